@@ -1,10 +1,27 @@
+import argparse
+import sys
+
 import uvicorn
 
 from lab_gen.settings import settings
+from lab_gen.startup_profile import profile_startup
 
 
 def main() -> None:
     """Entrypoint of the application."""
+    parser = argparse.ArgumentParser(prog="lab_gen")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="report the slowest imports made when a worker starts, instead of starting the server",
+    )
+    parser.add_argument("--limit", type=int, default=25, help="the number of modules in the startup report")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        sys.stdout.write(profile_startup(args.limit) + "\n")
+        return
+
     uvicorn.run(
         "lab_gen.web.application:get_app",
         workers=settings.workers_count,
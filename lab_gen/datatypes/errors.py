@@ -40,3 +40,87 @@ class ModelKeyError(ValueError):
             param (str): The invalid model key that caused the error.
         """
         super().__init__(f"Invalid model key {param}")
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raises an error when calls to a model are failing fast because its circuit is open.
+
+    Args:
+        model_key (str): The key of the model whose circuit is open.
+        retry_after (float): The seconds until a call may be tried again.
+    """
+
+    def __init__(self, model_key: str, retry_after: float) -> None:
+        """
+        Initialize the CircuitOpenError for the given model.
+
+        Args:
+            model_key (str): The key of the model whose circuit is open.
+            retry_after (float): The seconds until a call may be tried again.
+        """
+        super().__init__(f"Model {model_key} is unavailable")
+        self.model_key = model_key
+        self.retry_after = max(retry_after, 0)
+
+
+class FailoverError(RuntimeError):
+    """
+    Raises an error when a model could not answer and the request should move to the next model in its chain.
+
+    The error from the model is kept as the cause.
+
+    Args:
+        model_key (str): The key of the model that could not answer.
+    """
+
+    def __init__(self, model_key: str) -> None:
+        """
+        Initialize the FailoverError for the given model.
+
+        Args:
+            model_key (str): The key of the model that could not answer.
+        """
+        super().__init__(f"Model {model_key} is unavailable")
+        self.model_key = model_key
+
+
+class RateLimitedError(RuntimeError):
+    """
+    Raises an error when a request is shed because a deployment's requests or tokens per minute quota is used up.
+
+    Args:
+        deployment (str): The name of the deployment.
+        retry_after (float): The seconds until the quota allows the request.
+    """
+
+    def __init__(self, deployment: str, retry_after: float) -> None:
+        """
+        Initialize the RateLimitedError for the given deployment.
+
+        Args:
+            deployment (str): The name of the deployment.
+            retry_after (float): The seconds until the quota allows the request.
+        """
+        super().__init__(f"Rate limit reached for {deployment}, retry after {retry_after:.0f}s")
+        self.deployment = deployment
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimitError(RuntimeError):
+    """
+    Raises an error when a request is rejected because a provider has too many requests in flight and queued.
+
+    Args:
+        provider (str): The provider at its limit.
+    """
+
+    def __init__(self, provider: str) -> None:
+        """
+        Initialize the ConcurrencyLimitError for the given provider.
+
+        Args:
+            provider (str): The provider at its limit.
+        """
+        super().__init__(f"Too many requests in flight to {provider}")
+        self.provider = provider
@@ -20,6 +20,9 @@ class ConversationMetadata(BaseModel):
     - family (ModelFamily): The model family used for the conversation.
     - modelKey (str): The model key used with the conversation.
     - business_user (str): Business user associated with the conversation.
+    - summary (str | None): A summary of the earlier turns, when the summary memory is in use.
+    - summarised_messages (int): The number of leading messages the summary covers.
+    - history_tokens (int): The running total of tokens in the stored messages.
     """
 
     provider: ModelProvider
@@ -27,3 +30,6 @@ class ConversationMetadata(BaseModel):
     family: ModelFamily
     modelKey: str  # noqa: N815
     business_user: str
+    summary: str | None = None
+    summarised_messages: int = 0
+    history_tokens: int = 0
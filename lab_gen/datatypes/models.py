@@ -33,6 +33,14 @@ class ModelFamily(Enum):
     UNSPECIFIED = "UNSPECIFIED"
 
 
+class CircuitState(str, Enum):
+    """Represents the states of the circuit breaker around a model."""
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
 class Model(BaseModel):
     """
     Represents a model definition.
@@ -43,6 +51,10 @@ class Model(BaseModel):
         family (ModelFamily): The family of the model.
         description (str): The description of the model.
         location (str):  The geographic location where the model is running.
+        history_token_budget (int | None): The tokens of history to replay on each turn, None for the default.
+        fallbacks (list[str]): The keys of the models to move to, in order, when this model is unavailable.
+        rpm (int | None): The requests per minute quota of the deployment, None if it is not limited.
+        tpm (int | None): The tokens per minute quota of the deployment, None if it is not limited.
     """
 
     provider: ModelProvider
@@ -52,6 +64,10 @@ class Model(BaseModel):
     location: str
     identifier: str = Field(exclude=True)
     config: dict[str, str] = Field(exclude=True)
+    history_token_budget: int | None = Field(default=None, exclude=True)
+    fallbacks: list[str] = Field(default=[], exclude=True)
+    rpm: int | None = Field(default=None, exclude=True)
+    tpm: int | None = Field(default=None, exclude=True)
 
     @staticmethod
     def compute_key(provider: ModelProvider, variant: ModelVariant, family: ModelFamily) -> str:
@@ -79,6 +95,17 @@ class Model(BaseModel):
         return Model.compute_key(self.provider, self.variant, self.family)
 
 
+class ModelStatus(Model):
+    """
+    Represents a model definition along with the state of its circuit breaker.
+
+    Attributes:
+        circuit (CircuitState): The state of the circuit breaker around the model.
+    """
+
+    circuit: CircuitState = CircuitState.CLOSED
+
+
 class AzureModelConfig(BaseModel):
     """Represents an Azure model config."""
 
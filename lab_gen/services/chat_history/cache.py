@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, NamedTuple
+
+
+if TYPE_CHECKING:
+    from langchain_core.chat_history import BaseChatMessageHistory
+
+
+class CacheEntry(NamedTuple):
+    """A cached history, when it expires and its estimated size in bytes."""
+
+    history: BaseChatMessageHistory
+    expires_at: float
+    size: int
+
+
+def estimate_size(history: BaseChatMessageHistory) -> int:
+    """
+    Estimate the memory held by a history from the length of its message contents.
+
+    Args:
+        history (BaseChatMessageHistory): The history to measure.
+
+    Returns:
+        int: The estimated size in bytes.
+    """
+    return sum(len(str(message.content)) for message in history.messages)
+
+
+class HistoryCache:
+    """A bounded LRU cache of loaded conversation histories, keyed by user and conversation.
+
+    Entries expire after `ttl` seconds, and the least recently used entries are evicted once there are more than
+    `max_entries` or their estimated size passes `max_bytes`. The cache is per process and another worker may have
+    written a conversation since it was cached, so a hit has to be checked against the version in the store before it
+    is used.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache holds any entries at all."""
+        return self.max_entries > 0
+
+    @staticmethod
+    def _key(user_id: str, conversation_id: str) -> tuple[str, str]:
+        return user_id.lower(), conversation_id
+
+    def _remove(self, key: tuple[str, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def get(self, user_id: str, conversation_id: str) -> BaseChatMessageHistory | None:
+        """
+        Look up a history, counting the hit or miss.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            BaseChatMessageHistory | None: The cached history, or None if it is not cached or has expired.
+        """
+        if not self.enabled:
+            return None
+        key = self._key(user_id, conversation_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.history
+
+    def put(self, user_id: str, conversation_id: str, history: BaseChatMessageHistory) -> None:
+        """
+        Add or refresh a history, evicting the least recently used entries to stay within the limits.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            history (BaseChatMessageHistory): The loaded history.
+        """
+        if not self.enabled:
+            return
+        key = self._key(user_id, conversation_id)
+        size = estimate_size(history)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = CacheEntry(history, time.monotonic() + self.ttl, size)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str, conversation_id: str) -> None:
+        """
+        Remove a history from the cache.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+        """
+        with self._lock:
+            self._remove(self._key(user_id, conversation_id))
+
+    def stats(self) -> dict[str, int]:
+        """The cache counters and current usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
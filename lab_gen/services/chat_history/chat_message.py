@@ -1,15 +1,50 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 from lab_gen.datatypes.errors import InvalidParamsError, NoConversationError
 from lab_gen.datatypes.messages import MESSAGE_TYPE_AI
+from lab_gen.services.chat_history.compression import encode_messages
 
 
 if TYPE_CHECKING:
+        from collections.abc import Sequence
+
         from langchain_core.messages import BaseMessage
 
 
+# The most operations Cosmos DB accepts in a single patch request
+MAX_PATCH_OPERATIONS = 10
+# Reads only the version of a stored conversation, to check a cached copy without reading its messages
+ETAG_QUERY = "SELECT VALUE c._etag FROM c WHERE c.id = @id"
+
+
+def etag_parameters(session_id: str) -> list[dict[str, str]]:
+        """
+        Build the parameters of `ETAG_QUERY` for a conversation.
+
+        Args:
+            session_id (str): The ID of the conversation.
+
+        Returns:
+            list[dict[str, str]]: The query parameters.
+        """
+        return [{"name": "@id", "value": session_id}]
+
+
+def item_etag(item: dict[str, Any] | None) -> str | None:
+        """
+        Get the version of a Cosmos item, as returned by a read or a write.
+
+        Args:
+            item (dict[str, Any] | None): The item.
+
+        Returns:
+            str | None: The item's `_etag`, or None if there is no item.
+        """
+        return item.get("_etag") if item else None
+
+
 def calculate_messages(messages: list[BaseMessage], num_entries: int) -> list[BaseMessage]:
         """
         Calculate the messages to delete based on the given criteria.
@@ -49,3 +84,25 @@ def calculate_messages(messages: list[BaseMessage], num_entries: int) -> list[Ba
             messages = messages[:-total_entries_to_delete]
 
         return messages
+
+
+def append_operations(messages: Sequence[BaseMessage], metadata: dict | None = None) -> list[list[dict]]:
+        """
+        Build the Cosmos patch operations that append messages to a stored conversation.
+
+        Cosmos accepts at most `MAX_PATCH_OPERATIONS` operations in one patch, so they are returned in batches.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to append.
+            metadata (dict | None): The metadata to set as well, or None to leave it unchanged.
+
+        Returns:
+            list[list[dict]]: The batches of patch operations, one patch call per batch.
+        """
+        operations = [{"op": "set", "path": "/metadata", "value": metadata}] if metadata is not None else []
+        operations.extend(
+            {"op": "add", "path": "/messages/-", "value": message} for message in encode_messages(messages)
+        )
+        return [
+            operations[i:i + MAX_PATCH_OPERATIONS] for i in range(0, len(operations), MAX_PATCH_OPERATIONS)
+        ]
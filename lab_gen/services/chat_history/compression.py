@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+
+from typing import TYPE_CHECKING, Any
+
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from loguru import logger
+
+from lab_gen.settings import HistoryCompression, settings
+
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+    if settings.history_compression == HistoryCompression.ZSTD:
+        logger.warning("zstandard is not installed, compressing chat history with gzip instead")
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    from langchain_core.messages import BaseMessage
+
+
+ENCODING_KEY = "encoding"
+DATA_KEY = "data"
+
+
+def _compression() -> HistoryCompression:
+    """The configured compression, falling back to gzip if zstandard is not installed."""
+    if settings.history_compression == HistoryCompression.ZSTD and zstandard is None:
+        return HistoryCompression.GZIP
+    return settings.history_compression
+
+
+def compress(data: bytes, encoding: HistoryCompression) -> bytes:
+    """
+    Compress data with the given encoding.
+
+    Args:
+        data (bytes): The data to compress.
+        encoding (HistoryCompression): The compression to use.
+
+    Returns:
+        bytes: The compressed data.
+    """
+    if encoding == HistoryCompression.ZSTD:
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data: bytes, encoding: str) -> bytes:
+    """
+    Decompress data written by `compress`.
+
+    Args:
+        data (bytes): The compressed data.
+        encoding (str): The compression that was used.
+
+    Returns:
+        bytes: The original data.
+    """
+    if encoding == HistoryCompression.ZSTD:
+        if zstandard is None:
+            msg = "zstandard is required to read chat history compressed with zstd"
+            raise RuntimeError(msg)
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def encode_message(message: dict[str, Any]) -> dict[str, Any]:
+    """
+    Encode a message dict for storage, compressing it if it is large enough.
+
+    A compressed message is stored as ``{"encoding": ..., "data": <base64>}`` so that it can be told apart from a
+    plain message dict on load.
+
+    Args:
+        message (dict[str, Any]): The message, as created by `messages_to_dict`.
+
+    Returns:
+        dict[str, Any]: The message to store.
+    """
+    encoding = _compression()
+    if encoding == HistoryCompression.NONE:
+        return message
+    data = json.dumps(message, separators=(",", ":")).encode()
+    if len(data) < settings.history_compression_min_bytes:
+        return message
+    return {ENCODING_KEY: encoding.value, DATA_KEY: base64.b64encode(compress(data, encoding)).decode()}
+
+
+def decode_message(stored: dict[str, Any]) -> dict[str, Any]:
+    """
+    Decode a stored message back to a message dict, whether or not it was compressed.
+
+    Args:
+        stored (dict[str, Any]): The stored message.
+
+    Returns:
+        dict[str, Any]: The message dict.
+    """
+    if ENCODING_KEY not in stored:
+        return stored
+    return json.loads(decompress(base64.b64decode(stored[DATA_KEY]), stored[ENCODING_KEY]))
+
+
+def encode_messages(messages: Sequence[BaseMessage]) -> list[dict[str, Any]]:
+    """
+    Convert messages to dicts for storage, compressing the large ones.
+
+    Args:
+        messages (Sequence[BaseMessage]): The messages to store.
+
+    Returns:
+        list[dict[str, Any]]: The messages to store.
+    """
+    return [encode_message(message) for message in messages_to_dict(messages)]
+
+
+def decode_messages(stored: Iterable[dict[str, Any]]) -> list[BaseMessage]:
+    """
+    Convert stored messages back to messages, decompressing any that were compressed.
+
+    Args:
+        stored (Iterable[dict[str, Any]]): The stored messages.
+
+    Returns:
+        list[BaseMessage]: The messages.
+    """
+    return messages_from_dict([decode_message(message) for message in stored])
@@ -2,27 +2,30 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from azure.cosmos.exceptions import CosmosHttpResponseError
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import (
-    BaseMessage,
-    messages_from_dict,
-    messages_to_dict,
-)
 from loguru import logger
 
 from lab_gen.datatypes.errors import InvalidParamsError
 from lab_gen.datatypes.metadata import ConversationMetadata
 from lab_gen.services.chat_history import chat_message
+from lab_gen.services.chat_history.compression import decode_messages, encode_messages
 from lab_gen.services.chat_history.lifetime import CONTAINER_NAME, DATABASE_NAME
 
 
 if TYPE_CHECKING:
-    from azure.cosmos import CosmosClient
+    from collections.abc import Sequence
+
+    from azure.cosmos import ContainerProxy, CosmosClient
+    from langchain_core.messages import BaseMessage
 
 
 class CosmosDBChatMessageHistory(BaseChatMessageHistory):
-    """Chat message history backed by Azure CosmosDB."""
+    """Chat message history backed by Azure CosmosDB.
+
+    New messages are appended to a stored conversation with patch operations, so only they are sent. The whole item
+    is only written when the conversation is created or when messages are deleted.
+    """
 
     def __init__(
         self,
@@ -30,20 +33,61 @@ class CosmosDBChatMessageHistory(BaseChatMessageHistory):
         session_id: str,
         user_id: str,
         metadata: ConversationMetadata,
+        *,
+        load: bool = True,
     ) -> None:
-        """Initializes a new instance of the CosmosDBChatMessageHistory class."""
+        """Initializes a new instance of the CosmosDBChatMessageHistory class, loading its messages if `load` is set."""
         self._client = cosmos_client
         self.session_id = session_id
         self.user_id = user_id.lower()
         self.metadata = metadata
         self.messages: list[BaseMessage] = []
+        self._loaded = False
+        self._exists = False
+        self._stored_metadata: dict | None = None
+        self.version: str | None = None
+        self._container: ContainerProxy | None = None
 
         if (cosmos_client):
             database = cosmos_client.get_database_client(DATABASE_NAME)
             self._container = database.get_container_client(CONTAINER_NAME)
-            self.load_messages()
+            if load:
+                self.load_messages()
+
+    def _set_item(self, item: dict | None) -> list[BaseMessage]:
+        """Take the messages and metadata from the stored item, or None if there is no item."""
+        self._loaded = True
+        self.version = chat_message.item_etag(item)
+        if item is None:
+            logger.debug(f"No conversation found for {self.session_id}")
+            return self.messages
+        self._exists = True
+        if "messages" in item and len(item["messages"]) > 0:
+            self.messages = decode_messages(item["messages"])
+        if "metadata" in item:
+            self.metadata = ConversationMetadata.model_validate(item["metadata"])
+            self._stored_metadata = item["metadata"]
+        return self.messages
+
+    def _item(self) -> dict:
+        """Build the whole item, recording its metadata as stored."""
+        metadata = self.metadata.model_dump(mode="json")
+        self._exists = True
+        self._stored_metadata = metadata
+        return {
+            "id": self.session_id,
+            "user_id": self.user_id,
+            "metadata": metadata,
+            "messages": encode_messages(self.messages),
+        }
 
-    def load_messages(self) -> None:
+    def _append_operations(self, messages: Sequence[BaseMessage]) -> tuple[dict, list[list[dict]]]:
+        """Build the patches that append the messages, with the metadata if it has changed since it was stored."""
+        metadata = self.metadata.model_dump(mode="json")
+        changed = None if metadata == self._stored_metadata else metadata
+        return metadata, chat_message.append_operations(messages, changed)
+
+    def load_messages(self) -> list[BaseMessage]:
         """Retrieve the messages from Cosmos."""
         if not self._container:
             msg = "Container not initialized"
@@ -53,16 +97,49 @@ class CosmosDBChatMessageHistory(BaseChatMessageHistory):
                 item=self.session_id, partition_key=self.user_id,
             )
         except CosmosHttpResponseError:
-            logger.debug(f"No conversation found for {self.session_id}")
-            return
-        if "messages" in item and len(item["messages"]) > 0:
-            self.messages = messages_from_dict(item["messages"])
-        if "metadata" in item:
-            self.metadata = ConversationMetadata.model_validate(item["metadata"])
+            item = None
+        return self._set_item(item)
 
     def add_message(self, message: BaseMessage) -> None:
         """Add a self-created message to the store."""
-        self.messages.append(message)
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages to the store, appending them to the item or creating it on the first write."""
+        if not self._loaded:
+            self.load_messages()
+        self.messages.extend(messages)
+        if self._exists:
+            try:
+                self.patch_messages(messages)
+            except CosmosResourceNotFoundError:
+                logger.debug(f"Conversation {self.session_id} no longer exists, recreating it")
+            else:
+                return
+        self.upsert_messages()
+
+    def patch_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the cosmosdb item, setting the metadata too if it has changed."""
+        if not self._container:
+            msg = "Container not initialized"
+            raise ValueError(msg)
+        metadata, patches = self._append_operations(messages)
+        for operations in patches:
+            item = self._container.patch_item(
+                item=self.session_id, partition_key=self.user_id, patch_operations=operations,
+            )
+            self.version = chat_message.item_etag(item)
+        self._stored_metadata = metadata
+
+    def save_metadata(self) -> None:
+        """Set the metadata on the cosmosdb item, creating it if it does not exist."""
+        if self._exists:
+            try:
+                self.patch_messages([])
+            except CosmosResourceNotFoundError:
+                logger.debug(f"Conversation {self.session_id} no longer exists, recreating it")
+            else:
+                return
         self.upsert_messages()
 
     def upsert_messages(self) -> None:
@@ -70,18 +147,23 @@ class CosmosDBChatMessageHistory(BaseChatMessageHistory):
         if not self._container:
             msg = "Container not initialized"
             raise ValueError(msg)
-        self._container.upsert_item(
-            body={
-                "id": self.session_id,
-                "user_id": self.user_id,
-                "metadata": self.metadata.model_dump(mode="json"),
-                "messages": messages_to_dict(self.messages),
-            },
-        )
+        item = self._container.upsert_item(body=self._item())
+        self.version = chat_message.item_etag(item)
+
+    def stored_version(self) -> str | None:
+        """Read the `_etag` of the stored conversation, or None if it does not exist, without reading its messages."""
+        etags = list(self._container.query_items(
+            chat_message.ETAG_QUERY,
+            parameters=chat_message.etag_parameters(self.session_id),
+            partition_key=self.user_id,
+        ))
+        return etags[0] if etags else None
 
     def clear(self) -> None:
         """Clear session memory from this memory and cosmos."""
         self.messages = []
+        self._exists = False
+        self.version = None
         if self._container:
             logger.debug(f"Deleting conversation {self.session_id}")
             self._container.delete_item(
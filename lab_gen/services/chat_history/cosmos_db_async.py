@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosResourceNotFoundError
+from loguru import logger
+
+from lab_gen.datatypes.errors import InvalidParamsError
+from lab_gen.services.chat_history import chat_message
+from lab_gen.services.chat_history.cosmos_db import CosmosDBChatMessageHistory
+from lab_gen.services.chat_history.lifetime import CONTAINER_NAME, DATABASE_NAME
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from azure.cosmos import CosmosClient as SyncCosmosClient
+    from azure.cosmos.aio import CosmosClient
+    from langchain_core.messages import BaseMessage
+
+    from lab_gen.datatypes.metadata import ConversationMetadata
+
+
+class AsyncCosmosDBChatMessageHistory(CosmosDBChatMessageHistory):
+    """Chat message history backed by Azure CosmosDB, using the asyncio client.
+
+    Nothing is read on construction, the messages are loaded by the first call to `aget_messages` or `aload_messages`.
+    The service only uses the async API, so that history I/O never blocks the event loop. The sync API is inherited
+    from `CosmosDBChatMessageHistory` and uses the sync client, for LangChain callers that cannot await.
+    """
+
+    def __init__(
+        self,
+        cosmos_client: CosmosClient,
+        session_id: str,
+        user_id: str,
+        metadata: ConversationMetadata,
+        sync_client: SyncCosmosClient,
+    ) -> None:
+        """Initializes a new instance of the AsyncCosmosDBChatMessageHistory class."""
+        super().__init__(sync_client, session_id, user_id, metadata, load=False)
+        database = cosmos_client.get_database_client(DATABASE_NAME)
+        self._async_container = database.get_container_client(CONTAINER_NAME)
+
+    async def aload_messages(self) -> list[BaseMessage]:
+        """Retrieve the messages from Cosmos."""
+        try:
+            item = await self._async_container.read_item(
+                item=self.session_id, partition_key=self.user_id,
+            )
+        except CosmosHttpResponseError:
+            item = None
+        return self._set_item(item)
+
+    async def aget_messages(self) -> list[BaseMessage]:
+        """Return the messages, loading them from Cosmos on first use."""
+        if not self._loaded:
+            await self.aload_messages()
+        return self.messages
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages to the store, appending them to the item or creating it on the first write."""
+        if not self._loaded:
+            await self.aload_messages()
+        self.messages.extend(messages)
+        if self._exists:
+            try:
+                await self.apatch_messages(messages)
+            except CosmosResourceNotFoundError:
+                logger.debug(f"Conversation {self.session_id} no longer exists, recreating it")
+            else:
+                return
+        await self.aupsert_messages()
+
+    async def apatch_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages to the cosmosdb item, setting the metadata too if it has changed."""
+        metadata, patches = self._append_operations(messages)
+        for operations in patches:
+            item = await self._async_container.patch_item(
+                item=self.session_id, partition_key=self.user_id, patch_operations=operations,
+            )
+            self.version = chat_message.item_etag(item)
+        self._stored_metadata = metadata
+
+    async def asave_metadata(self) -> None:
+        """Set the metadata on the cosmosdb item, creating it if it does not exist."""
+        if self._exists:
+            try:
+                await self.apatch_messages([])
+            except CosmosResourceNotFoundError:
+                logger.debug(f"Conversation {self.session_id} no longer exists, recreating it")
+            else:
+                return
+        await self.aupsert_messages()
+
+    async def aupsert_messages(self) -> None:
+        """Update the cosmosdb item."""
+        item = await self._async_container.upsert_item(body=self._item())
+        self.version = chat_message.item_etag(item)
+
+    async def astored_version(self) -> str | None:
+        """Read the `_etag` of the stored conversation, or None if it does not exist, without reading its messages."""
+        etags = [
+            etag async for etag in self._async_container.query_items(
+                chat_message.ETAG_QUERY,
+                parameters=chat_message.etag_parameters(self.session_id),
+                partition_key=self.user_id,
+            )
+        ]
+        return etags[0] if etags else None
+
+    async def aclear(self) -> None:
+        """Clear session memory from this memory and cosmos."""
+        self.messages = []
+        self._exists = False
+        self.version = None
+        logger.debug(f"Deleting conversation {self.session_id}")
+        await self._async_container.delete_item(
+            item=self.session_id, partition_key=self.user_id,
+        )
+
+    async def adelete(self, num_entries: int) -> None:
+        """Delete a message from the memory."""
+        if not self._loaded:
+            msg = "Conversation not loaded"
+            raise InvalidParamsError(msg)
+
+        logger.debug(f"Deleting {num_entries} entry pairs from conversation {self.session_id}")
+        message_length = len(self.messages)
+        self.messages = chat_message.calculate_messages(self.messages, num_entries)
+        if len(self.messages) != message_length:
+            await self.aupsert_messages()
@@ -3,20 +3,23 @@ from __future__ import annotations
 import json
 
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import (
-    BaseMessage,
-    messages_from_dict,
-    messages_to_dict,
-)
 from loguru import logger
 
 from lab_gen.datatypes.metadata import ConversationMetadata
 from lab_gen.services.chat_history import chat_message
+from lab_gen.services.chat_history.compression import decode_messages, encode_messages
 from lab_gen.settings import settings
 
 
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from langchain_core.messages import BaseMessage
+
+
 class FileChatHistory(BaseChatMessageHistory):
     """File-based storage."""
 
@@ -37,6 +40,7 @@ class FileChatHistory(BaseChatMessageHistory):
         self.user_id = user_id
         self.metadata = metadata
         self.messages = []  # Initialize a basemessage list for compatibility
+        self.version: tuple[int, int] | None = None
 
         # Determine if the provided file path is a directory or a full path
         path_obj = settings.chat_history_dir
@@ -52,8 +56,12 @@ class FileChatHistory(BaseChatMessageHistory):
 
     def add_message(self, message: BaseMessage) -> None:
         """Add a message to the history and save it to the file."""
-        self.messages.append(message)  # Add to in-memory list.
-        self.upsert_messages()  # Save message to file
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages to the history and save them to the file in a single write."""
+        self.messages.extend(messages)  # Add to in-memory list.
+        self.upsert_messages()  # Save messages to file
 
     def upsert_messages(self) -> None:
         """Save or update the chat history and metadata in the file."""
@@ -66,20 +74,35 @@ class FileChatHistory(BaseChatMessageHistory):
             "id": self.session_id,
             "user_id": self.user_id,
             "metadata": self.metadata.model_dump(mode="json") if self.metadata else {},
-            "messages": messages_to_dict(self.messages),
+            "messages": encode_messages(self.messages),
         }
         # Save or update the file with the data
         try:
             with Path.open(self.file_path, "w") as f:
                 json.dump(data, f, indent=4)  # Use json.dump to write data in a readable format
+            self.version = self.stored_version()
             logger.debug(f"Chat history and metadata updated for session {self.session_id}")
         except OSError as e:
             logger.error(f"Failed to write data to file: {e}")
             raise
 
+    def save_metadata(self) -> None:
+        """Save the metadata, which rewrites the file."""
+        self.upsert_messages()
+
+    def stored_version(self) -> tuple[int, int] | None:
+        """The modification time and size of the file, or None if it does not exist."""
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
     def load_messages(self) -> list[BaseMessage]:
         """Load messages, metadata, and IDs from the file."""
         self.messages = []  # Initialize an empty list for messages
+        # Taken before reading, so a write in between is seen as a newer version
+        self.version = self.stored_version()
 
         if not self.file_path.exists():
             return self.messages
@@ -88,7 +111,7 @@ class FileChatHistory(BaseChatMessageHistory):
             with Path.open(self.file_path) as f:
                 data = json.load(f)
                 if "messages" in data:
-                    self.messages = messages_from_dict(data["messages"])
+                    self.messages = decode_messages(data["messages"])
                 if "metadata" in data:
                     self.metadata = ConversationMetadata.model_validate(data["metadata"])
 
@@ -113,6 +136,7 @@ class FileChatHistory(BaseChatMessageHistory):
     def clear(self) -> None:
         """Clear messages from the history and delete the file."""
         self.messages.clear()
+        self.version = None
         try:
             # Delete the file if it exists
             if self.file_path.exists():
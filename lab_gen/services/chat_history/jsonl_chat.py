@@ -0,0 +1,202 @@
+from __future__ import annotations
+
+import json
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from loguru import logger
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.services.chat_history import chat_message
+from lab_gen.services.chat_history.compression import decode_messages, encode_messages
+from lab_gen.settings import settings
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from langchain_core.messages import BaseMessage
+
+
+RECORD_HEADER = "header"
+RECORD_MESSAGE = "message"
+RECORD_TRUNCATE = "truncate"
+
+
+class JsonlChatHistory(BaseChatMessageHistory):
+    """Append-only file storage, one compact JSON record per line.
+
+    The log holds three kinds of record:
+
+    - ``header``: the conversation ids and metadata, the latest header wins.
+    - ``message``: a single message, in the order it was added.
+    - ``truncate``: the number of messages still live after a delete.
+
+    Adding a message appends a single line, so the cost of a write does not depend on the length of the conversation.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        user_id: str,
+        metadata: ConversationMetadata,
+    ) -> None:
+        """Initialize JsonlChatHistory with session details and file path.
+
+        Args:
+            session_id: Unique identifier for the conversation.
+            user_id: Identifier for the user involved in the conversation.
+            metadata: Metadata associated with the conversation.
+        """
+        self.session_id = session_id
+        self.user_id = user_id
+        self.metadata = metadata
+        self.messages = []
+        self.file_path = settings.chat_history_dir / f"{session_id}.jsonl"
+        # The metadata as last written to the log, used to decide when a new header is needed.
+        self._written_metadata: dict[str, Any] | None = None
+        # Number of records in the log that no longer contribute to the conversation.
+        self._dead_records = 0
+        self.version: tuple[int, int] | None = None
+
+        self.load_messages()
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        logger.debug(
+            f"JsonlChatHistory in use for session {session_id} with user {user_id}. Messages saved to {self.file_path}",
+        )
+
+    def _metadata_dict(self) -> dict[str, Any]:
+        return self.metadata.model_dump(mode="json") if self.metadata else {}
+
+    def _header_record(self) -> dict[str, Any]:
+        return {
+            "record": RECORD_HEADER,
+            "id": self.session_id,
+            "user_id": self.user_id,
+            "metadata": self._metadata_dict(),
+        }
+
+    def _append_records(self, records: list[dict[str, Any]]) -> None:
+        """Append the records to the log, writing a new header first if the metadata has changed."""
+        metadata = self._metadata_dict()
+        if metadata != self._written_metadata:
+            records = [self._header_record(), *records]
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        try:
+            with Path.open(self.file_path, "a") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.error(f"Failed to append data to file: {e}")
+            raise
+        self._written_metadata = metadata
+        self.version = self.stored_version()
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Add a message to the history and append it to the file."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages to the history and append them to the file in a single write."""
+        self.messages.extend(messages)
+        self._append_records([{"record": RECORD_MESSAGE, "message": m} for m in encode_messages(messages)])
+        logger.debug(f"Appended {len(messages)} messages for session {self.session_id}")
+
+    def save_metadata(self) -> None:
+        """Append a new header if the metadata has changed."""
+        self._append_records([])
+
+    def stored_version(self) -> tuple[int, int] | None:
+        """The modification time and size of the log, or None if it does not exist."""
+        try:
+            stat = self.file_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load_messages(self) -> list[BaseMessage]:
+        """Replay the log in a single pass to rebuild the messages and metadata."""
+        self.messages = []
+        self._written_metadata = None
+        self._dead_records = 0
+        # Taken before reading, so an append in between is seen as a newer version
+        self.version = self.stored_version()
+
+        if not self.file_path.exists():
+            return self.messages
+
+        message_dicts: list[dict[str, Any]] = []
+        try:
+            with Path.open(self.file_path) as f:
+                for line_number, line in enumerate(f, start=1):
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written line, most likely the tail of an interrupted append.
+                        logger.warning(f"Skipping malformed record {line_number} in {self.file_path}")
+                        continue
+                    match record.get("record"):
+                        case "header":
+                            self._written_metadata = record.get("metadata", {})
+                        case "message":
+                            message_dicts.append(record["message"])
+                        case "truncate":
+                            self._dead_records += len(message_dicts) - record["length"] + 1
+                            del message_dicts[record["length"]:]
+            self.messages = decode_messages(message_dicts)
+            if self._written_metadata:
+                self.metadata = ConversationMetadata.model_validate(self._written_metadata)
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Error loading messages: {e}")
+
+        return self.messages
+
+    def compact(self) -> None:
+        """Rewrite the log with only the live records, replacing the old file in one step."""
+        records = [self._header_record()]
+        records.extend({"record": RECORD_MESSAGE, "message": m} for m in encode_messages(self.messages))
+        temp_path = self.file_path.with_suffix(".jsonl.tmp")
+        try:
+            with Path.open(temp_path, "w") as f:
+                f.writelines(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+            temp_path.replace(self.file_path)
+        except OSError as e:
+            logger.error(f"Failed to compact chat file: {e}")
+            raise
+        self._written_metadata = self._metadata_dict()
+        self._dead_records = 0
+        self.version = self.stored_version()
+
+    def delete(self, num_entries: int) -> None:
+        """Delete a specific number of message entry pairs by appending a truncation marker."""
+        if not self.file_path.exists():
+            raise ValueError("File not exist")  # noqa: EM101, TRY003
+
+        logger.debug(f"Deleting {num_entries} entry pairs from conversation {self.session_id}")
+        message_length = len(self.messages)
+        self.messages = chat_message.calculate_messages(self.messages, num_entries)
+        if len(self.messages) == message_length:
+            return
+
+        self._dead_records += message_length - len(self.messages) + 1
+        if self._dead_records > len(self.messages):
+            # Most of the log is no longer live, so rewrite it rather than growing it further.
+            self.compact()
+        else:
+            self._append_records([{"record": RECORD_TRUNCATE, "length": len(self.messages)}])
+
+    def clear(self) -> None:
+        """Clear messages from the history and delete the file."""
+        self.messages.clear()
+        self._written_metadata = None
+        self._dead_records = 0
+        self.version = None
+        try:
+            if self.file_path.exists():
+                self.file_path.unlink()
+            else:
+                logger.warning(f"Chat history file not found for session {self.session_id}, nothing to delete.")
+        except OSError as e:
+            logger.error(f"Failed to delete chat file: {e}")
+            raise
@@ -1,8 +1,10 @@
 from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 from fastapi import FastAPI
 from loguru import logger
 
-from lab_gen.settings import settings
+from lab_gen.services.chat_history.sqlite_chat import expire_conversations
+from lab_gen.settings import ChatHistoryStore, settings
 
 
 DATABASE_NAME = "gen-app-data-" + settings.environment.lower()
@@ -13,6 +15,12 @@ def init_cosmosdb(app: FastAPI) -> None:
     """
     Initializes the CosmosDB client and creates the necessary database and container if they do not already exist.
 
+    If CosmosDB cannot be used the local store set by `chat_history_store` is used instead, and for SQLite the
+    conversations older than `session_store_ttl` are expired.
+
+    An asyncio client is also created once here and shared by every conversation, so that history reads and writes
+    do not block the event loop.
+
     Args:
         app (FastAPI): The FastAPI application object.
 
@@ -29,7 +37,26 @@ def init_cosmosdb(app: FastAPI) -> None:
         )
         logger.info("CosmosDB initialized successfully."+settings.session_store_uri)
         app.state.cosmos_client = client
+        app.state.cosmos_async_client = AsyncCosmosClient(
+            settings.session_store_uri, credential=settings.session_store_key,
+        )
     except Exception as e:  # noqa: BLE001
         logger.error(f"Error in initializing CosmosDB client: {e}")
         client = None
-        logger.info("CosmosDB failed to started, will attempt to use a FileChatHistory instead.")
+        logger.info(f"CosmosDB failed to started, will attempt to use the {settings.chat_history_store.value} store.")
+        if settings.chat_history_store == ChatHistoryStore.SQLITE:
+            expire_conversations(settings.session_store_ttl)
+
+
+async def close_cosmosdb(app: FastAPI) -> None:
+    """
+    Closes the asyncio CosmosDB client, if one was created.
+
+    Args:
+        app (FastAPI): The FastAPI application object.
+
+    Returns:
+        None
+    """
+    if hasattr(app.state, "cosmos_async_client"):
+        await app.state.cosmos_async_client.close()
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from loguru import logger
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.services.chat_history import chat_message
+from lab_gen.services.chat_history.compression import decode_messages, encode_messages
+from lab_gen.settings import settings
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+    from langchain_core.messages import BaseMessage
+
+
+DATABASE_FILE = "chat_history.sqlite3"
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    metadata TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, session_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (user_id, session_id, seq)
+) WITHOUT ROWID;
+"""
+
+SELECT_CONVERSATION = "SELECT metadata, updated_at FROM conversations WHERE user_id = ? AND session_id = ?"
+SELECT_UPDATED_AT = "SELECT updated_at FROM conversations WHERE user_id = ? AND session_id = ?"
+SELECT_MESSAGES = "SELECT message FROM messages WHERE user_id = ? AND session_id = ? ORDER BY seq"
+SELECT_NEXT_SEQ = "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE user_id = ? AND session_id = ?"
+UPSERT_CONVERSATION = """
+INSERT INTO conversations (user_id, session_id, metadata, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (user_id, session_id) DO UPDATE SET metadata = excluded.metadata, updated_at = excluded.updated_at
+"""
+INSERT_MESSAGE = "INSERT INTO messages (user_id, session_id, seq, message) VALUES (?, ?, ?, ?)"
+DELETE_MESSAGES_FROM = """
+DELETE FROM messages WHERE user_id = ? AND session_id = ? AND seq >= (
+    SELECT seq FROM messages WHERE user_id = ? AND session_id = ? ORDER BY seq LIMIT 1 OFFSET ?
+)
+"""
+DELETE_MESSAGES = "DELETE FROM messages WHERE user_id = ? AND session_id = ?"
+DELETE_CONVERSATION = "DELETE FROM conversations WHERE user_id = ? AND session_id = ?"
+DELETE_EXPIRED_MESSAGES = """
+DELETE FROM messages WHERE (user_id, session_id) IN (
+    SELECT user_id, session_id FROM conversations WHERE updated_at < ?
+)
+"""
+DELETE_EXPIRED_CONVERSATIONS = "DELETE FROM conversations WHERE updated_at < ?"
+
+_local = threading.local()
+
+
+def get_connection(path: Path) -> sqlite3.Connection:
+    """
+    Get the calling thread's connection to the database, opening it and creating the schema on first use.
+
+    Connections are kept per thread because sqlite3 connections cannot be shared between threads. Each one keeps a
+    cache of its prepared statements, so the fixed queries in this module are only compiled once per thread.
+
+    Args:
+        path (Path): The path of the database file.
+
+    Returns:
+        sqlite3.Connection: The connection for this thread.
+    """
+    connections: dict[Path, sqlite3.Connection] = _local.__dict__.setdefault("connections", {})
+    connection = connections.get(path)
+    if connection is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        connection.executescript(SCHEMA)
+        connections[path] = connection
+    return connection
+
+
+@contextmanager
+def transaction(connection: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """Run the statements in a write transaction, taking the lock up front so concurrent writers queue."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def expire_conversations(max_age: float) -> int:
+    """
+    Delete the conversations that have not been updated within the given age.
+
+    Args:
+        max_age (float): The age in seconds after which a conversation is deleted.
+
+    Returns:
+        int: The number of conversations deleted.
+    """
+    cutoff = time.time() - max_age
+    with transaction(get_connection(settings.chat_history_dir / DATABASE_FILE)) as connection:
+        connection.execute(DELETE_EXPIRED_MESSAGES, (cutoff,))
+        deleted = connection.execute(DELETE_EXPIRED_CONVERSATIONS, (cutoff,)).rowcount
+    logger.info(f"Expired {deleted} conversations from the SQLite chat history")
+    return deleted
+
+
+class SqliteChatHistory(BaseChatMessageHistory):
+    """SQLite storage in WAL mode, shared by every conversation and safe to use from several workers.
+
+    Each message is a row keyed by user, conversation and sequence number, so adding a turn inserts only its messages
+    and a conversation is read with one indexed range scan. The blocking calls are made from the threadpool by the
+    conversation service and the async methods of `BaseChatMessageHistory`.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        user_id: str,
+        metadata: ConversationMetadata,
+    ) -> None:
+        """Initialize SqliteChatHistory with session details and load the stored messages.
+
+        Args:
+            session_id: Unique identifier for the conversation.
+            user_id: Identifier for the user involved in the conversation.
+            metadata: Metadata associated with the conversation.
+        """
+        self.session_id = session_id
+        self.user_id = user_id.lower()
+        self.metadata = metadata
+        self.messages = []
+        self.db_path = settings.chat_history_dir / DATABASE_FILE
+        self.version: float | None = None
+
+        self.load_messages()
+        logger.debug(f"SqliteChatHistory in use for session {session_id} with user {user_id}.")
+
+    @property
+    def _key(self) -> tuple[str, str]:
+        return self.user_id, self.session_id
+
+    def _metadata_json(self) -> str | None:
+        return self.metadata.model_dump_json() if self.metadata else None
+
+    def load_messages(self) -> list[BaseMessage]:
+        """Load the metadata and messages of the conversation."""
+        connection = get_connection(self.db_path)
+        row = connection.execute(SELECT_CONVERSATION, self._key).fetchone()
+        if row is None:
+            self.messages = []
+            self.version = None
+            return self.messages
+        self.version = row[1]
+        if row[0]:
+            self.metadata = ConversationMetadata.model_validate_json(row[0])
+        rows = connection.execute(SELECT_MESSAGES, self._key).fetchall()
+        self.messages = decode_messages([json.loads(message) for (message,) in rows])
+        return self.messages
+
+    def stored_version(self) -> float | None:
+        """When the conversation was last written, or None if it is not stored."""
+        row = get_connection(self.db_path).execute(SELECT_UPDATED_AT, self._key).fetchone()
+        return None if row is None else row[0]
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Add a message to the history and insert it into the database."""
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages to the history and insert them in a single transaction."""
+        self.messages.extend(messages)
+        updated_at = time.time()
+        with transaction(get_connection(self.db_path)) as connection:
+            connection.execute(UPSERT_CONVERSATION, (*self._key, self._metadata_json(), updated_at))
+            (seq,) = connection.execute(SELECT_NEXT_SEQ, self._key).fetchone()
+            rows = [
+                (*self._key, seq + i, json.dumps(message, separators=(",", ":")))
+                for i, message in enumerate(encode_messages(messages))
+            ]
+            connection.executemany(INSERT_MESSAGE, rows)
+        self.version = updated_at
+        logger.debug(f"Inserted {len(messages)} messages for session {self.session_id}")
+
+    def save_metadata(self) -> None:
+        """Save the metadata of the conversation."""
+        updated_at = time.time()
+        with transaction(get_connection(self.db_path)) as connection:
+            connection.execute(UPSERT_CONVERSATION, (*self._key, self._metadata_json(), updated_at))
+        self.version = updated_at
+
+    def delete(self, num_entries: int) -> None:
+        """Delete a specific number of message entry pairs from the end of the conversation."""
+        logger.debug(f"Deleting {num_entries} entry pairs from conversation {self.session_id}")
+        message_length = len(self.messages)
+        self.messages = chat_message.calculate_messages(self.messages, num_entries)
+        if len(self.messages) == message_length:
+            return
+        updated_at = time.time()
+        with transaction(get_connection(self.db_path)) as connection:
+            connection.execute(DELETE_MESSAGES_FROM, (*self._key, *self._key, len(self.messages)))
+            connection.execute(UPSERT_CONVERSATION, (*self._key, self._metadata_json(), updated_at))
+        self.version = updated_at
+
+    def clear(self) -> None:
+        """Clear messages from the history and delete the conversation from the database."""
+        self.messages = []
+        self.version = None
+        with transaction(get_connection(self.db_path)) as connection:
+            connection.execute(DELETE_MESSAGES, self._key)
+            connection.execute(DELETE_CONVERSATION, self._key)
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from loguru import logger
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from langchain_core.messages import BaseMessage
+
+    from lab_gen.datatypes.metadata import ConversationMetadata
+
+
+class BatchedChatMessageHistory(BaseChatMessageHistory):
+    """Wraps a chat history, holding back the messages added during a turn until they are flushed.
+
+    `RunnableWithMessageHistory` adds the human and the ai message of a turn together, once the run has finished.
+    Holding them here means the wrapped history persists the whole turn with one write, at a time chosen by the caller.
+    """
+
+    def __init__(self, history: BaseChatMessageHistory) -> None:
+        self.history = history
+        self.pending: list[BaseMessage] = []
+
+    @property
+    def messages(self) -> list[BaseMessage]:  # type: ignore[override]
+        """The stored messages followed by any that have not been flushed yet."""
+        return [*self.history.messages, *self.pending]
+
+    @property
+    def metadata(self) -> ConversationMetadata:
+        """The metadata of the wrapped history."""
+        return self.history.metadata
+
+    @metadata.setter
+    def metadata(self, value: ConversationMetadata) -> None:
+        self.history.metadata = value
+
+    async def aget_messages(self) -> list[BaseMessage]:
+        """The stored messages followed by any that have not been flushed yet."""
+        return [*(await self.history.aget_messages()), *self.pending]
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Hold the messages until the next flush."""
+        self.pending.extend(messages)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Hold the messages until the next flush."""
+        self.pending.extend(messages)
+
+    def flush(self) -> None:
+        """Persist the held messages with a single write to the wrapped history."""
+        if self.pending:
+            messages, self.pending = self.pending, []
+            self.history.add_messages(messages)
+
+    async def aflush(self) -> None:
+        """Persist the held messages with a single write to the wrapped history."""
+        if self.pending:
+            messages, self.pending = self.pending, []
+            await self.history.aadd_messages(messages)
+
+    def clear(self) -> None:
+        """Drop the held messages and clear the wrapped history."""
+        self.pending = []
+        self.history.clear()
+
+    async def aclear(self) -> None:
+        """Drop the held messages and clear the wrapped history."""
+        self.pending = []
+        await self.history.aclear()
+
+
+class HistoryWriteBatch:
+    """Collects the histories used by one turn so their writes can be made after the response has been sent."""
+
+    def __init__(self) -> None:
+        self.histories: list[BatchedChatMessageHistory] = []
+        self.failed: list[BatchedChatMessageHistory] = []
+        # The history loaded off the event loop before the turn runs, for the chain to use rather than loading it
+        self.loaded: BaseChatMessageHistory | None = None
+
+    def track(self, history: BaseChatMessageHistory) -> BatchedChatMessageHistory:
+        """
+        Wrap the history so that its writes are held in this batch.
+
+        Args:
+            history (BaseChatMessageHistory): The history to wrap.
+
+        Returns:
+            BatchedChatMessageHistory: The wrapped history.
+        """
+        batched = BatchedChatMessageHistory(history)
+        self.histories.append(batched)
+        return batched
+
+    def add_unfinished_turn(self, messages: Sequence[BaseMessage]) -> bool:
+        """
+        Hold the messages of a turn that did not finish, in the conversation's history, if the turn added none itself.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages of the turn.
+
+        Returns:
+            bool: True if the messages are held, False if no history was loaded or the turn had finished.
+        """
+        if not self.histories or self.histories[0].pending:
+            return False
+        self.histories[0].add_messages(messages)
+        return True
+
+    async def aflush(self) -> None:
+        """Persist the messages held for every tracked history, recording those that could not be written."""
+        for history in self.histories:
+            try:
+                await history.aflush()
+            except Exception as e:  # noqa: BLE001
+                self.failed.append(history)
+                logger.error(f"Failed to write conversation history: {e}")
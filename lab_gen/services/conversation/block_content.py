@@ -1,10 +1,7 @@
-
-
 from typing import Any
 
 from langchain.callbacks.base import BaseCallbackHandler
-from langchain_core.language_models import BaseLanguageModel
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.outputs import LLMResult
 from openai import BadRequestError
 
 
@@ -12,36 +9,73 @@ AZURE_CONTENT_FILTER_REASON = "content_filter"
 BEDROCK_CONTENT_FILTER_REASON = "Your request was blocked due to content filtering. Please modify your prompt and retry." # noqa: E501
 
 
+def azure_blocked(response: LLMResult) -> bool:
+    """
+    Check whether Azure stopped a response with its content filter.
+
+    Args:
+        response (LLMResult): The response of the model.
+
+    Returns:
+        bool: True if the response finished because of the content filter.
+    """
+    generation_info = response.generations[0][0].generation_info or {}
+    return generation_info.get("finish_reason") == AZURE_CONTENT_FILTER_REASON
+
+
+def vertex_blocked(response: LLMResult) -> bool:
+    """
+    Check whether Vertex blocked a response for one of its safety ratings.
+
+    Args:
+        response (LLMResult): The response of the model.
+
+    Returns:
+        bool: True if any safety rating blocked the response.
+    """
+    generation_info = response.generations[0][0].generation_info or {}
+    safety_ratings = generation_info.get("safety_ratings") or []
+    return any(rating.get("blocked", False) for rating in safety_ratings if isinstance(rating, dict))
+
+
+def bedrock_blocked(response: LLMResult) -> bool:
+    """
+    Check whether a Bedrock guardrail replaced a response with its blocked message.
+
+    Args:
+        response (LLMResult): The response of the model.
+
+    Returns:
+        bool: True if the response is the guardrail's message.
+    """
+    return response.generations[0][0].text == BEDROCK_CONTENT_FILTER_REASON
+
+
 class BlockedContentTracker(BaseCallbackHandler):
-    """A callback handler that handles the blocked content instances in a conversation service."""
-    def __init__(self, llm: BaseLanguageModel) -> None:
-        """
-        Initialize the blocked content tracker.
+    """A callback handler that records whether a conversation's response was blocked by a content filter.
 
-        Parameters:
-            llm (BaseLanguageModel): The BaseLanguageModel instance to be used.
+    Each provider's signal is checked on every response, so the block is caught whichever model answers the turn,
+    including a fallback from another provider.
+    """
 
-        Returns:
-            None
-        """
-        self.llm = llm
+    def __init__(self) -> None:
+        """Initialize the blocked content tracker."""
         self.has_blocked = False
 
-class AzureBlockedContentTracker(BlockedContentTracker):
-    """A callback handler specific to Azure that handles the blocked content instances."""
-    def on_llm_end(self, response: RunnableWithMessageHistory, **kwargs: Any) -> None: # noqa: ARG002, ANN401
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None: # noqa: ARG002, ANN401
         """
-        A function that handles the end of a Azure LLM request with possible blocked content.
+        A function that handles the end of a LLM request with possible blocked content.
 
         Args:
-            response (RunnableWithMessageHistory): The response object containing message history.
+            response (LLMResult): The response of the model.
             **kwargs (Any): Additional keyword arguments.
 
         Returns:
             None
         """
-        if (isinstance(response.generations, list)
-            and response.generations[0][0].generation_info.get("finish_reason") == AZURE_CONTENT_FILTER_REASON):
+        if not isinstance(response.generations, list) or not response.generations or not response.generations[0]:
+            return
+        if azure_blocked(response) or vertex_blocked(response) or bedrock_blocked(response):
             self.has_blocked = True
 
     def on_llm_error(self, error: BaseException,  **kwargs: Any) -> None: # noqa: ARG002, ANN401
@@ -57,38 +91,3 @@ class AzureBlockedContentTracker(BlockedContentTracker):
         """
         if isinstance(error, BadRequestError) and error.code == AZURE_CONTENT_FILTER_REASON:
             self.has_blocked = True
-
-class VertexBlockedContentTracker(BlockedContentTracker):
-    """A callback handler specific to Vertex that handles the blocked content instances in a conversation service."""
-    def on_llm_end(self, response: RunnableWithMessageHistory, **kwargs: Any) -> None: # noqa: ARG002, ANN401
-        """
-        A function that handles the end of a VertexLLM request with possible blocked content.
-
-        Args:
-            response (RunnableWithMessageHistory): The response object containing message history.
-            **kwargs (Any): Additional keyword arguments.
-
-        Returns:
-            None
-        """
-        if (isinstance(response.generations, list) and response.generations[0]
-            and (safety_ratings := response.generations[0][0].generation_info.get("safety_ratings", []))
-            and any(rating.get("blocked", False) for rating in safety_ratings if isinstance(rating, dict))):
-                self.has_blocked = True
-
-class BedrockBlockedContentTracker(BlockedContentTracker):
-    """A callback handler specific to Bedrock that handles the blocked content instances in a conversation service."""
-    def on_llm_end(self, response: RunnableWithMessageHistory, **kwargs: Any) -> None: # noqa: ARG002, ANN401
-        """
-        A function that handles the end of a BedrockLLM request with possible blocked content.
-
-        Args:
-            response (RunnableWithMessageHistory): The response object containing message history.
-            **kwargs (Any): Additional keyword arguments.
-
-        Returns:
-            None
-        """
-        if (isinstance(response.generations, list)
-            and response.generations[0][0].text == BEDROCK_CONTENT_FILTER_REASON):
-            self.has_blocked = True
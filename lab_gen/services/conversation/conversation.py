@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 
@@ -5,7 +6,7 @@ from typing import Any
 
 from fastapi import FastAPI
 from langchain_community.chat_message_histories import ChatMessageHistory
-from langchain_core.language_models import BaseLanguageModel
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import (
@@ -15,24 +16,36 @@ from langchain_core.prompts import (
     MessagesPlaceholder,
     StringPromptTemplate,
 )
-from langchain_core.runnables import ConfigurableFieldSpec
+from langchain_core.runnables import ConfigurableFieldSpec, Runnable, RunnableConfig, RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langfuse.callback import CallbackHandler
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
-from lab_gen.datatypes.errors import NoConversationError
+from lab_gen.datatypes.errors import ModelKeyError, NoConversationError
 from lab_gen.datatypes.metadata import ConversationMetadata
-from lab_gen.datatypes.models import ModelProvider
+from lab_gen.datatypes.models import Model, ModelVariant
+from lab_gen.services.chat_history.cache import HistoryCache
 from lab_gen.services.chat_history.cosmos_db import CosmosDBChatMessageHistory
+from lab_gen.services.chat_history.cosmos_db_async import AsyncCosmosDBChatMessageHistory
 from lab_gen.services.chat_history.file_chat import FileChatHistory
-from lab_gen.services.conversation.block_content import (
-    AzureBlockedContentTracker,
-    BedrockBlockedContentTracker,
-    BlockedContentTracker,
-    VertexBlockedContentTracker,
+from lab_gen.services.chat_history.jsonl_chat import JsonlChatHistory
+from lab_gen.services.chat_history.sqlite_chat import SqliteChatHistory
+from lab_gen.services.chat_history.write_batch import HistoryWriteBatch
+from lab_gen.services.conversation.block_content import BlockedContentTracker
+from lab_gen.services.conversation.generations import GenerationRegistry
+from lab_gen.services.conversation.history_window import (
+    TRUNCATED_KEY,
+    count_message_tokens,
+    stamp_token_counts,
+    window_history,
 )
-from lab_gen.services.llm.lifetime import get_llm, get_model
+from lab_gen.services.conversation.summary import summarise, summarised_history, summary_range
+from lab_gen.services.llm.lifetime import get_model
+from lab_gen.services.llm.routing import ModelRoute, routed_llm
 from lab_gen.services.metrics.llm_metrics_counter import LLMMetricsCounter
 from lab_gen.services.metrics.metrics import Metric
+from lab_gen.settings import ChatHistoryStore, HistoryMemory, settings
 
 
 SYSTEM_MESSAGE = SystemMessage(
@@ -49,19 +62,32 @@ class ConversationService:
         self.all_prompts = {}
         for key, value in self.prompts.items():
             self.all_prompts[key] = value.input_variables
+        self.generations = GenerationRegistry(
+            settings.stop_signal_dir,
+            settings.stop_poll_seconds,
+            settings.stop_poll_seconds + settings.replay_grace_seconds,
+        )
+        self.history_cache = HistoryCache(
+            max_entries=settings.history_cache_size,
+            ttl=settings.history_cache_ttl,
+            max_bytes=settings.history_cache_max_bytes,
+        )
+        self._summaries: set[asyncio.Task] = set()
 
-    def create_chain(self, llm: BaseLanguageModel, prompt: ChatPromptTemplate) -> RunnableWithMessageHistory:
+    def create_chain(self, llm: Runnable, prompt: ChatPromptTemplate) -> RunnableWithMessageHistory:
         """
         Create a chain to process a prompt and return a `RunnableWithMessageHistory` object.
 
+        The history is fitted to the token budget of the model before it is added to the prompt.
+
         Args:
-            llm (LLM): The LLM object used to generate the chain.
+            llm (Runnable): The LLM, or the `routed_llm` of a model, used to generate the chain.
             prompt (Prompt): The prompt to be processed.
 
         Returns:
             RunnableWithMessageHistory: A `RunnableWithMessageHistory` object that represents the chain of operations.
         """
-        str_chain = prompt | llm | StrOutputParser()
+        str_chain = RunnableLambda(self.apply_history_window) | prompt | llm | StrOutputParser()
         return RunnableWithMessageHistory(
             str_chain,
             get_session_history=self.get_message_history,
@@ -92,9 +118,42 @@ class ConversationService:
                     default="",
                     is_shared=True,
                 ),
+                ConfigurableFieldSpec(
+                    id="write_batch",
+                    annotation=Any,
+                    name="Write batch",
+                    description="Holds the history writes for the turn until it is flushed.",
+                    default=None,
+                    is_shared=True,
+                ),
             ],
         )
 
+    def apply_history_window(self, inputs: dict[str, Any], config: RunnableConfig) -> dict[str, Any]:
+        """
+        Trim the oldest turns from the history so that it fits the budget set in the turn's metrics counter.
+
+        If the conversation has a summary, the turns it covers are replaced by it before trimming.
+
+        Args:
+            inputs (dict[str, Any]): The chain inputs, including the loaded history.
+            config (RunnableConfig): The configuration for the turn.
+
+        Returns:
+            dict[str, Any]: The inputs with the history trimmed.
+        """
+        configurable = config.get("configurable", {})
+        metrics_counter = configurable.get("metrics_counter")
+        if metrics_counter is None or not inputs.get("history"):
+            return inputs
+        metadata = configurable.get("metadata") or {}
+        history = summarised_history(
+            inputs["history"], metadata.get("summary"), metadata.get("summarised_messages", 0),
+        )
+        window = window_history(history, metrics_counter.history_token_budget)
+        metrics_counter.record_history_window(window.tokens, window.trimmed)
+        return {**inputs, "history": window.messages}
+
     def get_metadata(self, model_key: str, business_user: str) -> ConversationMetadata:
         """
         Returns the model metadata for the given model key.
@@ -115,27 +174,23 @@ class ConversationService:
             business_user = business_user,
         )
 
-    def generate_config(self, meta: ConversationMetadata, conversation_id: str, llm: BaseLanguageModel) -> dict:
+    def generate_config(self, meta: ConversationMetadata, conversation_id: str) -> dict:
         """Generates configuration for a conversation.
 
+        The metrics counter and blocked content tracker do not depend on the model, as the turn may be answered by a
+        fallback from another provider.
+
         Args:
             meta: Metadata about the conversation.
             conversation_id: The conversation ID.
-            llm: The language model used for the conversation.
 
         Returns:
             A dictionary containing the configuration for the conversation.
         """
-        metrics_counter = LLMMetricsCounter(llm)
-        match meta.provider:
-            case ModelProvider.AZURE:
-                blocked_content_counter = AzureBlockedContentTracker(llm)
-            case ModelProvider.VERTEX:
-                blocked_content_counter = VertexBlockedContentTracker(llm)
-            case ModelProvider.BEDROCK:
-                blocked_content_counter = BedrockBlockedContentTracker(llm)
-            case _:
-                blocked_content_counter = BlockedContentTracker(llm)
+        metrics_counter = LLMMetricsCounter()
+        model = get_model(meta.modelKey)
+        metrics_counter.history_token_budget = model.history_token_budget or settings.history_token_budget
+        blocked_content_counter = BlockedContentTracker()
 
         callbacks = [metrics_counter, blocked_content_counter]
 
@@ -151,25 +206,115 @@ class ConversationService:
                 "user_id": meta.business_user,
                 "conversation_id": conversation_id,
                 "metadata": meta.model_dump(),
+                "write_batch": HistoryWriteBatch(),
+                "metrics_counter": metrics_counter,
+                "route": ModelRoute(meta.modelKey),
+                "generations": self.generations,
             },
         }
 
-    def start(
+    async def finish_turn(self, config: dict) -> None:
+        """
+        Completes a turn once its response has been sent, persisting the turn's messages with a single write.
+
+        Each new message is stored with its token count, and the conversation's running total is updated with them.
+        If a fallback model answered the turn, the conversation is moved to it so that later turns stay on it.
+
+        The cached history is refreshed with the written messages, or dropped if the write failed. With the summary
+        memory, older turns are then added to the conversation's summary in a task of its own, so the model call does
+        not hold the response, or the event stream of its replay buffer, open.
+
+        Args:
+            config (dict): The configuration created by `generate_config` for the turn.
+        """
+        configurable = config["configurable"]
+        write_batch = configurable["write_batch"]
+        route_update = configurable["route"].metadata_update()
+        if route_update:
+            logger.info(f"Conversation moved to {route_update['modelKey']} after failing over")
+        for batched in write_batch.histories:
+            tokens = stamp_token_counts(batched.pending)
+            if batched.metadata is not None:
+                batched.metadata = batched.metadata.model_copy(
+                    update={"history_tokens": batched.metadata.history_tokens + tokens, **route_update},
+                )
+        await write_batch.aflush()
+        for batched in write_batch.histories:
+            if batched in write_batch.failed:
+                self.history_cache.invalidate(configurable["user_id"], configurable["conversation_id"])
+            else:
+                self.history_cache.put(configurable["user_id"], configurable["conversation_id"], batched.history)
+                if settings.history_memory == HistoryMemory.SUMMARY:
+                    summary = asyncio.create_task(self.summarise_history(batched.history))
+                    self._summaries.add(summary)
+                    summary.add_done_callback(self._summaries.discard)
+
+    def get_summary_llm(self, meta: ConversationMetadata) -> Runnable:
+        """
+        Get the LLM used to summarise a conversation, the GENERAL variant of its model family if there is one.
+
+        It is routed like a conversation, so its calls are reported to the circuit breakers and the other limits.
+
+        Args:
+            meta (ConversationMetadata): The metadata of the conversation.
+
+        Returns:
+            Runnable: The `routed_llm` to summarise with.
+        """
+        try:
+            return routed_llm(Model.compute_key(meta.provider, ModelVariant.GENERAL, meta.family))
+        except ModelKeyError:
+            return routed_llm(meta.modelKey)
+
+    async def summarise_history(self, history: BaseChatMessageHistory) -> None:
+        """
+        Add the older turns of a conversation to its summary once the unsummarised history passes the threshold.
+
+        Args:
+            history (BaseChatMessageHistory): The loaded history of the conversation.
+        """
+        meta = history.metadata
+        if meta is None:
+            return
+        messages = history.messages
+        summary_messages = summary_range(
+            messages,
+            meta.summarised_messages,
+            settings.history_summary_threshold,
+            settings.history_summary_recent_turns,
+        )
+        if summary_messages is None:
+            return
+        start, end = summary_messages
+        try:
+            summary = await summarise(self.get_summary_llm(meta), meta.summary, messages[start:end])
+            history.metadata = meta.model_copy(update={"summary": summary, "summarised_messages": end})
+            if isinstance(history, AsyncCosmosDBChatMessageHistory):
+                await history.asave_metadata()
+            else:
+                await run_in_threadpool(history.save_metadata)
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Failed to summarise conversation history: {e}")
+
+    async def start(
         self,
         meta: ConversationMetadata,
         prompt_id: str,
+        *,
+        hedge: bool = False,
     ) -> tuple[dict, str, RunnableWithMessageHistory]:
         """Sets up a new conversation.
 
         Generates a new UUID to use as the conversation ID. Gets the memory
         and LLM to use for the conversation. Stores metadata about the
         conversation. Creates the ConversationChain instance to manage the
-        conversation.
+        conversation. The request to the LLM is hedged if `hedge` is set. The history is loaded for the turn here,
+        off the event loop.
 
         Returns the generated conversation ID, config, and ConversationChain.
         """
         conversation_id = str(uuid.uuid4())  # Generate a new UUID
-        llm = get_llm(meta.modelKey)
+        routed = routed_llm(meta.modelKey, hedge=hedge)
 
         messages = [SYSTEM_MESSAGE]
         if prompt_id != "default":
@@ -179,30 +324,36 @@ class ConversationService:
             messages.append(("human", "{input}"))
 
         chat_prompt = ChatPromptTemplate.from_messages(messages)
-        chain_with_history = self.create_chain(llm, chat_prompt).with_config(
+        chain_with_history = self.create_chain(routed, chat_prompt).with_config(
             {"metadata": {"prompt_id": prompt_id}},
         )
         self.app.state.metrics_provider.increment(Metric.COUNT_CHAT_REQUESTS, meta.model_dump())
 
-        config = self.generate_config(meta, conversation_id, llm)
+        config = self.generate_config(meta, conversation_id)
+        await self.aload_turn_history(config)
         return config, conversation_id, chain_with_history
 
-    def get(self, conversation_id: str, user_id: str) -> tuple[dict, RunnableWithMessageHistory]:
+    async def get(
+        self, conversation_id: str, user_id: str, *, hedge: bool = False,
+    ) -> tuple[dict, RunnableWithMessageHistory]:
         """
         Gets an existing conversation for the given conversation ID.
 
-        If no metadata exists for the ID, raises a NoConversationError.
+        If no metadata exists for the ID, raises a NoConversationError. The request to the LLM is hedged if `hedge` is
+        set.
 
         Returns the config and created chain.
         """
-        history = self.get_message_history(user_id=user_id, conversation_id=conversation_id)
+        history = await self.aget_message_history(user_id=user_id, conversation_id=conversation_id)
 
         if history.metadata is not None:
             meta = history.metadata
-            llm = get_llm(meta.modelKey)
+            routed = routed_llm(meta.modelKey, hedge=hedge)
             self.app.state.metrics_provider.increment(Metric.COUNT_CHAT_REQUESTS, meta.model_dump())
-            config = self.generate_config(meta, conversation_id, llm)
+            config = self.generate_config(meta, conversation_id)
+            config["configurable"]["write_batch"].loaded = history
         else:
+            self.history_cache.invalidate(user_id, conversation_id)
             raise NoConversationError(conversation_id)
         prompt = ChatPromptTemplate.from_messages(
             [
@@ -210,7 +361,7 @@ class ConversationService:
                 ("human", "{input}"),
             ],
         )
-        return config, self.create_chain(llm, prompt)
+        return config, self.create_chain(routed, prompt)
 
     def get_message_history(
         self,
@@ -218,45 +369,156 @@ class ConversationService:
         user_id: str,
         conversation_id: str,
         metadata: dict[str, Any] | None = None,
+        write_batch: HistoryWriteBatch | None = None,
     ) -> ChatMessageHistory:
         """
-        Retrieves the chat message history for a given user and conversation.
+        Retrieves the chat message history for a given user and conversation, for `RunnableWithMessageHistory`.
+
+        This is called on the event loop, so the history loaded for the turn by `aload_turn_history` is used if there is
+        one. Otherwise it comes from the cache, or is created and loaded here.
 
         Args:
             user_id (str): The ID of the user.
             conversation_id (str): The ID of the conversation.
             metadata (dict[str, Any] | None, optional): Additional metadata for the conversation. Defaults to None.
+            write_batch (HistoryWriteBatch | None, optional): Holds the writes for the turn until the batch is flushed.
+                Defaults to None, which writes straight to the store.
 
         Returns:
             ChatMessageHistory: The chat message history for the user and conversation
         """
+        if write_batch is not None and write_batch.loaded is not None:
+            return write_batch.track(write_batch.loaded)
+        history = self.history_cache.get(user_id, conversation_id)
+        if history is None:
+            history = self._create_message_history(user_id=user_id, conversation_id=conversation_id, metadata=metadata)
+            self.history_cache.put(user_id, conversation_id, history)
+        return history if write_batch is None else write_batch.track(history)
+
+    def _create_message_history(
+        self,
+        *,
+        user_id: str,
+        conversation_id: str,
+        metadata: dict[str, Any] | None = None,
+    ) -> ChatMessageHistory:
+        """Creates the history for the configured store, the synchronous stores load their messages here."""
         meta = None if metadata is None else ConversationMetadata.model_validate(metadata)
 
-        if hasattr(self.app.state, "cosmos_client"):
-           return CosmosDBChatMessageHistory(
+        if hasattr(self.app.state, "cosmos_async_client"):
+            history = AsyncCosmosDBChatMessageHistory(
+                self.app.state.cosmos_async_client,
+                session_id=conversation_id,
+                user_id=user_id,
+                metadata=meta,
+                sync_client=self.app.state.cosmos_client,
+            )
+        elif hasattr(self.app.state, "cosmos_client"):
+            history = CosmosDBChatMessageHistory(
                 self.app.state.cosmos_client,
                 session_id=conversation_id,
                 user_id=user_id,
                 metadata=meta,
-        )
-        return FileChatHistory(
-            session_id=conversation_id,
-            user_id=user_id,
-            metadata=meta,
+            )
+        elif settings.chat_history_store == ChatHistoryStore.SQLITE:
+            history = SqliteChatHistory(
+                session_id=conversation_id,
+                user_id=user_id,
+                metadata=meta,
+            )
+        elif settings.chat_history_store == ChatHistoryStore.JSONL:
+            history = JsonlChatHistory(
+                session_id=conversation_id,
+                user_id=user_id,
+                metadata=meta,
+            )
+        else:
+            history = FileChatHistory(
+                session_id=conversation_id,
+                user_id=user_id,
+                metadata=meta,
+            )
+        return history
+
+    async def aget_message_history(
+        self,
+        *,
+        user_id: str,
+        conversation_id: str,
+        metadata: dict[str, Any] | None = None,
+        cached: bool = True,
+    ) -> ChatMessageHistory:
+        """
+        Retrieves and loads the chat message history without blocking the event loop.
+
+        A cached history is returned if it is still the version in the store. Otherwise the asyncio Cosmos history is
+        loaded with the async client, the other stores load in the threadpool, and the loaded history is added to the
+        cache.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            metadata (dict[str, Any] | None, optional): Additional metadata for the conversation. Defaults to None.
+            cached (bool, optional): Whether to use and fill the cache. Defaults to True, False always loads the
+                history from the store.
+
+        Returns:
+            ChatMessageHistory: The loaded chat message history for the user and conversation
+        """
+        history = self.history_cache.get(user_id, conversation_id) if cached else None
+        if history is not None:
+            await history.aget_messages()
+            if await self._is_current(history):
+                return history
+            self.history_cache.invalidate(user_id, conversation_id)
+
+        if hasattr(self.app.state, "cosmos_async_client"):
+            history = self._create_message_history(user_id=user_id, conversation_id=conversation_id, metadata=metadata)
+            await history.aload_messages()
+        else:
+            history = await run_in_threadpool(
+                self._create_message_history, user_id=user_id, conversation_id=conversation_id, metadata=metadata,
+            )
+        if cached:
+            self.history_cache.put(user_id, conversation_id, history)
+        return history
+
+    async def aload_turn_history(self, config: dict) -> None:
+        """
+        Load the history of a turn's conversation off the event loop, for the turn's chain to use.
+
+        Args:
+            config (dict): The configuration created by `generate_config` for the turn.
+        """
+        configurable = config["configurable"]
+        configurable["write_batch"].loaded = await self.aget_message_history(
+            user_id=configurable["user_id"],
+            conversation_id=configurable["conversation_id"],
+            metadata=configurable["metadata"],
         )
 
-    def _message_to_dict(self, message: BaseMessage) -> dict[str, str]:
+    async def _is_current(self, history: BaseChatMessageHistory) -> bool:
+        """Check that a cached history is the version in the store, which another worker may have written since."""
+        if isinstance(history, AsyncCosmosDBChatMessageHistory):
+            stored = await history.astored_version()
+        else:
+            stored = await run_in_threadpool(history.stored_version)
+        return stored == history.version
+
+    def _message_to_dict(self, message: BaseMessage) -> dict[str, str | bool]:
         """Convert a Message to a dictionary.
 
         Args:
             message: Message to convert.
 
         Returns:
-            Message as a dict.
+            Message as a dict, marked truncated if its answer was cut short by the client disconnecting.
         """
+        if message.response_metadata.get(TRUNCATED_KEY):
+            return {"role": message.type, "content": message.content, "truncated": True}
         return {"role": message.type, "content": message.content}
 
-    def history(self, user_id: str, conversation_id: str) -> list[dict[str, str]]:
+    async def history(self, user_id: str, conversation_id: str) -> list[dict[str, str | bool]]:
         """
         Retrieves the message history for a specific user and conversation.
 
@@ -265,17 +527,18 @@ class ConversationService:
             conversation_id (str): The ID of the conversation.
 
         Returns:
-            list[dict[str, str]]: A list of dictionaries representing the message history.
+            list[dict[str, str | bool]]: A list of dictionaries representing the message history.
 
         Raises:
             NoConversationError: If there is no conversation with the specified ID.
         """
-        history = self.get_message_history(user_id=user_id, conversation_id=conversation_id)
+        history = await self.aget_message_history(user_id=user_id, conversation_id=conversation_id)
         if history.messages:
             return [self._message_to_dict(m) for m in history.messages]
+        self.history_cache.invalidate(user_id, conversation_id)
         raise NoConversationError(conversation_id)
 
-    def end(self, user_id: str, conversation_id: str) -> None:
+    async def end(self, user_id: str, conversation_id: str) -> None:
         """
         End a conversation for a specific user.
 
@@ -289,9 +552,10 @@ class ConversationService:
         Raises:
             NoConversationError: If no conversation is found with the given conversation ID.
         """
-        history = self.get_message_history(user_id=user_id, conversation_id=conversation_id)
+        self.history_cache.invalidate(user_id, conversation_id)
+        history = await self.aget_message_history(user_id=user_id, conversation_id=conversation_id, cached=False)
         if history.messages:
-            return history.clear()
+            return await history.aclear()
         raise NoConversationError(conversation_id)
 
     def get_prompts(self, categories: str) -> dict[str, list[str]]:
@@ -302,7 +566,7 @@ class ConversationService:
         """Gets the prompt template for the given prompt ID."""
         return self.prompts[prompt_id]
 
-    def delete_history(self, user_id: str, conversation_id: str, num_entries: int) -> None:
+    async def delete_history(self, user_id: str, conversation_id: str, num_entries: int) -> None:
         """
         Delete a chosen message from the message history.
 
@@ -314,9 +578,22 @@ class ConversationService:
         Raises:
             NoConversationError: If no such message index exists.
         """
-        history = self.get_message_history(user_id=user_id, conversation_id=conversation_id)
+        self.history_cache.invalidate(user_id, conversation_id)
+        # Loaded from the store, as the remaining messages are written back as a whole
+        history = await self.aget_message_history(user_id=user_id, conversation_id=conversation_id, cached=False)
 
         if len(history.messages) > 0:
-            history.delete(num_entries)
+            meta = history.metadata
+            remaining = history.messages[:len(history.messages) - num_entries * 2]
+            if meta is not None:
+                update = {"history_tokens": sum(count_message_tokens(m) for m in remaining)}
+                if meta.summarised_messages > len(remaining):
+                    # The summary covers messages being deleted, so drop it with them.
+                    update.update({"summary": None, "summarised_messages": 0})
+                history.metadata = meta.model_copy(update=update)
+            if isinstance(history, AsyncCosmosDBChatMessageHistory):
+                await history.adelete(num_entries)
+            else:
+                await run_in_threadpool(history.delete, num_entries)
         else:
             raise NoConversationError(conversation_id)
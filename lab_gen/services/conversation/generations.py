@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import time
+
+from pathlib import Path
+
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+
+
+class Generation:
+    """An answer being streamed for a conversation, which can be asked to stop."""
+
+    def __init__(self, signal: Path) -> None:
+        self.signal = signal
+        self.started = time.time()
+        self.stopped = asyncio.Event()
+
+    def signalled(self) -> bool:
+        """
+        Check whether another worker has asked for this answer to stop, since it started.
+
+        Returns:
+            bool: True if the stop signal was written after the answer started.
+        """
+        try:
+            return self.signal.stat().st_mtime >= self.started
+        except FileNotFoundError:
+            return False
+
+    def take_signal(self) -> bool:
+        """
+        Check for the stop signal, removing it if it was written for this answer.
+
+        Returns:
+            bool: True if another worker has asked for this answer to stop.
+        """
+        if not self.signalled():
+            return False
+        self.signal.unlink(missing_ok=True)
+        return True
+
+    async def wait_stopped(self, poll_seconds: float) -> None:
+        """
+        Wait until this answer is asked to stop, by this worker or by another through the stop signal.
+
+        Args:
+            poll_seconds (float): How often to check for the stop signal.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.stopped.wait(), poll_seconds)
+            except TimeoutError:
+                if await run_in_threadpool(self.take_signal):
+                    self.stopped.set()
+            else:
+                return
+
+
+class GenerationRegistry:
+    """The answers being streamed by this worker, keyed by user and conversation, so they can be stopped.
+
+    A stop for an answer this worker is not streaming is written as a signal file in a directory shared by the
+    workers on the host, which the worker streaming it notices when it next checks. A signal no worker has taken within
+    `max_age_seconds` is for an answer that has already finished, and is removed when the next one is written.
+    """
+
+    def __init__(self, signal_dir: Path, poll_seconds: float, max_age_seconds: float) -> None:
+        self.signal_dir = signal_dir
+        self.poll_seconds = poll_seconds
+        self.max_age_seconds = max_age_seconds
+        self._generations: dict[tuple[str, str], Generation] = {}
+
+    def _signal_path(self, user_id: str, conversation_id: str) -> Path:
+        # Hashed so the IDs from the request cannot reach outside the directory
+        key = hashlib.sha256(f"{user_id}\0{conversation_id}".encode()).hexdigest()
+        return self.signal_dir / key
+
+    def start(self, user_id: str, conversation_id: str) -> Generation:
+        """
+        Register an answer that is starting to stream.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            Generation: The answer, to wait on for a stop.
+        """
+        generation = Generation(self._signal_path(user_id, conversation_id))
+        self._generations[(user_id, conversation_id)] = generation
+        return generation
+
+    def finish(self, user_id: str, conversation_id: str, generation: Generation) -> None:
+        """
+        Remove an answer that has finished streaming, unless a later answer for the conversation replaced it.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+            generation (Generation): The answer.
+        """
+        if self._generations.get((user_id, conversation_id)) is generation:
+            del self._generations[(user_id, conversation_id)]
+
+    def _remove_stale_signals(self) -> None:
+        """Remove the signal files older than `max_age_seconds`."""
+        oldest = time.time() - self.max_age_seconds
+        for signal in self.signal_dir.iterdir():
+            try:
+                if signal.stat().st_mtime < oldest:
+                    signal.unlink(missing_ok=True)
+            except FileNotFoundError:
+                continue
+
+    def _signal(self, user_id: str, conversation_id: str) -> None:
+        """Write the stop signal for an answer streamed by another worker, clearing out the stale ones."""
+        signal = self._signal_path(user_id, conversation_id)
+        try:
+            signal.parent.mkdir(parents=True, exist_ok=True)
+            self._remove_stale_signals()
+            signal.touch()
+        except OSError as e:
+            logger.error(f"Unable to signal the other workers to stop {conversation_id}: {e}")
+
+    async def stop(self, user_id: str, conversation_id: str) -> bool:
+        """
+        Ask the answer being streamed for a conversation to stop.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            bool: True if this worker is streaming the answer and has stopped it, False if the other workers have been
+                signalled instead.
+        """
+        generation = self._generations.get((user_id, conversation_id))
+        if generation is not None:
+            generation.stopped.set()
+            return True
+        await run_in_threadpool(self._signal, user_id, conversation_id)
+        return False
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+import tiktoken
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+
+# Tokens added for each message by the chat format, on top of its content.
+MESSAGE_OVERHEAD_TOKENS = 4
+# Estimate used for content that is not text, such as an image.
+NON_TEXT_PART_TOKENS = 765
+# Key in a message's response metadata holding its token count, stored with the message.
+TOKEN_COUNT_KEY = "token_count"  # noqa: S105
+# Key in a message's response metadata marking an answer cut short because its client disconnected.
+TRUNCATED_KEY = "truncated"
+
+encoding = tiktoken.get_encoding("cl100k_base")
+
+
+class HistoryWindow(NamedTuple):
+    """The messages kept from a history, how many tokens they hold and how many were trimmed."""
+
+    messages: list[BaseMessage]
+    tokens: int
+    trimmed: int
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    """
+    Approximate the number of tokens in a message.
+
+    The count stored with the message is used if it has one. Otherwise the cl100k encoding is used for every model
+    family, which is close enough to decide how much history to send without loading a tokenizer for each model.
+
+    Args:
+        message (BaseMessage): The message to count.
+
+    Returns:
+        int: The approximate number of tokens.
+    """
+    stored = message.response_metadata.get(TOKEN_COUNT_KEY)
+    if stored is not None:
+        return stored
+    if isinstance(message.content, str):
+        return MESSAGE_OVERHEAD_TOKENS + len(encoding.encode(message.content))
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    for part in message.content:
+        if isinstance(part, str):
+            tokens += len(encoding.encode(part))
+        elif part.get("type") == "text":
+            tokens += len(encoding.encode(part.get("text", "")))
+        else:
+            tokens += NON_TEXT_PART_TOKENS
+    return tokens
+
+
+def stamp_token_counts(messages: list[BaseMessage]) -> int:
+    """
+    Store the token count of each message in its response metadata, so it is saved with the message.
+
+    Args:
+        messages (list[BaseMessage]): The messages to count.
+
+    Returns:
+        int: The total tokens of the messages.
+    """
+    total = 0
+    for message in messages:
+        tokens = count_message_tokens(message)
+        message.response_metadata[TOKEN_COUNT_KEY] = tokens
+        total += tokens
+    return total
+
+
+def split_turns(messages: list[BaseMessage]) -> list[list[BaseMessage]]:
+    """
+    Group messages into turns, each starting with a human message.
+
+    Args:
+        messages (list[BaseMessage]): The messages to group.
+
+    Returns:
+        list[list[BaseMessage]]: The turns, in order.
+    """
+    turns: list[list[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def window_history(messages: list[BaseMessage], budget: int) -> HistoryWindow:
+    """
+    Trim the oldest turns from a history so that it fits in a token budget.
+
+    System messages and the first turn, which holds the templated prompt the conversation was started with, are
+    always kept. The most recent turns are then added for as long as they fit, so whole turns are dropped from the
+    middle of the conversation.
+
+    Args:
+        messages (list[BaseMessage]): The stored messages.
+        budget (int): The number of tokens the history may use.
+
+    Returns:
+        HistoryWindow: The messages to send, their approximate token count and the number of messages trimmed.
+    """
+    system = [m for m in messages if isinstance(m, SystemMessage)]
+    turns = split_turns([m for m in messages if not isinstance(m, SystemMessage)])
+    if not turns:
+        return HistoryWindow(system, sum(count_message_tokens(m) for m in system), 0)
+
+    first, recent = turns[0], turns[1:]
+    tokens = sum(count_message_tokens(m) for m in [*system, *first])
+    kept: list[list[BaseMessage]] = []
+    for turn in reversed(recent):
+        turn_tokens = sum(count_message_tokens(m) for m in turn)
+        if tokens + turn_tokens > budget:
+            break
+        kept.append(turn)
+        tokens += turn_tokens
+
+    window = [*system, *first, *(m for turn in reversed(kept) for m in turn)]
+    return HistoryWindow(window, tokens, len(messages) - len(window))
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from langchain_core.messages import SystemMessage, get_buffer_string
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from lab_gen.services.conversation.history_window import count_message_tokens, split_turns
+
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+    from langchain_core.runnables import Runnable
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "You condense conversations between a user and an AI assistant. Write a concise summary that keeps the "
+            "facts, figures, decisions and open questions needed to continue the conversation. Reply with the summary "
+            "only.",
+        ),
+        ("human", "Existing summary:\n{summary}\n\nNew lines of conversation:\n{lines}\n\nUpdated summary:"),
+    ],
+)
+
+
+def summarised_history(messages: list[BaseMessage], summary: str | None, summarised: int) -> list[BaseMessage]:
+    """
+    Replace the summarised part of a history with its summary.
+
+    The summary is sent as a system message ahead of the first turn, followed by the messages it does not cover.
+
+    Args:
+        messages (list[BaseMessage]): The stored messages.
+        summary (str | None): The stored summary, if there is one.
+        summarised (int): The number of leading messages the summary covers, including the first turn.
+
+    Returns:
+        list[BaseMessage]: The history to send.
+    """
+    if not summary or not messages or summarised > len(messages):
+        return messages
+    first = split_turns(messages)[0]
+    return [SystemMessage(content=SUMMARY_PREFIX + summary), *first, *messages[max(summarised, len(first)):]]
+
+
+def summary_range(
+    messages: list[BaseMessage], summarised: int, threshold: int, recent_turns: int,
+) -> tuple[int, int] | None:
+    """
+    Decide which messages should be added to the summary once a new turn has been added.
+
+    Nothing more is summarised until the messages after the summary hold more than `threshold` tokens. They are then
+    summarised apart from the most recent `recent_turns` turns. The first turn is never summarised.
+
+    Args:
+        messages (list[BaseMessage]): The stored messages.
+        summarised (int): The number of leading messages the current summary covers.
+        threshold (int): The tokens of unsummarised history allowed before summarising.
+        recent_turns (int): The number of turns to leave out of the summary.
+
+    Returns:
+        tuple[int, int] | None: The start and end of the messages to summarise, or None if the summary is up to date.
+    """
+    if not messages:
+        return None
+    start = max(summarised, len(split_turns(messages)[0]))
+    unsummarised = messages[start:]
+    if sum(count_message_tokens(m) for m in unsummarised) <= threshold:
+        return None
+    turns = split_turns(unsummarised)
+    if len(turns) <= recent_turns:
+        return None
+    return start, start + sum(len(turn) for turn in turns[:len(turns) - recent_turns])
+
+
+async def summarise(llm: Runnable, summary: str | None, messages: list[BaseMessage]) -> str:
+    """
+    Extend a summary with the given messages.
+
+    Args:
+        llm (Runnable): The model, or the `routed_llm` of one, to write the summary with.
+        summary (str | None): The current summary, if there is one.
+        messages (list[BaseMessage]): The messages to add to the summary.
+
+    Returns:
+        str: The updated summary.
+    """
+    chain = SUMMARY_PROMPT | llm | StrOutputParser()
+    return await chain.ainvoke(
+        {"summary": summary or "None yet.", "lines": get_buffer_string(messages)},
+        {"run_name": "summarise_history"},
+    )
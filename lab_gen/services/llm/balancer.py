@@ -0,0 +1,67 @@
+import threading
+
+from lab_gen.settings import LoadBalancing
+
+
+# Weight given to the latest latency in each deployment's moving average
+EWMA_ALPHA = 0.3
+
+
+class DeploymentStats:
+    """The requests in flight to one deployment of a model and its moving average latency."""
+
+    def __init__(self) -> None:
+        self.outstanding = 0
+        self.latency: float | None = None
+        self._lock = threading.Lock()
+
+    def started(self) -> None:
+        """Record a request sent to the deployment."""
+        with self._lock:
+            self.outstanding += 1
+
+    def finished(self, latency: float | None) -> None:
+        """
+        Record a request to the deployment finishing.
+
+        Args:
+            latency (float | None): The seconds to the first token of the response, or None if it failed.
+        """
+        with self._lock:
+            self.outstanding -= 1
+            if latency is None:
+                return
+            self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+
+    def score(self, policy: LoadBalancing) -> tuple[float, float]:
+        """
+        Score the deployment for the next request, lower is better.
+
+        Args:
+            policy (LoadBalancing): How to balance between deployments.
+
+        Returns:
+            tuple[float, float]: The score, compared in order.
+        """
+        latency = self.latency or 0.0
+        if policy == LoadBalancing.EWMA:
+            # A deployment with no latency yet scores 0, so it is tried
+            return latency * (self.outstanding + 1), self.outstanding
+        return self.outstanding, latency
+
+
+def rank_deployments(names: list[str], stats: dict[str, DeploymentStats], policy: LoadBalancing) -> list[str]:
+    """
+    Order the deployments of a model from the best to send the next request to.
+
+    Ties keep the configured order, so a model with idle deployments uses the first.
+
+    Args:
+        names (list[str]): The names of the deployments.
+        stats (dict[str, DeploymentStats]): The stats of each deployment.
+        policy (LoadBalancing): How to balance between deployments.
+
+    Returns:
+        list[str]: The deployment names, best first.
+    """
+    return sorted(names, key=lambda name: stats[name].score(policy))
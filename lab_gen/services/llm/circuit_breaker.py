@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from collections import deque
+
+from loguru import logger
+
+from lab_gen.datatypes.errors import CircuitOpenError
+from lab_gen.datatypes.models import CircuitState
+
+
+HTTP_CLIENT_ERROR_START = 400
+HTTP_SERVER_ERROR_START = 500
+HTTP_TOO_MANY_REQUESTS = 429
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    Decide whether an error from a model counts against its circuit.
+
+    Errors caused by the request itself, such as a prompt blocked by a content filter, say nothing about the health of
+    the backend. Rate limiting does, as it means the backend cannot take more calls.
+
+    Args:
+        error (BaseException): The error raised by the model client.
+
+    Returns:
+        bool: True if the error should count as a failure of the backend.
+    """
+    status_code = getattr(error, "status_code", None)
+    if not isinstance(status_code, int):
+        return True
+    return status_code == HTTP_TOO_MANY_REQUESTS or not (
+        HTTP_CLIENT_ERROR_START <= status_code < HTTP_SERVER_ERROR_START
+    )
+
+
+class CircuitBreaker:
+    """A circuit breaker for the calls to one model, driven by their error rate and latency.
+
+    While CLOSED every call is allowed and the outcome of the last `window` calls is kept, with calls slower than
+    `slow_call_seconds` counting as failures. Once at least `min_calls` are kept and the share that failed reaches
+    `failure_rate`, the circuit OPENs and calls fail fast for `open_seconds`. It is then HALF_OPEN, letting a single
+    probe call through: the circuit closes if it succeeds and opens again if it fails. A probe that never reports back
+    is abandoned after `open_seconds`, so another can be made.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        model_key: str,
+        *,
+        failure_rate: float,
+        window: int,
+        min_calls: int,
+        open_seconds: float,
+        slow_call_seconds: float,
+    ) -> None:
+        self.model_key = model_key
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._state = CircuitState.CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: float | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> CircuitState:
+        """The current state, moving an open circuit to HALF_OPEN once it has been open for `open_seconds`."""
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    @property
+    def retry_after(self) -> float:
+        """The seconds until an open circuit lets a probe call through, 0 if it is not open."""
+        with self._lock:
+            self._refresh()
+            if self._state != CircuitState.OPEN:
+                return 0
+            return self.open_seconds - (time.monotonic() - self._opened_at)
+
+    def _refresh(self) -> None:
+        if self._state == CircuitState.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = CircuitState.HALF_OPEN
+            self._probe_started_at = None
+
+    def _open(self) -> None:
+        if self._state != CircuitState.OPEN:
+            logger.warning(f"Circuit opened for {self.model_key}")
+        self._state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_started_at = None
+        self._outcomes.clear()
+
+    def before_call(self) -> None:
+        """
+        Check that a call may be made to the model.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half open with a probe already in flight.
+        """
+        with self._lock:
+            self._refresh()
+            now = time.monotonic()
+            if self._state == CircuitState.OPEN:
+                raise CircuitOpenError(self.model_key, self.open_seconds - (now - self._opened_at))
+            if self._state == CircuitState.HALF_OPEN:
+                if self._probe_started_at is not None and now - self._probe_started_at < self.open_seconds:
+                    raise CircuitOpenError(self.model_key, self.open_seconds - (now - self._probe_started_at))
+                self._probe_started_at = now
+
+    def record_success(self, latency: float) -> None:
+        """
+        Record a call that completed, counting it as a failure if it was slower than `slow_call_seconds`.
+
+        Args:
+            latency (float): The seconds the model took to respond.
+        """
+        if latency > self.slow_call_seconds:
+            logger.warning(f"Slow call to {self.model_key} took {latency:.1f}s")
+            self.record_failure()
+            return
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                logger.info(f"Circuit closed for {self.model_key}")
+                self._state = CircuitState.CLOSED
+                self._probe_started_at = None
+            self._outcomes.append(True)
+
+    def release(self) -> None:
+        """Record a call that ended without an outcome, freeing the probe of a half open circuit for another call."""
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._probe_started_at = None
+
+    def record_failure(self) -> None:
+        """Record a call that failed, opening the circuit if the probe failed or the failure rate is too high."""
+        with self._lock:
+            if self._state == CircuitState.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
@@ -0,0 +1,111 @@
+import asyncio
+
+from collections import deque
+
+from loguru import logger
+
+from lab_gen.datatypes.errors import ConcurrencyLimitError
+
+
+# Weight given to the latest time to first token in the baseline latency
+BASELINE_ALPHA = 0.05
+# Share of the limit kept when latency rises or a call fails
+BACKOFF_RATIO = 0.9
+
+
+class AdaptiveLimiter:
+    """An AIMD limit on the requests in flight to one provider, adapted to its time to first token and errors.
+
+    Each call's time to first token is compared with a slowly moving baseline. While it stays within
+    `latency_tolerance` times the baseline the limit grows by about one for every `limit` calls. When it rises above,
+    or a call fails, the limit shrinks by `BACKOFF_RATIO`, never going below `min_limit` or above `max_limit`. Requests
+    over the limit wait in a queue of at most `queue_size` for up to `queue_timeout` seconds, and are rejected once the
+    queue is full or their deadline passes. It is used from the event loop, so needs no lock.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        provider: str,
+        *,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        queue_size: int,
+        queue_timeout: float,
+        latency_tolerance: float,
+    ) -> None:
+        self.provider = provider
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.baseline: float | None = None
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    async def acquire(self) -> None:
+        """
+        Take a slot for a request, waiting in the queue if the provider is at its limit.
+
+        Raises:
+            ConcurrencyLimitError: If the queue is full, or no slot came free before the deadline.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise ConcurrencyLimitError(self.provider)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over as the wait ended, so pass it on
+                self.release()
+            if isinstance(e, TimeoutError):
+                raise ConcurrencyLimitError(self.provider) from None
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Give back the slot of a finished request, handing it to the next request in the queue."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():  # A waiter whose deadline has passed may not have left the queue yet
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _resize(self, limit: float) -> None:
+        limit = min(self.max_limit, max(self.min_limit, limit))
+        if int(limit) != int(self.limit):
+            logger.debug(f"Concurrency limit for {self.provider} is now {int(limit)}")
+        self.limit = limit
+        self._wake()
+
+    def record_success(self, latency: float) -> None:
+        """
+        Record the time to first token of a call, shrinking the limit if it rose above the baseline.
+
+        Args:
+            latency (float): The seconds to the first token.
+        """
+        baseline = self.baseline
+        self.baseline = latency if baseline is None else baseline + BASELINE_ALPHA * (latency - baseline)
+        if baseline is not None and latency > self.latency_tolerance * baseline:
+            self._resize(self.limit * BACKOFF_RATIO)
+        else:
+            self._resize(self.limit + 1 / self.limit)
+
+    def record_failure(self) -> None:
+        """Record a call that failed, shrinking the limit."""
+        self._resize(self.limit * BACKOFF_RATIO)
@@ -0,0 +1,45 @@
+from collections import Counter, deque
+
+
+class LatencyWindow:
+    """The times to first token of a model's most recent calls, to pick the delay before a request is hedged."""
+
+    def __init__(self, size: int) -> None:
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        """The number of latencies recorded."""
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        """
+        Record the time to first token of a call.
+
+        Args:
+            latency (float): The seconds to the first token.
+        """
+        self._samples.append(latency)
+
+    def percentile(self, quantile: float) -> float:
+        """
+        Get a percentile of the recorded latencies, by the nearest rank.
+
+        Args:
+            quantile (float): The percentile as a fraction, e.g. 0.95.
+
+        Returns:
+            float: The latency in seconds, 0 if none are recorded.
+        """
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class HedgeStats:
+    """Counts, for each model, the requests that asked to be hedged, those that were and those the hedge won."""
+
+    def __init__(self) -> None:
+        self.requested: Counter[str] = Counter()
+        self.hedged: Counter[str] = Counter()
+        self.won: Counter[str] = Counter()
@@ -0,0 +1,94 @@
+import threading
+
+from importlib.util import find_spec
+from typing import Any
+
+import httpx
+
+from lab_gen.settings import settings
+
+
+# Each provider client gets its own httpx client, for its base URL and headers, over one of these shared transports. The
+# connections to a backend are then reused by every model and deployment that calls it, and the limits apply per worker
+_transports: dict[str, httpx.BaseTransport | httpx.AsyncBaseTransport] = {}
+_transports_lock = threading.Lock()
+
+
+def http2_enabled() -> bool:
+    """
+    Whether to offer HTTP/2 to the backends, if it is turned on and the `h2` package is installed.
+
+    Returns:
+        bool: True if the transports use HTTP/2 where the backend supports it.
+    """
+    return settings.http2 and find_spec("h2") is not None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry_seconds,
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    """
+    Get the timeouts for the calls to a backend.
+
+    Returns:
+        httpx.Timeout: The connect timeout, and the read timeout that also applies to writes and the pool.
+    """
+    return httpx.Timeout(settings.http_read_timeout_seconds, connect=settings.http_connect_timeout_seconds)
+
+
+def _transport(name: str, factory: type[httpx.HTTPTransport] | type[httpx.AsyncHTTPTransport]) -> Any:  # noqa: ANN401
+    with _transports_lock:
+        transport = _transports.get(name)
+        if transport is None:
+            transport = factory(limits=_limits(), http2=http2_enabled())
+            _transports[name] = transport
+        return transport
+
+
+def sync_client(**kwargs: Any) -> httpx.Client:  # noqa: ANN401
+    """
+    Create a sync HTTP client over the shared pool.
+
+    Args:
+        **kwargs: The other arguments of the client, such as its base URL and headers.
+
+    Returns:
+        httpx.Client: The client.
+    """
+    return httpx.Client(transport=_transport("sync", httpx.HTTPTransport), timeout=http_timeout(), **kwargs)
+
+
+def async_client(**kwargs: Any) -> httpx.AsyncClient:  # noqa: ANN401
+    """
+    Create an async HTTP client over the shared pool.
+
+    Args:
+        **kwargs: The other arguments of the client, such as its base URL and headers.
+
+    Returns:
+        httpx.AsyncClient: The client.
+    """
+    return httpx.AsyncClient(transport=_transport("async", httpx.AsyncHTTPTransport), timeout=http_timeout(), **kwargs)
+
+
+def pool_usage() -> dict[str, dict[str, int]]:
+    """
+    Count the connections in each shared pool that are handling a request and those kept alive for reuse.
+
+    Returns:
+        dict[str, dict[str, int]]: The active and idle connections, by "sync" or "async" pool.
+    """
+    with _transports_lock:
+        transports = dict(_transports)
+    usage = {}
+    for name, transport in transports.items():
+        connections = transport._pool.connections  # noqa: SLF001
+        idle = sum(connection.is_idle() for connection in connections)
+        usage[name] = {"active": len(connections) - idle, "idle": idle}
+    return usage
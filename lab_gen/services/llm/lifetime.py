@@ -1,49 +1,227 @@
-from typing import Any
-
-import boto3
-
-from google.oauth2 import service_account
-from langchain_anthropic import ChatAnthropic
-from langchain_aws.chat_models.bedrock import ChatBedrock
-from langchain_community.chat_models.azureml_endpoint import AzureMLChatOnlineEndpoint, CustomOpenAIChatContentFormatter
-from langchain_community.llms import HuggingFaceEndpoint
-from langchain_community.llms.azureml_endpoint import AzureMLEndpointApiType
-from langchain_core.language_models import BaseChatModel, BaseLanguageModel
-from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
-from langchain_mistralai.chat_models import ChatMistralAI
-from langchain_openai import AzureChatOpenAI
+import importlib
+import threading
+
+from types import ModuleType
+
+from langchain_core.language_models import BaseLanguageModel
 from loguru import logger
 
-from lab_gen.datatypes.errors import ModelKeyError
-from lab_gen.datatypes.models import (
-    DEFAULT_MODEL_KEY,
-    AzureMLModelConfig,
-    AzureModelConfig,
-    BedrockModelConfig,
-    HuggingfaceModelConfig,
-    Model,
-    ModelFamily,
-    ModelProvider,
-)
+from lab_gen.datatypes.errors import CircuitOpenError, ModelKeyError
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, CircuitState, Model, ModelProvider
+from lab_gen.services.llm.balancer import DeploymentStats, rank_deployments
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.concurrency import AdaptiveLimiter
+from lab_gen.services.llm.hedging import HedgeStats, LatencyWindow
+from lab_gen.services.llm.rate_limiter import RateLimiter
+from lab_gen.services.llm.retry import RetryBudget, RetryStats
 from lab_gen.settings import settings
 
 
-MAX_TOKENS = 1536
-
-VERTEX_SAFETY_CONFIG = {
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+# The plugin module for each provider, imported when a model of that provider is configured
+PROVIDER_MODULES = {
+    ModelProvider.AZURE: "lab_gen.services.llm.providers.azure",
+    ModelProvider.ANTHROPIC: "lab_gen.services.llm.providers.anthropic",
+    ModelProvider.BEDROCK: "lab_gen.services.llm.providers.bedrock",
+    ModelProvider.VERTEX: "lab_gen.services.llm.providers.vertex",
+    ModelProvider.HUGGINGFACE: "lab_gen.services.llm.providers.huggingface",
 }
 
-model_providers: dict[str, Any] = {}
+# Model definitions, registered at startup, the first configured for each model key
 models: dict[str, Model] = {}
+# The deployments of each model key, and the model definition of each deployment. A model configured more than once
+# under the same key has a deployment for each, the first named after the key and the others after the key and their
+# index, e.g. AZUREGPTGENERAL#1
+deployments: dict[str, list[str]] = {}
+deployment_models: dict[str, Model] = {}
+# LLM clients, built on first use of each deployment
+model_providers: dict[str, BaseLanguageModel] = {}
+# Circuit breakers around the calls to each deployment
+circuit_breakers: dict[str, CircuitBreaker] = {}
+# Requests in flight to each deployment and their latency, used to balance between them
+deployment_stats: dict[str, DeploymentStats] = {}
+# Limiters for the deployments with a requests or tokens per minute quota
+rate_limiters: dict[str, RateLimiter] = {}
+# Adaptive limits on the requests in flight to each provider, shared by its deployments
+concurrency_limiters: dict[ModelProvider, AdaptiveLimiter] = {}
+# Caps the retries of model calls across all requests, and counts them for the metrics
+retry_budget = RetryBudget(settings.retry_budget_ratio, settings.retry_budget_min_per_second)
+retry_stats = RetryStats()
+# The recent times to first token of each model key, used to decide when to hedge a request
+first_token_latencies: dict[str, LatencyWindow] = {}
+hedge_stats = HedgeStats()
+
+_build_locks: dict[str, threading.Lock] = {}
+_build_locks_lock = threading.Lock()
+
+
+def _build_lock(model_key: str) -> threading.Lock:
+    with _build_locks_lock:
+        return _build_locks.setdefault(model_key, threading.Lock())
+
+
+def get_circuit_breaker(deployment: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker around the calls to a deployment, creating it on first use.
+
+    Args:
+        deployment (str): The name of the deployment, the model key for a model with one deployment.
+
+    Returns:
+        CircuitBreaker: The circuit breaker for the deployment.
+    """
+    with _build_locks_lock:
+        breaker = circuit_breakers.get(deployment)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                deployment,
+                failure_rate=settings.circuit_breaker_failure_rate,
+                window=settings.circuit_breaker_window,
+                min_calls=settings.circuit_breaker_min_calls,
+                open_seconds=settings.circuit_breaker_open_seconds,
+                slow_call_seconds=settings.circuit_breaker_slow_call_seconds,
+            )
+            circuit_breakers[deployment] = breaker
+        return breaker
+
+
+def get_deployment_stats(deployment: str) -> DeploymentStats:
+    """
+    Get the requests in flight to a deployment and its latency, creating them on first use.
+
+    Args:
+        deployment (str): The name of the deployment.
+
+    Returns:
+        DeploymentStats: The stats of the deployment.
+    """
+    with _build_locks_lock:
+        return deployment_stats.setdefault(deployment, DeploymentStats())
+
+
+def get_rate_limiter(deployment: str) -> RateLimiter | None:
+    """
+    Get the limiter for a deployment's requests and tokens per minute quota, creating it on first use.
+
+    Args:
+        deployment (str): The name of the deployment.
+
+    Returns:
+        RateLimiter | None: The limiter, or None if the deployment has no quota set.
+    """
+    model = deployment_models.get(deployment)
+    if model is None or (model.rpm is None and model.tpm is None):
+        return None
+    with _build_locks_lock:
+        limiter = rate_limiters.get(deployment)
+        if limiter is None:
+            limiter = RateLimiter(deployment, model.rpm, model.tpm, settings.rate_limit_max_wait_seconds)
+            rate_limiters[deployment] = limiter
+        return limiter
+
+
+def get_concurrency_limiter(deployment: str) -> AdaptiveLimiter:
+    """
+    Get the limiter for the requests in flight to a deployment's provider, creating it on first use.
+
+    Args:
+        deployment (str): The name of the deployment.
+
+    Returns:
+        AdaptiveLimiter: The limiter shared by the provider's deployments.
+    """
+    provider = deployment_models[deployment].provider
+    with _build_locks_lock:
+        limiter = concurrency_limiters.get(provider)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                provider.value,
+                initial_limit=settings.concurrency_initial_limit,
+                min_limit=settings.concurrency_min_limit,
+                max_limit=settings.concurrency_max_limit,
+                queue_size=settings.concurrency_queue_size,
+                queue_timeout=settings.concurrency_queue_timeout_seconds,
+                latency_tolerance=settings.concurrency_latency_tolerance,
+            )
+            concurrency_limiters[provider] = limiter
+        return limiter
+
+
+def get_latency_window(model_key: str) -> LatencyWindow:
+    """
+    Get the recent times to first token of a model, creating the window on first use.
+
+    Args:
+        model_key (str): The key of the model.
+
+    Returns:
+        LatencyWindow: The model's recent latencies.
+    """
+    with _build_locks_lock:
+        return first_token_latencies.setdefault(model_key, LatencyWindow(settings.hedge_window))
+
+
+def _deployment_names(name: str) -> list[str]:
+    return deployments.get(name, [name])
+
+
+def get_circuit_state(name: str) -> CircuitState:
+    """
+    Get the state of the circuit around a model or a single deployment, CLOSED if it has not been called.
+
+    A model is CLOSED while any of its deployments is, and only OPEN once all of them are.
+
+    Args:
+        name (str): The unique key for the model, or the name of a deployment.
+
+    Returns:
+        CircuitState: The state of the circuit.
+    """
+    states = [
+        CircuitState.CLOSED if breaker is None else breaker.state
+        for breaker in (circuit_breakers.get(deployment) for deployment in _deployment_names(name))
+    ]
+    for state in (CircuitState.CLOSED, CircuitState.HALF_OPEN):
+        if state in states:
+            return state
+    return CircuitState.OPEN
+
+
+def get_retry_after(model_key: str) -> float:
+    """
+    Get the seconds until a deployment of a model lets a call through.
+
+    Args:
+        model_key (str): The unique key for the model.
+
+    Returns:
+        float: The seconds to wait, 0 if a deployment's circuit is not open.
+    """
+    return min(get_circuit_breaker(deployment).retry_after for deployment in _deployment_names(model_key))
+
+
+def get_deployments(model_key: str) -> list[str]:
+    """
+    Get the deployments of a model whose circuit is not open, in the order to send the next request to them.
+
+    Args:
+        model_key (str): The unique key for the model.
+
+    Returns:
+        list[str]: The deployment names, best first.
+    """
+    available = [name for name in _deployment_names(model_key) if get_circuit_state(name) != CircuitState.OPEN]
+    stats = {name: get_deployment_stats(name) for name in available}
+    return rank_deployments(available, stats, settings.load_balancing)
 
 
 def get_llm(model_key: str = DEFAULT_MODEL_KEY) -> BaseLanguageModel:
     """
-    Get the LLM for the specified model key.
+    Get the LLM for the specified model key, from its best deployment whose circuit is closed.
+
+    The circuit breakers are checked first, so callers fail fast rather than waiting on a backend that is failing. The
+    client's calls are not reported to the breakers, so a half open circuit is left for the probe of a caller that does
+    report them. The client is built without its SDK's retries, so this is for scripts and evaluations only: the service
+    sends all its calls through `routing.routed_llm`, which retries them and moves to the fallback models.
 
     Args:
         model_key (str): The unique key for the model.
@@ -53,12 +231,51 @@ def get_llm(model_key: str = DEFAULT_MODEL_KEY) -> BaseLanguageModel:
 
     Raises:
         KeyError: If the specified model is not found.
+        CircuitOpenError: If no deployment of the model has a closed circuit.
     """
-    try:
-        return model_providers[model_key]
-    except KeyError as ke:
+    if model_key not in models:
         logger.warning(f"Unable to find llm model {model_key}")
-        raise ModelKeyError(model_key) from ke
+        raise ModelKeyError(model_key)
+    for deployment in get_deployments(model_key):
+        if get_circuit_state(deployment) == CircuitState.CLOSED:
+            return build_llm(deployment)
+    raise CircuitOpenError(model_key, get_retry_after(model_key))
+
+
+def build_llm(deployment: str = DEFAULT_MODEL_KEY) -> BaseLanguageModel:
+    """
+    Get the LLM client for the specified deployment, building it on first use.
+
+    Clients are built under a lock per deployment, so concurrent first requests build a client only once and do not
+    wait for other models.
+
+    Args:
+        deployment (str): The name of the deployment, the model key for the first deployment of a model.
+
+    Returns:
+        BaseLanguageModel: The llm for the specified deployment.
+
+    Raises:
+        KeyError: If the specified deployment is not found.
+    """
+    llm = model_providers.get(deployment)
+    if llm is not None:
+        return llm
+    if deployment not in deployment_models:
+        logger.warning(f"Unable to find llm model {deployment}")
+        raise ModelKeyError(deployment)
+
+    with _build_lock(deployment):
+        llm = model_providers.get(deployment)
+        if llm is None:
+            model = deployment_models[deployment]
+            logger.debug(f"Configuring LLM for {deployment} {model.identifier}")
+            llm = init_llm(model)
+            if llm is None:
+                logger.warning(f"Unable to configure llm model {deployment} for provider {model.provider.value}")
+                raise ModelKeyError(deployment)
+            model_providers[deployment] = llm
+    return llm
 
 
 def get_model(model_key: str = DEFAULT_MODEL_KEY) -> Model:
@@ -81,143 +298,74 @@ def get_model(model_key: str = DEFAULT_MODEL_KEY) -> Model:
         raise ModelKeyError(model_key) from ke
 
 
-def init_azure_llm(model: Model) -> BaseChatModel:
+def get_provider(provider: ModelProvider) -> ModuleType | None:
     """
-    Initialize the LLM running on Azure.
+    Import the plugin module for a provider.
 
     Args:
-        model (Model): The model configuration.
+        provider (ModelProvider): The model provider.
 
     Returns:
-        AzureChatOpenAI: The initialized Azure LLM.
-    """
-    if model.family == ModelFamily.MISTRAL:
-        config = AzureMLModelConfig(**model.config)
-        return ChatMistralAI(
-            endpoint=config.endpoint,
-            api_key=config.api_key,
-            max_tokens=MAX_TOKENS,
-            temperature=0,
-            streaming=True,
-        )
-
-    if (model.family == ModelFamily.PHI or model.family == ModelFamily.LLAMA): # noqa: PLR1714
-        config = AzureMLModelConfig(**model.config)
-        return AzureMLChatOnlineEndpoint(
-            endpoint_url=config.endpoint,
-            endpoint_api_type=AzureMLEndpointApiType.serverless,
-            endpoint_api_key=config.api_key,
-            content_formatter=CustomOpenAIChatContentFormatter(),
-        )
-
-    # Default to Azure OpenAI
-    config = AzureModelConfig(**model.config)
-    return AzureChatOpenAI(
-        verbose=True,
-        temperature=0,
-        azure_deployment=model.identifier,
-        max_tokens=MAX_TOKENS,
-        api_version=config.api_version,
-        azure_endpoint=config.endpoint,
-        api_key=config.api_key,
-        streaming=True,
-    )
-
-
-def init_bedrock_llm(model: Model) -> ChatBedrock:
-    """
-    Initialize the LLM running on Bedrock.
+        ModuleType | None: The module, which exposes `init_llm(model)`, or None if the provider is not supported.
+    """
+    module = PROVIDER_MODULES.get(provider)
+    return None if module is None else importlib.import_module(module)
 
-    Args:
-        model (Model): The model configuration.
 
-    Returns:
-        ChatBedrock: The initialized Bedrock LLM.
-    """
-    config = BedrockModelConfig(**model.config)
-    boto_client = boto3.client(
-        service_name="bedrock-runtime",
-        **config.model_dump(),
-    )
-    bedrock_kwargs = {
-        "client": boto_client,
-        "model_id": model.identifier,
-        "streaming": True,
-        "model_kwargs": {"max_tokens": MAX_TOKENS},
-    }
-    # Guardrail settings
-    guardrails = {}
-    guardrailid = model.config.get("guardrailIdentifier")
-    guardrailversion = model.config.get("guardrailVersion")
-    if guardrailid is not None and guardrailversion is not None:
-        guardrails["guardrailIdentifier"] = guardrailid
-        guardrails["guardrailVersion"] = guardrailversion
-        bedrock_kwargs["guardrails"] = guardrails
-    return ChatBedrock(**bedrock_kwargs)
-
-
-def init_vertex_llm(model: Model) -> ChatVertexAI:
-    """
-    Initializes and returns a ChatVertexAI instance for the given model.
+def init_llm(model: Model) -> BaseLanguageModel | None:
+    """
+    Build the LLM client for a model with its provider's plugin.
 
     Args:
         model (Model): The model configuration.
 
     Returns:
-        ChatVertexAI: The initialized ChatVertexAI instance.
-
+        BaseLanguageModel | None: The LLM client, or None if the provider is not supported.
     """
-    credentials = service_account.Credentials.from_service_account_info(model.config)
-    vertex_setup = {
-        "credentials": credentials,
-        "model_name": model.identifier,
-        "project": model.config["project_id"],
-        "max_output_tokens": MAX_TOKENS,
-        "streaming": True,
-        "safety_settings": VERTEX_SAFETY_CONFIG,
-        "convert_system_message_to_human": True,
-    }
-    if "location" in model.config:
-        vertex_setup["location"] = model.config["location"]
-    return ChatVertexAI(**vertex_setup)
+    provider = get_provider(model.provider)
+    return None if provider is None else provider.init_llm(model)
+
+
+def prewarm_models() -> None:
+    """Build the LLM client for every registered deployment, logging any that fail."""
+    for deployment in list(deployment_models):
+        try:
+            build_llm(deployment)
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"Failed to pre-warm llm model {deployment}: {e}")
+    logger.info(f"Pre-warmed {len(model_providers)} of {len(deployment_models)} LLMs")
 
 
 def init_models() -> None:
     """
-    Loops through the model settings, for each model configures an LLM client.
+    Loops through the model settings, registering each model definition and importing its provider's plugin.
 
-    :param app: current fastapi application.
+    A model configured more than once under the same key is registered as a deployment of that key for each config.
+    The LLM clients are built when `build_llm` first asks for a deployment, or in a background thread straight away if
+    `prewarm_models` is set.
     """
     modelz = settings.models + settings.models_vertex
+    registered: dict[str, list[str]] = {}
+    registered_models: dict[str, Model] = {}
     for model in modelz:
-        if model.config is not None:
-            key = model.key
-            llm = None
-            match model.provider:
-                case ModelProvider.AZURE:
-                    llm = init_azure_llm(model)
-                case ModelProvider.BEDROCK:
-                    llm = init_bedrock_llm(model)
-                case ModelProvider.VERTEX:
-                    llm = init_vertex_llm(model)
-                case ModelProvider.ANTHROPIC:
-                    llm = ChatAnthropic(
-                        model=model.identifier,
-                        temperature=0,
-                        max_tokens=MAX_TOKENS,
-                        streaming=True,
-                        max_retries=2,
-                        api_key=model.config["ANTHROPIC_API_KEY"],
-                    )
-                case ModelProvider.HUGGINGFACE:
-                    config = HuggingfaceModelConfig(**model.config)
-                    llm = HuggingFaceEndpoint(
-                        streaming=True,
-                        repo_id=config.repo_id, huggingfacehub_api_token=config.access_token)
-            if llm is not None:
-                logger.debug(f"Configuring LLM for {key} {model.identifier}")
-                model_providers[key] = llm
-                models[key] = model
-
-    if len(model_providers) != len(modelz):
-        logger.warning(f"Configured {len(model_providers)} LLMs, but provided {len(modelz)} in settings")
+        if model.config is not None and get_provider(model.provider) is not None:
+            names = registered.setdefault(model.key, [])
+            name = model.key if not names else f"{model.key}#{len(names)}"
+            names.append(name)
+            registered_models[name] = model
+    deployments.clear()
+    deployments.update(registered)
+    deployment_models.clear()
+    deployment_models.update(registered_models)
+    rate_limiters.clear()
+    models.clear()
+    models.update({key: registered_models[names[0]] for key, names in registered.items()})
+
+    if len(deployment_models) != len(modelz):
+        logger.warning(f"Registered {len(deployment_models)} LLMs, but provided {len(modelz)} in settings")
+    for key, names in deployments.items():
+        if len(names) > 1:
+            logger.info(f"Balancing {key} across {len(names)} deployments")
+
+    if settings.prewarm_models:
+        threading.Thread(target=prewarm_models, name="prewarm-models", daemon=True).start()
@@ -0,0 +1,9 @@
+"""LLM provider plugins, one module per `ModelProvider`, each exposing `init_llm(model)` and `is_failover_error(error)`.
+
+A provider module, and the SDK it wraps, is only imported when a model of that provider is configured.
+
+The clients are built with their SDK's retries turned off, as `routing.routed_llm` retries every call the service makes,
+with one budget for every provider.
+"""
+
+MAX_TOKENS = 1536
@@ -0,0 +1,54 @@
+from functools import cached_property
+
+import anthropic
+
+from langchain_anthropic import ChatAnthropic
+
+from lab_gen.datatypes.models import Model
+from lab_gen.services.llm.http_pool import async_client, sync_client
+from lab_gen.services.llm.providers import MAX_TOKENS
+
+
+class PooledChatAnthropic(ChatAnthropic):
+    """A ChatAnthropic whose clients use the shared HTTP connection pools."""
+
+    @cached_property
+    def _client(self) -> anthropic.Client:
+        return anthropic.Client(**self._client_params, http_client=sync_client())
+
+    @cached_property
+    def _async_client(self) -> anthropic.AsyncClient:
+        return anthropic.AsyncClient(**self._client_params, http_client=async_client())
+
+
+def init_llm(model: Model) -> ChatAnthropic:
+    """
+    Initialize the LLM running on Anthropic.
+
+    Args:
+        model (Model): The model configuration.
+
+    Returns:
+        ChatAnthropic: The initialized Anthropic LLM.
+    """
+    return PooledChatAnthropic(
+        model=model.identifier,
+        temperature=0,
+        max_tokens=MAX_TOKENS,
+        streaming=True,
+        max_retries=0,
+        api_key=model.config["ANTHROPIC_API_KEY"],
+    )
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """
+    Whether an error from an Anthropic model means it is unreachable or rate limited.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    return isinstance(error, anthropic.APIConnectionError | anthropic.RateLimitError)
@@ -0,0 +1,81 @@
+from urllib.error import URLError
+
+import httpx
+import openai
+
+from langchain_community.chat_models.azureml_endpoint import AzureMLChatOnlineEndpoint, CustomOpenAIChatContentFormatter
+from langchain_community.llms.azureml_endpoint import AzureMLEndpointApiType
+from langchain_core.language_models import BaseChatModel
+from langchain_mistralai.chat_models import ChatMistralAI
+from langchain_openai import AzureChatOpenAI
+
+from lab_gen.datatypes.models import AzureMLModelConfig, AzureModelConfig, Model, ModelFamily
+from lab_gen.services.llm.http_pool import async_client, sync_client
+from lab_gen.services.llm.providers import MAX_TOKENS
+
+
+def init_llm(model: Model) -> BaseChatModel:
+    """
+    Initialize the LLM running on Azure.
+
+    Args:
+        model (Model): The model configuration.
+
+    Returns:
+        AzureChatOpenAI: The initialized Azure LLM.
+    """
+    if model.family == ModelFamily.MISTRAL:
+        config = AzureMLModelConfig(**model.config)
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {config.api_key}",
+        }
+        return ChatMistralAI(
+            endpoint=config.endpoint,
+            api_key=config.api_key,
+            max_tokens=MAX_TOKENS,
+            temperature=0,
+            streaming=True,
+            max_retries=0,
+            client=sync_client(base_url=config.endpoint, headers=headers),
+            async_client=async_client(base_url=config.endpoint, headers=headers),
+        )
+
+    if (model.family == ModelFamily.PHI or model.family == ModelFamily.LLAMA): # noqa: PLR1714
+        config = AzureMLModelConfig(**model.config)
+        return AzureMLChatOnlineEndpoint(
+            endpoint_url=config.endpoint,
+            endpoint_api_type=AzureMLEndpointApiType.serverless,
+            endpoint_api_key=config.api_key,
+            content_formatter=CustomOpenAIChatContentFormatter(),
+        )
+
+    # Default to Azure OpenAI
+    config = AzureModelConfig(**model.config)
+    return AzureChatOpenAI(
+        verbose=True,
+        temperature=0,
+        azure_deployment=model.identifier,
+        max_tokens=MAX_TOKENS,
+        api_version=config.api_version,
+        azure_endpoint=config.endpoint,
+        api_key=config.api_key,
+        streaming=True,
+        max_retries=0,
+        http_client=sync_client(),
+        http_async_client=async_client(),
+    )
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """
+    Whether an error from an Azure model means it is unreachable or rate limited.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    return isinstance(error, openai.APIConnectionError | openai.RateLimitError | httpx.TransportError | URLError)
@@ -0,0 +1,68 @@
+import boto3
+import botocore.exceptions
+
+from botocore.config import Config
+from botocore.exceptions import ClientError, HTTPClientError
+from langchain_aws.chat_models.bedrock import ChatBedrock
+
+from lab_gen.datatypes.models import BedrockModelConfig, Model
+from lab_gen.services.llm.providers import MAX_TOKENS
+from lab_gen.settings import settings
+
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "ServiceUnavailableException"}
+
+
+def init_llm(model: Model) -> ChatBedrock:
+    """
+    Initialize the LLM running on Bedrock.
+
+    Args:
+        model (Model): The model configuration.
+
+    Returns:
+        ChatBedrock: The initialized Bedrock LLM.
+    """
+    config = BedrockModelConfig(**model.config)
+    boto_client = boto3.client(
+        service_name="bedrock-runtime",
+        # botocore pools its own connections, with the same limits and timeouts as the shared httpx pools
+        config=Config(
+            retries={"total_max_attempts": 1, "mode": "standard"},
+            max_pool_connections=settings.http_max_connections,
+            connect_timeout=settings.http_connect_timeout_seconds,
+            read_timeout=settings.http_read_timeout_seconds,
+            tcp_keepalive=True,
+        ),
+        **config.model_dump(),
+    )
+    bedrock_kwargs = {
+        "client": boto_client,
+        "model_id": model.identifier,
+        "streaming": True,
+        "model_kwargs": {"max_tokens": MAX_TOKENS},
+    }
+    # Guardrail settings
+    guardrails = {}
+    guardrailid = model.config.get("guardrailIdentifier")
+    guardrailversion = model.config.get("guardrailVersion")
+    if guardrailid is not None and guardrailversion is not None:
+        guardrails["guardrailIdentifier"] = guardrailid
+        guardrails["guardrailVersion"] = guardrailversion
+        bedrock_kwargs["guardrails"] = guardrails
+    return ChatBedrock(**bedrock_kwargs)
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """
+    Whether an error from a Bedrock model means it is unreachable or throttled.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return isinstance(error, botocore.exceptions.ConnectionError | HTTPClientError)
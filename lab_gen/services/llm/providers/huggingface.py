@@ -0,0 +1,39 @@
+import requests
+
+from langchain_community.llms import HuggingFaceEndpoint
+
+from lab_gen.datatypes.models import HuggingfaceModelConfig, Model
+
+
+HTTP_TOO_MANY_REQUESTS = 429
+
+
+def init_llm(model: Model) -> HuggingFaceEndpoint:
+    """
+    Initialize the LLM running on a Hugging Face endpoint.
+
+    Args:
+        model (Model): The model configuration.
+
+    Returns:
+        HuggingFaceEndpoint: The initialized Hugging Face LLM.
+    """
+    config = HuggingfaceModelConfig(**model.config)
+    return HuggingFaceEndpoint(
+        streaming=True,
+        repo_id=config.repo_id, huggingfacehub_api_token=config.access_token)
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """
+    Whether an error from a Hugging Face endpoint means it is unreachable or rate limited.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code == HTTP_TOO_MANY_REQUESTS
+    return isinstance(error, requests.ConnectionError | requests.Timeout)
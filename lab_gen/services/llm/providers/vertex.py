@@ -0,0 +1,54 @@
+from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
+from google.oauth2 import service_account
+from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
+
+from lab_gen.datatypes.models import Model
+from lab_gen.services.llm.providers import MAX_TOKENS
+
+
+VERTEX_SAFETY_CONFIG = {
+    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+}
+
+
+def init_llm(model: Model) -> ChatVertexAI:
+    """
+    Initializes and returns a ChatVertexAI instance for the given model.
+
+    Args:
+        model (Model): The model configuration.
+
+    Returns:
+        ChatVertexAI: The initialized ChatVertexAI instance.
+
+    """
+    credentials = service_account.Credentials.from_service_account_info(model.config)
+    vertex_setup = {
+        "credentials": credentials,
+        "model_name": model.identifier,
+        "project": model.config["project_id"],
+        "max_output_tokens": MAX_TOKENS,
+        "streaming": True,
+        "safety_settings": VERTEX_SAFETY_CONFIG,
+        "convert_system_message_to_human": True,
+        "max_retries": 0,
+    }
+    if "location" in model.config:
+        vertex_setup["location"] = model.config["location"]
+    return ChatVertexAI(**vertex_setup)
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """
+    Whether an error from a Vertex model means it is unreachable or out of quota.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    return isinstance(error, ResourceExhausted | ServiceUnavailable)
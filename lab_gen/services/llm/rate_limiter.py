@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+from lab_gen.datatypes.errors import RateLimitedError
+
+
+SECONDS_PER_MINUTE = 60
+
+
+class TokenBucket:
+    """A bucket holding up to `capacity` tokens, refilled at `capacity` per minute.
+
+    Taking more than the bucket holds leaves it in debt, which the refill pays off before anything else can be taken.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.per_second = capacity / SECONDS_PER_MINUTE
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Get the seconds until the bucket holds the given amount, or is full if the amount is more than it holds.
+
+        Args:
+            amount (float): The tokens wanted.
+
+        Returns:
+            float: The seconds to wait, 0 if they can be taken now.
+        """
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self._tokens) / self.per_second)
+
+    def take(self, amount: float) -> None:
+        """
+        Take tokens from the bucket, going into debt if it does not hold enough.
+
+        Args:
+            amount (float): The tokens to take, negative to give tokens back.
+        """
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    """Keeps the requests and tokens sent to a deployment within its requests and tokens per minute quota.
+
+    Each request is charged its estimated tokens up front, and the charge is corrected once the actual usage is known.
+    A request that would have to wait more than `max_wait` seconds for the quota is shed straight away.
+    """
+
+    def __init__(self, deployment: str, rpm: int | None, tpm: int | None, max_wait: float) -> None:
+        self.deployment = deployment
+        self.requests = None if rpm is None else TokenBucket(rpm)
+        self.tokens = None if tpm is None else TokenBucket(tpm)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+
+    async def acquire(self, tokens: int) -> "RateLimitReservation":
+        """
+        Reserve a request and its estimated tokens, waiting briefly if the quota is used up.
+
+        Args:
+            tokens (int): The estimated tokens of the request, including its response.
+
+        Returns:
+            RateLimitReservation: The reservation, to correct with the actual usage.
+
+        Raises:
+            RateLimitedError: If the request would have to wait more than `max_wait` seconds.
+        """
+        with self._lock:
+            wait = max(
+                0.0 if self.requests is None else self.requests.wait_time(1),
+                0.0 if self.tokens is None else self.tokens.wait_time(tokens),
+            )
+            if wait > self.max_wait:
+                raise RateLimitedError(self.deployment, wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # The request is never sent, and no reservation is returned to correct the charge
+                self._refund(tokens)
+                raise
+        return RateLimitReservation(self, tokens)
+
+    def _refund(self, tokens: int) -> None:
+        with self._lock:
+            if self.requests is not None:
+                self.requests.take(-1)
+            if self.tokens is not None:
+                self.tokens.take(-tokens)
+
+    def adjust(self, tokens: int) -> None:
+        """
+        Charge more tokens for a request, or give them back if negative.
+
+        Args:
+            tokens (int): The tokens to charge.
+        """
+        if self.tokens is not None:
+            with self._lock:
+                self.tokens.take(tokens)
+
+
+class RateLimitReservation:
+    """The tokens charged for a request, corrected once its actual usage is known."""
+
+    def __init__(self, limiter: RateLimiter | None, tokens: int) -> None:
+        self.limiter = limiter
+        self.tokens = tokens
+
+    def reconcile(self, used: int) -> None:
+        """
+        Correct the charge for the request with the tokens it actually used.
+
+        Args:
+            used (int): The tokens used, 0 if the request failed before reaching the model.
+        """
+        if self.limiter is not None and used != self.tokens:
+            self.limiter.adjust(used - self.tokens)
+            self.tokens = used
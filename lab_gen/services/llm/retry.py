@@ -0,0 +1,143 @@
+import random
+import re
+import time
+
+from collections import Counter
+from collections.abc import Mapping
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+
+
+# Seconds of the minimum retry rate the budget can save up, so a quiet service can retry a short burst
+BUDGET_WINDOW_SECONDS = 10
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+# Azure OpenAI sends the time until each quota resets, in the format "1m30s"
+RATE_LIMIT_RESET_HEADERS = ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+
+
+def parse_duration(value: str) -> float | None:
+    """
+    Parse a duration such as "20ms", "1.5s" or "6m0s", as sent in the `x-ratelimit-reset-*` headers.
+
+    Args:
+        value (str): The duration.
+
+    Returns:
+        float | None: The duration in seconds, or None if it could not be parsed.
+    """
+    value = value.strip()
+    parts = DURATION_PART.findall(value)
+    if not parts or "".join(amount + unit for amount, unit in parts) != value:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _response_headers(error: BaseException) -> Mapping[str, str] | None:
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        # botocore keeps the response as a dict, with the headers lower cased
+        return response.get("ResponseMetadata", {}).get("HTTPHeaders")
+    return getattr(response, "headers", None)
+
+
+def _parse_retry_after(value: str) -> float | None:
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+def requested_delay(error: BaseException) -> float | None:
+    """
+    Get how long the backend asked to wait before a retry, from the headers of the response to the failed call.
+
+    `Retry-After` and `retry-after-ms` are checked first, then the Azure `x-ratelimit-reset-*` headers. The error and
+    its causes are checked, as some clients wrap the error from their SDK.
+
+    Args:
+        error (BaseException): The error raised by the client.
+
+    Returns:
+        float | None: The seconds to wait, or None if the backend did not say.
+    """
+    seen: set[int] = set()
+    current: BaseException | None = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        headers = _response_headers(current)
+        if headers:
+            if headers.get("retry-after-ms"):
+                delay = _parse_retry_after(headers["retry-after-ms"])
+                return None if delay is None else delay / 1000
+            if headers.get("retry-after"):
+                return _parse_retry_after(headers["retry-after"])
+            resets = [parse_duration(headers[name]) for name in RATE_LIMIT_RESET_HEADERS if headers.get(name)]
+            if any(reset is not None for reset in resets):
+                return max(reset for reset in resets if reset is not None)
+        current = current.__cause__ or current.__context__
+    return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Get the delay before a retry, growing exponentially with full jitter so retries from many requests spread out.
+
+    Args:
+        attempt (int): The number of retries already made, 0 for the first.
+        base_delay (float): The most to wait before the first retry.
+        max_delay (float): The most to wait before any retry.
+
+    Returns:
+        float: The seconds to wait.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))  # noqa: S311
+
+
+class RetryBudget:
+    """Caps the retries across all requests at `ratio` of the requests made, plus `min_per_second`.
+
+    Each request deposits `ratio` and each retry withdraws one, so an outage cannot multiply the load on a backend. The
+    minimum rate lets a quiet service still retry. It is used from the event loop, so needs no lock.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = max(1.0, min_per_second * BUDGET_WINDOW_SECONDS)
+        self._balance = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, amount: float = 0) -> None:
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.min_per_second + amount)
+        self._updated = now
+
+    def deposit(self) -> None:
+        """Record a request, allowing `ratio` more retries."""
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        """
+        Take a retry from the budget.
+
+        Returns:
+            bool: True if the retry may be made, False if the budget is spent.
+        """
+        self._refill()
+        if self._balance < 1:
+            return False
+        self._balance -= 1
+        return True
+
+
+class RetryStats:
+    """Counts the retries made to each provider, and the retries refused because a budget was spent."""
+
+    def __init__(self) -> None:
+        self.retried: Counter[str] = Counter()
+        self.exhausted: Counter[str] = Counter()
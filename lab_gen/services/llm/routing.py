@@ -0,0 +1,534 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from contextlib import ExitStack
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from langchain_core.messages.ai import add_usage
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableLambda
+from langchain_core.runnables.config import patch_config
+from loguru import logger
+
+from lab_gen.datatypes.errors import CircuitOpenError, ConcurrencyLimitError, FailoverError, RateLimitedError
+from lab_gen.datatypes.models import CircuitState
+from lab_gen.services.conversation.history_window import count_message_tokens, encoding
+from lab_gen.services.llm.circuit_breaker import (
+    HTTP_SERVER_ERROR_START,
+    HTTP_TOO_MANY_REQUESTS,
+    is_backend_failure,
+)
+from lab_gen.services.llm.lifetime import (
+    build_llm,
+    get_circuit_breaker,
+    get_circuit_state,
+    get_concurrency_limiter,
+    get_deployment_stats,
+    get_deployments,
+    get_latency_window,
+    get_model,
+    get_provider,
+    get_rate_limiter,
+    get_retry_after,
+    hedge_stats,
+    models,
+    retry_budget,
+    retry_stats,
+)
+from lab_gen.services.llm.providers import MAX_TOKENS
+from lab_gen.services.llm.rate_limiter import RateLimitReservation
+from lab_gen.services.llm.retry import backoff_delay, requested_delay
+from lab_gen.settings import settings
+
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable
+
+    from langchain_core.messages import BaseMessage, BaseMessageChunk
+    from langchain_core.messages.ai import UsageMetadata
+    from langchain_core.runnables import RunnableConfig
+
+    from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+    from lab_gen.services.llm.concurrency import AdaptiveLimiter
+
+
+class ModelRoute:
+    """Records which model in a fallback chain answered a turn, so the conversation can stay on it.
+
+    It also counts the retries made for the turn, which share one budget across all the models tried.
+    """
+
+    def __init__(self, model_key: str) -> None:
+        self.model_key = model_key
+        self.answered_by: str | None = None
+        self.retries = 0
+
+    @property
+    def failed_over(self) -> bool:
+        """Whether the turn was answered by a fallback rather than the requested model."""
+        return self.answered_by is not None and self.answered_by != self.model_key
+
+    def metadata_update(self) -> dict[str, Any]:
+        """
+        The conversation metadata fields to change so that later turns use the model that answered.
+
+        Returns:
+            dict[str, Any]: The fields to update, empty if the requested model answered.
+        """
+        if not self.failed_over:
+            return {}
+        model = get_model(self.answered_by)
+        return {
+            "provider": model.provider,
+            "family": model.family,
+            "variant": model.variant,
+            "modelKey": self.answered_by,
+        }
+
+
+def failover_chain(model_key: str) -> list[str]:
+    """
+    Get the models to try for a request, the requested model followed by its registered fallbacks.
+
+    Args:
+        model_key (str): The key of the requested model.
+
+    Returns:
+        list[str]: The model keys, in the order to try them.
+
+    Raises:
+        ModelKeyError: If the requested model is not found.
+    """
+    chain = [model_key]
+    for key in get_model(model_key).fallbacks:
+        if key in models and key not in chain:
+            chain.append(key)
+    return chain
+
+
+def is_failover_error(model_key: str, error: BaseException) -> bool:
+    """
+    Decide whether an error means the request should move to the next model in its chain.
+
+    Connection errors, timeouts, rate limiting, a used up quota, a provider at its concurrency limit and an open circuit
+    all move the request on. The error and its causes are checked, as some clients wrap the error from their SDK.
+
+    Args:
+        model_key (str): The key of the model that raised the error.
+        error (BaseException): The error raised.
+
+    Returns:
+        bool: True if the request should move to a fallback model.
+    """
+    provider = get_provider(get_model(model_key).provider)
+    seen: set[int] = set()
+    current: BaseException | None = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(
+            current, CircuitOpenError | RateLimitedError | ConcurrencyLimitError | ConnectionError | TimeoutError,
+        ):
+            return True
+        if getattr(current, "status_code", None) == HTTP_TOO_MANY_REQUESTS:
+            return True
+        if provider is not None and provider.is_failover_error(current):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+def is_retryable(model_key: str, error: BaseException) -> bool:
+    """
+    Decide whether a failed call is worth retrying: the errors that move a request on, and server errors.
+
+    Args:
+        model_key (str): The key of the model that raised the error.
+        error (BaseException): The error raised.
+
+    Returns:
+        bool: True if the call may succeed if made again.
+    """
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int) and status_code >= HTTP_SERVER_ERROR_START:
+        return True
+    return is_failover_error(model_key, error)
+
+
+def record_error(error: BaseException, breaker: CircuitBreaker, concurrency: AdaptiveLimiter) -> None:
+    """
+    Report an error from a deployment to its circuit breaker and its provider's concurrency limiter.
+
+    An error caused by the request itself counts as a success for the circuit and is not reported to the limiter.
+
+    Args:
+        error (BaseException): The error raised by its client.
+        breaker (CircuitBreaker): The deployment's circuit breaker.
+        concurrency (AdaptiveLimiter): The concurrency limiter of the deployment's provider.
+    """
+    if is_backend_failure(error):
+        breaker.record_failure()
+        concurrency.record_failure()
+    else:
+        breaker.record_success(0)
+
+
+def estimate_tokens(prompt: PromptValue | list[BaseMessage]) -> int:
+    """
+    Estimate the tokens a request will use, its prompt and the most its response may use.
+
+    Args:
+        prompt (PromptValue | list[BaseMessage]): The prompt sent to the model.
+
+    Returns:
+        int: The estimated tokens.
+    """
+    messages = prompt.to_messages() if isinstance(prompt, PromptValue) else prompt
+    return sum(count_message_tokens(message) for message in messages) + MAX_TOKENS
+
+
+class OpenStream(NamedTuple):
+    """A response stream from a deployment that has sent its first chunk, with the resources it holds."""
+
+    stream: AsyncIterator[BaseMessageChunk]
+    chunk: BaseMessageChunk | None
+    latency: float
+    reservation: RateLimitReservation
+    concurrency: AdaptiveLimiter
+
+
+class ModelCandidate:
+    """A model in a fallback chain, streaming from the best of its deployments that can take the request.
+
+    The deployments are tried in the order given by the load balancer. A deployment is skipped if its circuit is open,
+    or its rate limiter or its provider's concurrency limiter sheds the request. The outcome of each call, with the
+    time to its first chunk as the latency, is reported to the deployment's circuit breaker, load balancing stats and
+    concurrency limiter, and its rate limiter is charged with the tokens used. An error before the first chunk that
+    should move the request on tries the next deployment, and the last deployment is retried while the retry budgets
+    allow. Once they have all been tried the error is raised as a `FailoverError`, unless this is the last model in the
+    chain. Once a chunk has been sent the request stays on its deployment, and is never retried.
+    """
+
+    def __init__(self, model_key: str, *, failover: bool, deployments: list[str] | None = None) -> None:
+        self.model_key = model_key
+        self.failover = failover
+        self.deployments = deployments
+
+    async def _open_stream(
+        self, deployment: str, prompt: PromptValue, config: RunnableConfig, tokens: int,
+    ) -> OpenStream:
+        """Send the request to a deployment and wait for the first chunk, recording the outcome if it fails."""
+        with ExitStack() as cleanup:
+            limiter = get_rate_limiter(deployment)
+            reservation = RateLimitReservation(None, tokens) if limiter is None else await limiter.acquire(tokens)
+            cleanup.callback(reservation.reconcile, 0)
+            concurrency = get_concurrency_limiter(deployment)
+            await concurrency.acquire()
+            cleanup.callback(concurrency.release)
+            breaker = get_circuit_breaker(deployment)
+            breaker.before_call()
+            # Frees a half open circuit's probe if the request is cancelled, as that counts neither way
+            cleanup.callback(breaker.release)
+
+            stats = get_deployment_stats(deployment)
+            stats.started()
+            cleanup.callback(stats.finished, None)
+            started = time.monotonic()
+            stream = build_llm(deployment).astream(prompt, config)
+            try:
+                chunk = await anext(stream, None)
+            except BaseException as e:
+                # Closes the upstream response, rather than leaving it open until the stream is garbage collected
+                await stream.aclose()
+                if isinstance(e, Exception):
+                    record_error(e, breaker, concurrency)
+                raise
+            latency = time.monotonic() - started
+            breaker.record_success(latency)
+            concurrency.record_success(latency)
+            # The request is now in flight, so astream releases it once the stream ends
+            cleanup.pop_all()
+        return OpenStream(stream, chunk, latency, reservation, concurrency)
+
+    def _retry_delay(self, error: BaseException, attempt: int, config: RunnableConfig) -> float | None:
+        """Get the seconds to wait before retrying a failed call, or None if it should not be retried."""
+        if not is_retryable(self.model_key, error):
+            return None
+        delay = requested_delay(error)
+        if delay is None:
+            delay = backoff_delay(attempt, settings.retry_base_delay_seconds, settings.retry_max_delay_seconds)
+        elif delay > settings.retry_max_delay_seconds:
+            return None  # Better to fail over than wait that long
+
+        provider = get_model(self.model_key).provider.value
+        route = config.get("configurable", {}).get("route")
+        retries = attempt if route is None else route.retries
+        if retries >= settings.retry_max_attempts or not retry_budget.withdraw():
+            retry_stats.exhausted[provider] += 1
+            return None
+        if route is not None:
+            route.retries += 1
+        retry_stats.retried[provider] += 1
+        return max(delay, 0)
+
+    async def _open_with_retries(
+        self, deployment: str, prompt: PromptValue, config: RunnableConfig, tokens: int, *, retry: bool,
+    ) -> OpenStream:
+        """Open a stream from a deployment, retrying transient errors if `retry` is set and the budgets allow."""
+        attempt = 0
+        while True:
+            try:
+                return await self._open_stream(deployment, prompt, config, tokens)
+            except (CircuitOpenError, RateLimitedError, ConcurrencyLimitError):
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, config) if retry else None
+                if delay is None:
+                    raise
+                logger.warning(f"Retrying {deployment} in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def astream(self, prompt: PromptValue, config: RunnableConfig) -> AsyncIterator[BaseMessageChunk]:
+        """
+        Stream the model's response to the prompt.
+
+        Args:
+            prompt (PromptValue): The formatted prompt.
+            config (RunnableConfig): The configuration for the turn.
+
+        Yields:
+            BaseMessageChunk: The chunks of the response.
+        """
+        tokens = estimate_tokens(prompt)
+        retry_budget.deposit()
+        error: BaseException | None = None
+        deployments = self.deployments or get_deployments(self.model_key)
+        for deployment in deployments:
+            try:
+                # Another deployment is a better bet than waiting to retry, so only the last is retried
+                opened = await self._open_with_retries(
+                    deployment, prompt, config, tokens, retry=deployment == deployments[-1],
+                )
+            except (CircuitOpenError, RateLimitedError, ConcurrencyLimitError) as e:
+                error = e
+                continue
+            except Exception as e:
+                if not is_failover_error(self.model_key, e):
+                    raise
+                logger.warning(f"Failing over from {deployment}: {e}")
+                error = e
+                continue
+
+            get_latency_window(self.model_key).add(opened.latency)
+            route = config.get("configurable", {}).get("route")
+            if route is not None:
+                route.answered_by = self.model_key
+            usage = TokenUsage(tokens - MAX_TOKENS)
+            chunk = opened.chunk
+            try:
+                while chunk is not None:
+                    usage.add(chunk)
+                    yield chunk
+                    chunk = await anext(opened.stream, None)
+            finally:
+                get_deployment_stats(deployment).finished(opened.latency)
+                opened.concurrency.release()
+                opened.reservation.reconcile(usage.total)
+                await opened.stream.aclose()
+            return
+
+        if error is None:
+            error = CircuitOpenError(self.model_key, get_retry_after(self.model_key))
+        if self.failover:
+            raise FailoverError(self.model_key) from error
+        raise error
+
+
+class TokenUsage:
+    """Counts the tokens used by a streamed response, from its usage metadata if the model reports it."""
+
+    def __init__(self, prompt_tokens: int) -> None:
+        self.prompt_tokens = prompt_tokens
+        self.usage: UsageMetadata | None = None
+        self.text: list[str] = []
+
+    def add(self, chunk: BaseMessageChunk | str) -> None:
+        """
+        Add a chunk of the response.
+
+        Args:
+            chunk (BaseMessageChunk | str): The chunk, a string if the model is a text completion model.
+        """
+        self.text.append(chunk if isinstance(chunk, str) else chunk.text())
+        usage = getattr(chunk, "usage_metadata", None)
+        if usage:
+            self.usage = add_usage(self.usage, usage)
+
+    @property
+    def total(self) -> int:
+        """The tokens used, estimated from the prompt and the response text if the model did not report them."""
+        if self.usage:
+            return self.usage["total_tokens"]
+        return self.prompt_tokens + len(encoding.encode("".join(self.text)))
+
+
+class HedgedRoute:
+    """Sends a request to a model, and again to a second deployment or model if its first chunk is late.
+
+    The hedge is sent once the request has waited `delay` seconds for its first chunk. The first of the two to send a
+    chunk wins and streams the response, and the other is cancelled. Each runs with its own `ModelRoute`, and the turn
+    records the model of the one that won, so a hedge won by a fallback model moves the conversation as a failover does.
+    """
+
+    def __init__(self, model_key: str, primary: Runnable, hedge: ModelCandidate, delay: float) -> None:
+        self.model_key = model_key
+        self.primary = primary
+        self.hedge = hedge
+        self.delay = delay
+
+    async def astream(self, prompt: PromptValue, config: RunnableConfig) -> AsyncIterator[BaseMessageChunk]:
+        """
+        Stream the response of whichever of the request and its hedge sends the first chunk.
+
+        Args:
+            prompt (PromptValue): The formatted prompt.
+            config (RunnableConfig): The configuration for the turn.
+
+        Yields:
+            BaseMessageChunk: The chunks of the response.
+        """
+        legs: dict[asyncio.Task, tuple[AsyncIterator[BaseMessageChunk], ModelRoute]] = {}
+
+        def start(runnable: Runnable) -> asyncio.Task:
+            leg_route = ModelRoute(self.model_key)
+            configurable = {**config.get("configurable", {}), "route": leg_route}
+            stream = runnable.astream(prompt, patch_config(config, configurable=configurable))
+            task = asyncio.ensure_future(anext(stream, None))
+            legs[task] = (stream, leg_route)
+            return task
+
+        hedge_stats.requested[self.model_key] += 1
+        primary = start(self.primary)
+        winner = await self._first_chunk(legs, primary, start)
+        stream, leg_route = legs.pop(winner)
+        route = config.get("configurable", {}).get("route")
+        if route is not None:
+            route.retries += leg_route.retries
+            route.answered_by = leg_route.answered_by
+        if winner is not primary:
+            hedge_stats.won[self.model_key] += 1
+
+        chunk = winner.result()
+        try:
+            while chunk is not None:
+                yield chunk
+                chunk = await anext(stream, None)
+        finally:
+            await stream.aclose()
+
+    async def _first_chunk(
+        self,
+        legs: dict[asyncio.Task, tuple[AsyncIterator[BaseMessageChunk], ModelRoute]],
+        primary: asyncio.Task,
+        start: Callable[[Runnable], asyncio.Task],
+    ) -> asyncio.Task:
+        """Wait for the first leg to send a chunk, hedging once the delay passes and cancelling the others."""
+        error: BaseException | None = None
+        winner: asyncio.Task | None = None
+        try:
+            done, _ = await asyncio.wait([primary], timeout=self.delay)
+            if not done:
+                logger.info(f"Hedging {self.model_key} after {self.delay:.2f}s")
+                hedge_stats.hedged[self.model_key] += 1
+                start(RunnableLambda(self.hedge.astream, name=f"{self.hedge.model_key} hedge"))
+            while winner is None and legs:
+                done, _ = await asyncio.wait(legs, return_when=asyncio.FIRST_COMPLETED)
+                # The request wins a tie with its hedge
+                for task in sorted(done, key=lambda task: task is not primary):
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = task.exception()
+                    legs.pop(task)
+        finally:
+            for task, (stream, _) in list(legs.items()):
+                if task is not winner:
+                    legs.pop(task)
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    await stream.aclose()
+        if winner is None:
+            raise error
+        return winner
+
+
+def hedge_candidate(model_key: str) -> ModelCandidate | None:
+    """
+    Pick where to send the hedge of a request: the model's second best deployment, or its first available fallback.
+
+    Args:
+        model_key (str): The key of the requested model.
+
+    Returns:
+        ModelCandidate | None: The candidate to hedge with, or None if there is nowhere else to send the request.
+    """
+    deployments = get_deployments(model_key)
+    if len(deployments) > 1:
+        return ModelCandidate(model_key, failover=False, deployments=[deployments[1]])
+    for key in failover_chain(model_key)[1:]:
+        fallback_deployments = get_deployments(key)
+        if fallback_deployments:
+            return ModelCandidate(key, failover=False, deployments=fallback_deployments[:1])
+    return None
+
+
+def hedge_delay(model_key: str) -> float:
+    """
+    Get how long a request waits for its first chunk before it is hedged, a percentile of the model's recent calls.
+
+    Args:
+        model_key (str): The key of the requested model.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    window = get_latency_window(model_key)
+    if len(window) < settings.hedge_min_samples:
+        return settings.hedge_initial_delay_seconds
+    return window.percentile(settings.hedge_percentile)
+
+
+def routed_llm(model_key: str, *, hedge: bool = False) -> Runnable:
+    """
+    Create the runnable that sends a prompt to a model, moving to its fallbacks when it is unavailable.
+
+    Models whose deployments all have an open circuit are left out of the chain. Each remaining model is tried in turn
+    until one sends its first chunk.
+
+    Args:
+        model_key (str): The key of the requested model.
+        hedge (bool): Whether to hedge the request, for latency critical prompts.
+
+    Returns:
+        Runnable: The runnable to use in place of the model's client.
+
+    Raises:
+        ModelKeyError: If the requested model is not found.
+        CircuitOpenError: If the circuit of every model in the chain is open.
+    """
+    chain = failover_chain(model_key)
+    available = [key for key in chain if get_circuit_state(key) != CircuitState.OPEN]
+    if not available:
+        raise CircuitOpenError(model_key, get_retry_after(model_key))
+    candidates = [
+        RunnableLambda(ModelCandidate(key, failover=key != available[-1]).astream, name=key) for key in available
+    ]
+    routed = candidates[0]
+    if len(candidates) > 1:
+        routed = routed.with_fallbacks(candidates[1:], exceptions_to_handle=(FailoverError,))
+    hedged_by = hedge_candidate(model_key) if hedge else None
+    if hedged_by is None:
+        return routed
+    return RunnableLambda(HedgedRoute(model_key, routed, hedged_by, hedge_delay(model_key)).astream, name=model_key)
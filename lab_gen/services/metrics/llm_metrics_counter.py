@@ -4,18 +4,54 @@ from typing import Any
 
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from loguru import logger
 
+from lab_gen.services.conversation.history_window import TOKEN_COUNT_KEY, encoding
+
 
 class LLMMetricsCounter(BaseCallbackHandler):
-    """A callback handler that counts the number of tokens used in a conversation service."""
-    def __init__(self, llm: BaseLanguageModel) -> None:
+    """A callback handler that counts the number of tokens used in a conversation service.
+
+    Without a model the tokens are counted with the cl100k encoding, so the count does not depend on which model in a
+    fallback chain answers.
+
+    The prompt and the timings are taken from the first call of the turn. Retries, fallbacks and hedges send the same
+    prompt again with the same callbacks, and would otherwise count its tokens more than once and restart the clock.
+    """
+    def __init__(self, llm: BaseLanguageModel | None = None) -> None:
         self.llm = llm
         self.input_tokens = 0
         self.output_tokens = 0
-        self._start_time = 0
+        self._start_time: float | None = None
         self.request_duration_seconds = 0
+        self.first_token_seconds: float | None = None
+        self.history_token_budget = 0
+        self.history_tokens = 0
+        self.history_messages_trimmed = 0
+
+    def record_history_window(self, tokens: int, trimmed: int) -> None:
+        """
+        Record the history sent with the prompt after it was fitted to `history_token_budget`.
+
+        :param tokens: The approximate tokens of history sent.
+        :param trimmed: The number of messages trimmed from the history.
+        :return: None
+        """
+        self.history_tokens = tokens
+        self.history_messages_trimmed = trimmed
+        if trimmed:
+            logger.debug(f"Trimmed {trimmed} messages to fit a history budget of {self.history_token_budget} tokens.")
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens in a text, with the counter's model if it has one.
+
+        :param text: The text to count.
+        :return: The number of tokens.
+        """
+        return len(encoding.encode(text)) if self.llm is None else self.llm.get_num_tokens(text)
 
     def on_llm_start(self, serialized: dict[str, Any], prompts: list[str], **kwargs: Any) -> None: # noqa: ARG002, ANN401
         """
@@ -26,11 +62,59 @@ class LLMMetricsCounter(BaseCallbackHandler):
         :param kwargs: Additional keyword arguments.
         :return: None
         """
+        if self._start_time is not None:
+            return
         for p in prompts:
-            self.input_tokens += self.llm.get_num_tokens(p)
+            self.input_tokens += self.count_tokens(p)
 
         self._start_time = time.time()
 
+    def on_chat_model_start(
+        self, serialized: dict[str, Any], messages: list[list[BaseMessage]], **kwargs: Any,  # noqa: ARG002, ANN401
+    ) -> None:
+        """
+        Update input tokens from the chat messages, using the token counts stored with the history.
+
+        Only messages without a stored count, such as the new input, are tokenised, so the cost does not grow with the
+        length of the conversation.
+
+        :param serialized: The serialized data.
+        :param messages: The lists of messages sent to the model.
+        :param kwargs: Additional keyword arguments.
+        :return: None
+        """
+        if self._start_time is not None:
+            return
+        for prompt in messages:
+            for message in prompt:
+                stored = message.response_metadata.get(TOKEN_COUNT_KEY)
+                self.input_tokens += stored if stored is not None else self.count_tokens(message.text())
+
+        self._start_time = time.time()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:  # noqa: ARG002, ANN401
+        """
+        Record the time to the first token of a streamed response.
+
+        :param token: The new token.
+        :param kwargs: Additional keyword arguments.
+        :return: None
+        """
+        if self.first_token_seconds is None and self._start_time is not None:
+            self.first_token_seconds = time.time() - self._start_time
+
+    def usage(self) -> dict[str, Any]:
+        """
+        The tokens and timings of the request, as sent to a client.
+
+        :return: The input and output tokens, and the seconds to the first token and to the end of the response.
+        """
+        return {
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "first_token_seconds": self.first_token_seconds,
+            "duration_seconds": self.request_duration_seconds,
+        }
 
     def on_llm_end(self, response: RunnableWithMessageHistory, **kwargs: Any)  -> None: # noqa: ARG002, ANN401
         """
@@ -42,7 +126,8 @@ class LLMMetricsCounter(BaseCallbackHandler):
         """
         results = response.flatten()
         for r in results:
-            self.output_tokens = self.llm.get_num_tokens(r.generations[0][0].text)
+            self.output_tokens = self.count_tokens(r.generations[0][0].text)
 
-        self.request_duration_seconds = time.time() - self._start_time
+        if self._start_time is not None:
+            self.request_duration_seconds = time.time() - self._start_time
         logger.debug(f"Request took {self.request_duration_seconds} seconds.")
@@ -1,11 +1,15 @@
+from collections.abc import Callable, Iterable
 from enum import Enum
 
 from azure.monitor.opentelemetry import configure_azure_monitor
 from fastapi import FastAPI
 from loguru import logger
 from opentelemetry import metrics
+from opentelemetry.metrics import CallbackOptions, Observation
 from opentelemetry.sdk.metrics import Counter, Histogram
 
+from lab_gen.services.llm.http_pool import pool_usage
+from lab_gen.services.llm.lifetime import hedge_stats, retry_stats
 from lab_gen.services.metrics.llm_metrics_counter import LLMMetricsCounter
 from lab_gen.settings import settings
 
@@ -21,12 +25,18 @@ class Metric(Enum):
     COUNT_COMPLETION_TOKENS = "completion_tokens_counter"
     COUNT_ERRORS = "error_code_counter"
     COUNT_CONTENT_FILTERED = "content_filtered_counter"
+    COUNT_CANCELLED = "cancelled_streams_counter"
     TIMER_LLM_REQUESTS = "llm_request_timer"
     COUNT_SUCCESSFUL_JSON = "successful_json_counter"
     COUNT_FIXED_JSON = "fixed_json_counter"
     COUNT_FAILED_JSON = "failed_json_counter"
     COUNT_VOTE_UP = "feedback_positive_counter"
     COUNT_VOTE_DOWN = "feedback_negative_counter"
+    COUNT_HISTORY_CACHE_HITS = "history_cache_hits_counter"
+    COUNT_HISTORY_CACHE_MISSES = "history_cache_misses_counter"
+    COUNT_RETRIES = "llm_retries_counter"
+    COUNT_HEDGES = "llm_hedges_counter"
+    GAUGE_HTTP_POOL_CONNECTIONS = "http_pool_connections_gauge"
 
 
 class MetricsService:
@@ -60,6 +70,8 @@ class MetricsService:
                 meter.create_histogram(Metric.TIMER_LLM_REQUESTS.value))
         setattr(self._app.state, Metric.COUNT_CONTENT_FILTERED.value,
                 meter.create_counter(Metric.COUNT_CONTENT_FILTERED.value))
+        setattr(self._app.state, Metric.COUNT_CANCELLED.value,
+                meter.create_counter(Metric.COUNT_CANCELLED.value))
         setattr(self._app.state, Metric.COUNT_SUCCESSFUL_JSON.value,
                 meter.create_counter(Metric.COUNT_SUCCESSFUL_JSON.value))
         setattr(self._app.state, Metric.COUNT_FIXED_JSON.value,
@@ -70,6 +82,54 @@ class MetricsService:
                 meter.create_counter(Metric.COUNT_VOTE_UP.value))
         setattr(self._app.state, Metric.COUNT_VOTE_DOWN.value,
                 meter.create_counter(Metric.COUNT_VOTE_DOWN.value))
+        setattr(self._app.state, Metric.COUNT_HISTORY_CACHE_HITS.value,
+                meter.create_observable_counter(Metric.COUNT_HISTORY_CACHE_HITS.value,
+                                                callbacks=[self._observe_history_cache("hits")]))
+        setattr(self._app.state, Metric.COUNT_HISTORY_CACHE_MISSES.value,
+                meter.create_observable_counter(Metric.COUNT_HISTORY_CACHE_MISSES.value,
+                                                callbacks=[self._observe_history_cache("misses")]))
+        setattr(self._app.state, Metric.COUNT_RETRIES.value,
+                meter.create_observable_counter(Metric.COUNT_RETRIES.value, callbacks=[self._observe_retries]))
+        setattr(self._app.state, Metric.COUNT_HEDGES.value,
+                meter.create_observable_counter(Metric.COUNT_HEDGES.value, callbacks=[self._observe_hedges]))
+        setattr(self._app.state, Metric.GAUGE_HTTP_POOL_CONNECTIONS.value,
+                meter.create_observable_gauge(Metric.GAUGE_HTTP_POOL_CONNECTIONS.value,
+                                              callbacks=[self._observe_http_pools]))
+
+    def _observe_history_cache(self, counter: str) -> Callable[[CallbackOptions], Iterable[Observation]]:
+        """Create a callback reporting one of the history cache counters."""
+        def observe(_options: CallbackOptions) -> Iterable[Observation]:
+            conversation = getattr(self._app.state, "conversation_provider", None)
+            if conversation is None:
+                return []
+            return [Observation(getattr(conversation.history_cache, counter), {"environment": settings.environment})]
+        return observe
+
+    def _observe_retries(self, _options: CallbackOptions) -> Iterable[Observation]:
+        """Report the retries of model calls made to each provider, and those refused because a budget was spent."""
+        return [
+            Observation(count, {"environment": settings.environment, "provider": provider, "outcome": outcome})
+            for outcome, counts in [("retried", retry_stats.retried), ("exhausted", retry_stats.exhausted)]
+            for provider, count in counts.items()
+        ]
+
+    def _observe_hedges(self, _options: CallbackOptions) -> Iterable[Observation]:
+        """Report, for each model, the requests that asked to be hedged, those that were and those the hedge won."""
+        return [
+            Observation(count, {"environment": settings.environment, "model": model_key, "outcome": outcome})
+            for outcome, counts in [
+                ("requested", hedge_stats.requested), ("hedged", hedge_stats.hedged), ("won", hedge_stats.won),
+            ]
+            for model_key, count in counts.items()
+        ]
+
+    def _observe_http_pools(self, _options: CallbackOptions) -> Iterable[Observation]:
+        """Report the connections in the shared HTTP pools that are handling a request, and those kept alive."""
+        return [
+            Observation(count, {"environment": settings.environment, "pool": pool, "state": state})
+            for pool, usage in pool_usage().items()
+            for state, count in usage.items()
+        ]
 
     def increment(self, metric: Metric, meta: dict, value: float = 1, custom_meta: dict[str, str] = {}) -> None:  # noqa: B006
         """
@@ -34,6 +34,36 @@ class LogLevel(str, enum.Enum):
     FATAL = "FATAL"
 
 
+class ChatHistoryStore(str, enum.Enum):
+    """Local chat history stores, used when Cosmos DB is not available."""
+
+    FILE = "FILE"
+    JSONL = "JSONL"
+    SQLITE = "SQLITE"
+
+
+class HistoryCompression(str, enum.Enum):
+    """Compression applied to large messages in the chat history."""
+
+    NONE = "NONE"
+    GZIP = "GZIP"
+    ZSTD = "ZSTD"
+
+
+class HistoryMemory(str, enum.Enum):
+    """How the history sent with each turn is kept within its token budget."""
+
+    WINDOW = "WINDOW"
+    SUMMARY = "SUMMARY"
+
+
+class LoadBalancing(str, enum.Enum):
+    """How requests are spread across the deployments of a model key."""
+
+    LEAST_OUTSTANDING = "LEAST_OUTSTANDING"
+    EWMA = "EWMA"
+
+
 class AzureSettingsSource(PydanticBaseSettingsSource):
     """A settings source that gets it data from Azure App Configuration."""
 
@@ -126,6 +156,21 @@ class Settings(BaseSettings):
     static_dir: Path = APP_DIR / "static"
     prompts_dir: Path = APP_DIR / "templates"
     chat_history_dir: Path = APP_DIR.parent / "filestorage"
+    # Format used by the local chat history store
+    chat_history_store: ChatHistoryStore = ChatHistoryStore.FILE
+    # Limits for the in-process cache of loaded histories, off by default with a size of 0
+    history_cache_size: int = 0
+    history_cache_ttl: int = 300
+    history_cache_max_bytes: int = 64 * 1024 * 1024
+    # Compression for stored messages, only messages of at least the minimum size are compressed
+    history_compression: HistoryCompression = HistoryCompression.NONE
+    history_compression_min_bytes: int = 1024
+    # Tokens of history replayed on each turn, unless the model sets its own history_token_budget
+    history_token_budget: int = 6000
+    # SUMMARY condenses older turns into a stored summary once the unsummarised history passes the threshold in tokens
+    history_memory: HistoryMemory = HistoryMemory.WINDOW
+    history_summary_threshold: int = 3000
+    history_summary_recent_turns: int = 2
     # Endpoint for opentelemetry.
     # E.G. http://localhost:4317
     opentelemetry_endpoint: str | None = None
@@ -136,6 +181,63 @@ class Settings(BaseSettings):
     azure_monitor_connection_string: str | None = Field(default=None, alias="APPLICATIONINSIGHTS_CONNECTION_STRING")
     models: list[Model] = Field(alias="AZURE_MODELS")
     models_vertex: list[Model] = Field(default=[], alias="AZURE_MODELS_VERTEX")
+    # Build every LLM client in the background at startup, rather than on first use
+    prewarm_models: bool = False
+    # Each model's circuit opens once this share of its last calls failed or were slow, for open seconds
+    circuit_breaker_failure_rate: float = 0.5
+    circuit_breaker_window: int = 20
+    circuit_breaker_min_calls: int = 5
+    circuit_breaker_open_seconds: float = 30
+    circuit_breaker_slow_call_seconds: float = 30
+    # Models configured more than once under the same key are deployments, balanced with this policy
+    load_balancing: LoadBalancing = LoadBalancing.LEAST_OUTSTANDING
+    # Seconds a request may wait for a deployment's rpm and tpm quota before it is shed
+    rate_limit_max_wait_seconds: float = 2
+    # Each provider's requests in flight are limited, growing while its time to first token stays within the tolerance
+    # of its baseline and shrinking when it rises or calls fail. Requests over the limit queue for the timeout
+    concurrency_initial_limit: int = 20
+    concurrency_min_limit: int = 1
+    concurrency_max_limit: int = 200
+    concurrency_queue_size: int = 100
+    concurrency_queue_timeout_seconds: float = 5
+    concurrency_latency_tolerance: float = 2
+    # Calls that fail before their first token are retried up to max attempts per request, waiting as long as the
+    # backend asks or backing off exponentially with jitter. Across requests, retries are capped at the budget ratio
+    # of the requests made, plus a minimum per second
+    retry_max_attempts: int = 2
+    retry_base_delay_seconds: float = 0.5
+    retry_max_delay_seconds: float = 10
+    retry_budget_ratio: float = 0.1
+    retry_budget_min_per_second: float = 1
+    # A request that opts in to hedging is sent to a second deployment or fallback model if its first token is later
+    # than this percentile of the model's last calls, or the initial delay until there are min samples of them
+    hedge_percentile: float = 0.95
+    hedge_window: int = 100
+    hedge_min_samples: int = 20
+    hedge_initial_delay_seconds: float = 2
+    # The HTTP connection pools shared by the provider clients, using HTTP/2 if it is on and the h2 package installed
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30
+    http_connect_timeout_seconds: float = 5
+    http_read_timeout_seconds: float = 60
+    http2: bool = True
+    # Seconds without an event before a Server-Sent Events stream sends a keep-alive comment
+    sse_keep_alive_seconds: float = 15
+    # An answer can be stopped from any worker, those on other workers are signalled with a file in this directory,
+    # which the streaming worker checks for at this interval
+    stop_signal_dir: Path = APP_DIR.parent / "filestorage" / "stop"
+    stop_poll_seconds: float = 0.5
+    # Server-Sent Events answers keep their last max events for a client that reconnects, for ttl seconds once finished.
+    # An answer keeps going for the grace seconds while no client is following it
+    replay_max_events: int = 2000
+    replay_ttl_seconds: float = 60
+    replay_grace_seconds: float = 30
+    # Streamed chunks are buffered and sent together once they reach the bytes or have waited the seconds. Endpoints can
+    # set their own limits by name, e.g. {"start_file_conversation": [4096, 0.05]}
+    stream_coalesce_bytes: int = 512
+    stream_coalesce_seconds: float = 0.02
+    stream_coalesce_endpoints: dict[str, tuple[int, float]] = {}
 
     session_store_uri: str
     session_store_key: str
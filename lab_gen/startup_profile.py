@@ -0,0 +1,81 @@
+import subprocess
+import sys
+import time
+
+from typing import NamedTuple
+
+
+IMPORT_TIME_PREFIX = "import time:"
+# Imports the application and registers the models, as a worker does before it serves requests
+STARTUP_CODE = (
+    "from lab_gen.web.application import get_app\n"
+    "from lab_gen.services.llm.lifetime import init_models\n"
+    "get_app()\n"
+    "init_models()\n"
+)
+
+
+class ImportTime(NamedTuple):
+    """The time taken to import a module, on its own and including the modules it imported."""
+
+    module: str
+    self_us: int
+    cumulative_us: int
+
+
+def parse_import_times(output: str) -> list[ImportTime]:
+    """
+    Parse the report written to stderr by `python -X importtime`.
+
+    Args:
+        output (str): The stderr of the profiled process.
+
+    Returns:
+        list[ImportTime]: The import time of each module, in the order they finished importing.
+    """
+    times = []
+    for line in output.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        self_us, cumulative_us, module = line.removeprefix(IMPORT_TIME_PREFIX).split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # The header line
+        # Nested imports are indented after the single space that follows the separator
+        times.append(ImportTime(module.removeprefix(" ").rstrip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def profile_startup(limit: int = 25) -> str:
+    """
+    Profile the imports made when a worker starts, in a fresh interpreter so nothing is already imported.
+
+    Args:
+        limit (int): The number of slowest modules to report.
+
+    Returns:
+        str: The report.
+    """
+    started = time.perf_counter()
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", STARTUP_CODE],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        return f"Startup failed:\n{result.stderr[-2000:]}"
+
+    times = parse_import_times(result.stderr)
+    top_level = [t for t in times if not t.module.startswith(" ")]
+    lines = [
+        f"Startup took {elapsed:.2f}s, importing {len(times)} modules "
+        f"in {sum(t.cumulative_us for t in top_level) / 1e6:.2f}s",
+        "",
+        f"{'cumulative (ms)':>16} {'self (ms)':>10}  module",
+    ]
+    lines.extend(
+        f"{t.cumulative_us / 1000:>16.1f} {t.self_us / 1000:>10.1f}  {t.module.strip()}"
+        for t in sorted(top_level, key=lambda t: t.cumulative_us, reverse=True)[:limit]
+    )
+    return "\n".join(lines)
@@ -0,0 +1,85 @@
+from collections.abc import Iterator
+
+import pytest
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, CircuitState
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.balancer import DeploymentStats, rank_deployments
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.routing import ModelRoute, routed_llm
+from lab_gen.settings import LoadBalancing, settings
+from lab_gen.tests.unit.test_routing import UnreachableChatModel
+
+
+SECOND_DEPLOYMENT = f"{DEFAULT_MODEL_KEY}#1"
+
+
+@pytest.fixture()
+def two_deployments(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """Configure the default model twice, so it has two deployments."""
+    default = next(model for model in settings.models if model.key == DEFAULT_MODEL_KEY)
+    monkeypatch.setattr(settings, "models", [*settings.models, default.model_copy(update={"location": "EU"})])
+    lifetime.init_models()
+    yield
+    monkeypatch.undo()
+    lifetime.init_models()
+
+
+def test_least_outstanding() -> None:
+    """Test that the deployment with the fewest requests in flight is ranked first."""
+    stats = {"a": DeploymentStats(), "b": DeploymentStats()}
+    stats["a"].started()
+
+    assert rank_deployments(["a", "b"], stats, LoadBalancing.LEAST_OUTSTANDING) == ["b", "a"]
+    stats["b"].started()
+    assert rank_deployments(["a", "b"], stats, LoadBalancing.LEAST_OUTSTANDING) == ["a", "b"]
+
+
+def test_ewma_latency() -> None:
+    """Test that the deployment with the lowest moving average latency is ranked first."""
+    stats = {"a": DeploymentStats(), "b": DeploymentStats()}
+    for name, latency in [("a", 2.0), ("b", 0.5)]:
+        stats[name].started()
+        stats[name].finished(latency)
+
+    assert rank_deployments(["a", "b"], stats, LoadBalancing.EWMA) == ["b", "a"]
+    stats["b"].started()
+    stats["b"].finished(10.0)
+    assert rank_deployments(["a", "b"], stats, LoadBalancing.EWMA) == ["a", "b"]
+
+
+@pytest.mark.usefixtures("two_deployments")
+def test_repeated_models_are_deployments() -> None:
+    """Test that a model configured twice under one key is registered as two deployments of it."""
+    assert lifetime.deployments[DEFAULT_MODEL_KEY] == [DEFAULT_MODEL_KEY, SECOND_DEPLOYMENT]
+    assert lifetime.deployment_models[SECOND_DEPLOYMENT].location == "EU"
+    assert lifetime.models[DEFAULT_MODEL_KEY].location != "EU"
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("two_deployments")
+async def test_unreachable_deployment_is_skipped(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a request moves to another deployment of the same model, which keeps its own circuit."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, UnreachableChatModel(responses=[]))
+    monkeypatch.setitem(lifetime.model_providers, SECOND_DEPLOYMENT, FakeListChatModel(responses=["From the EU"]))
+    for name in lifetime.deployments[DEFAULT_MODEL_KEY]:
+        monkeypatch.setitem(
+            lifetime.circuit_breakers,
+            name,
+            CircuitBreaker(name, failure_rate=0.5, window=10, min_calls=1, open_seconds=30, slow_call_seconds=30),
+        )
+    route = ModelRoute(DEFAULT_MODEL_KEY)
+
+    response = await routed_llm(DEFAULT_MODEL_KEY).ainvoke(
+        [HumanMessage(content="Hello")], {"configurable": {"route": route}},
+    )
+
+    assert response.content == "From the EU"
+    assert not route.failed_over
+    assert lifetime.get_circuit_state(DEFAULT_MODEL_KEY) == CircuitState.CLOSED
+    assert lifetime.get_circuit_state(SECOND_DEPLOYMENT) == CircuitState.CLOSED
+    assert lifetime.circuit_breakers[DEFAULT_MODEL_KEY].state == CircuitState.OPEN
+    assert lifetime.get_deployment_stats(SECOND_DEPLOYMENT).outstanding == 0
@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.prompt_values import ChatPromptValue
+from starlette import status
+
+from lab_gen.datatypes.errors import CircuitOpenError
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, CircuitState
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.routing import ModelCandidate
+
+
+def make_breaker(open_seconds: float = 30) -> CircuitBreaker:
+    """Create a breaker that opens once half of at least four calls have failed."""
+    return CircuitBreaker(
+        "TEST", failure_rate=0.5, window=10, min_calls=4, open_seconds=open_seconds, slow_call_seconds=1,
+    )
+
+
+class StatusError(Exception):
+    """An error from a model client with an HTTP status code."""
+
+    def __init__(self, status_code: int) -> None:
+        super().__init__(f"Status {status_code}")
+        self.status_code = status_code
+
+
+def test_circuit_opens_on_error_rate() -> None:
+    """Test that the circuit opens once enough calls fail, and then fails fast."""
+    breaker = make_breaker()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitState.CLOSED
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitState.OPEN
+    with pytest.raises(CircuitOpenError) as coe:
+        breaker.before_call()
+    assert 0 < coe.value.retry_after <= 30  # noqa: PLR2004
+
+
+def test_slow_calls_count_as_failures() -> None:
+    """Test that calls slower than the limit open the circuit."""
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_success(5)
+
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_half_open_allows_one_probe() -> None:
+    """Test that a single probe is allowed once the circuit has been open long enough, closing it on success."""
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    breaker.before_call()
+    breaker.open_seconds = 30
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success(0.1)
+
+    assert breaker.state == CircuitState.CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_reopens() -> None:
+    """Test that the circuit opens again when the probe fails."""
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.open_seconds = 30
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitState.OPEN
+
+
+@pytest.mark.anyio()
+async def test_cancelled_call_frees_probe(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a routed call cancelled before its first token counts neither way, and frees the probe."""
+    lifetime.init_models()
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure()
+    monkeypatch.setitem(lifetime.circuit_breakers, DEFAULT_MODEL_KEY, breaker)
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Slow"], sleep=1))
+    stream = ModelCandidate(DEFAULT_MODEL_KEY, failover=False).astream(
+        ChatPromptValue(messages=[HumanMessage(content="Hi")]), {},
+    )
+    waiting = asyncio.ensure_future(anext(stream))
+    await asyncio.sleep(0.05)
+    breaker.open_seconds = 30
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.before_call()
+
+
+def test_get_llm_leaves_probe(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that getting a client, whose calls are not reported, does not take the probe of a half open circuit."""
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record_failure()
+    monkeypatch.setitem(lifetime.circuit_breakers, DEFAULT_MODEL_KEY, breaker)
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Unused"]))
+
+    with pytest.raises(CircuitOpenError):
+        lifetime.get_llm(DEFAULT_MODEL_KEY)
+    breaker.open_seconds = 30
+
+    breaker.before_call()
+
+
+def test_open_circuit_returns_503(fastapi_app: FastAPI, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a conversation with a model whose circuit is open fails fast, and the state is reported."""
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    monkeypatch.setitem(lifetime.circuit_breakers, DEFAULT_MODEL_KEY, breaker)
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Unused"]))
+
+    with TestClient(fastapi_app) as test_client:
+        response = test_client.post(
+            fastapi_app.url_path_for("start_conversation"),
+            headers={"Authorization": "pytest_key", "x-business-user": "123"},
+            json={"content": "Hello"},
+        )
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert int(response.headers["Retry-After"]) > 0
+
+        response = test_client.get(fastapi_app.url_path_for("read_models"))
+        circuits = {model["key"]: model["circuit"] for model in response.json()}
+        assert circuits[DEFAULT_MODEL_KEY] == CircuitState.OPEN
+
+        response = test_client.get(fastapi_app.url_path_for("health_check"))
+        assert response.json()["detail"]["models"][DEFAULT_MODEL_KEY] == CircuitState.OPEN
@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from lab_gen.datatypes.errors import ConcurrencyLimitError
+from lab_gen.services.llm.concurrency import BACKOFF_RATIO, AdaptiveLimiter
+
+
+INITIAL_LIMIT = 4
+
+
+def create_limiter(limit: int = INITIAL_LIMIT, queue_size: int = 1, queue_timeout: float = 1) -> AdaptiveLimiter:
+    """Create a limiter for a test provider."""
+    return AdaptiveLimiter(
+        "TEST",
+        initial_limit=limit,
+        min_limit=1,
+        max_limit=10,
+        queue_size=queue_size,
+        queue_timeout=queue_timeout,
+        latency_tolerance=2,
+    )
+
+
+def test_limit_follows_latency() -> None:
+    """Test that the limit grows while latency stays near its baseline, and shrinks when it rises or calls fail."""
+    limiter = create_limiter()
+    for _ in range(8):
+        limiter.record_success(1.0)
+    grown = limiter.limit
+    assert grown > INITIAL_LIMIT
+
+    limiter.record_success(5.0)
+    assert limiter.limit == pytest.approx(grown * BACKOFF_RATIO)
+    for _ in range(20):
+        limiter.record_failure()
+    assert limiter.limit == limiter.min_limit
+
+
+@pytest.mark.anyio()
+async def test_request_over_limit_waits_for_slot() -> None:
+    """Test that a request over the limit waits in the queue until a slot is released."""
+    limiter = create_limiter(limit=1)
+    await limiter.acquire()
+
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    limiter.release()
+    await waiting
+    assert limiter.in_flight == 1
+
+
+@pytest.mark.anyio()
+async def test_request_rejected_when_queue_full_or_deadline_passes() -> None:
+    """Test that a request is rejected straight away when the queue is full, and after waiting past its deadline."""
+    limiter = create_limiter(limit=1, queue_size=1, queue_timeout=0.05)
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(ConcurrencyLimitError):
+        await limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError):
+        await waiting
+    assert limiter.in_flight == 1
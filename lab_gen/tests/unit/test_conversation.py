@@ -1,9 +1,27 @@
+import asyncio
+import json
+
 import pytest
 
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import Generation, LLMResult
 from starlette import status
 
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY
+from lab_gen.services.chat_history.file_chat import FileChatHistory
+from lab_gen.services.chat_history.sqlite_chat import SqliteChatHistory
+from lab_gen.services.chat_history.write_batch import HistoryWriteBatch
+from lab_gen.services.conversation.block_content import BEDROCK_CONTENT_FILTER_REASON, BlockedContentTracker
+from lab_gen.services.conversation.conversation import ConversationService
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.routing import ModelRoute
+from lab_gen.settings import ChatHistoryStore, HistoryMemory, settings
+from lab_gen.tests.unit.test_write_batch import CountingHistory
+
 
 @pytest.mark.anyio()
 def test_delete_conversation(fastapi_app: FastAPI) -> None:
@@ -55,3 +73,303 @@ def test_conversation_history(fastapi_app: FastAPI) -> None:
         assert response.status_code == status.HTTP_404_NOT_FOUND
         response = test_client.get(url)
         assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_start_conversation_saves_turn(
+    fastapi_app: FastAPI, mock_openai_chatcompletion, monkeypatch: pytest.MonkeyPatch,  # noqa: ARG001, ANN001
+) -> None:
+    """Test that the turn is saved once the response has been sent."""
+    monkeypatch.setattr(settings, "history_cache_size", 16)
+    with TestClient(fastapi_app) as test_client:
+        headers = {"Authorization": "pytest_key", "x-business-user": "123"}
+        response = test_client.post(fastapi_app.url_path_for("start_conversation"), headers=headers,
+                                    json={"content": "What is the capital of France?"})
+        conversation_id = response.headers["X-conversation-id"]
+
+        url = fastapi_app.url_path_for("conversation_history", conversationId=conversation_id)
+        response = test_client.get(url, headers=headers)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == [
+            {"role": "human", "content": "What is the capital of France?"},
+            {"role": "ai", "content": "The capital of France is Paris."},
+        ]
+
+        history = fastapi_app.state.conversation_provider.history_cache.get("123", conversation_id)
+        token_counts = [m.response_metadata["token_count"] for m in history.messages]
+        assert all(token_counts)
+        assert history.metadata.history_tokens == sum(token_counts)
+
+
+def test_history_is_cached(
+    fastapi_app: FastAPI, mock_openai_chatcompletion, monkeypatch: pytest.MonkeyPatch,  # noqa: ARG001, ANN001
+) -> None:
+    """Test that reading a conversation again is served from the cache, and ending it removes it."""
+    monkeypatch.setattr(settings, "history_cache_size", 16)
+    with TestClient(fastapi_app) as test_client:
+        history_cache = fastapi_app.state.conversation_provider.history_cache
+        headers = {"Authorization": "pytest_key", "x-business-user": "123"}
+        response = test_client.post(fastapi_app.url_path_for("start_conversation"), headers=headers,
+                                    json={"content": "What is the capital of France?"})
+        conversation_id = response.headers["X-conversation-id"]
+
+        hits = history_cache.hits
+        url = fastapi_app.url_path_for("conversation_history", conversationId=conversation_id)
+        assert test_client.get(url, headers=headers).status_code == status.HTTP_200_OK
+        assert history_cache.hits == hits + 1
+
+        url = fastapi_app.url_path_for("end_conversation", conversationId=conversation_id)
+        assert test_client.delete(url, headers=headers).status_code == status.HTTP_200_OK
+        assert history_cache.get("123", conversation_id) is None
+
+
+def test_cached_history_written_elsewhere_is_reloaded(
+    fastapi_app: FastAPI, mock_openai_chatcompletion, monkeypatch: pytest.MonkeyPatch,  # noqa: ARG001, ANN001
+) -> None:
+    """Test that a cached conversation that another worker has written since is loaded again from the store."""
+    monkeypatch.setattr(settings, "history_cache_size", 16)
+    with TestClient(fastapi_app) as test_client:
+        headers = {"Authorization": "pytest_key", "x-business-user": "123"}
+        response = test_client.post(fastapi_app.url_path_for("start_conversation"), headers=headers,
+                                    json={"content": "What is the capital of France?"})
+        conversation_id = response.headers["X-conversation-id"]
+
+        other_worker = FileChatHistory(conversation_id, "123", None)  # type: ignore  # noqa: PGH003
+        other_worker.add_messages([HumanMessage(content="And of Spain?"), AIMessage(content="Madrid.")])
+
+        url = fastapi_app.url_path_for("conversation_history", conversationId=conversation_id)
+        response = test_client.get(url, headers=headers)
+        assert [message["content"] for message in response.json()][2:] == ["And of Spain?", "Madrid."]
+
+
+def test_start_conversation_event_stream(fastapi_app: FastAPI, mock_openai_chatcompletion) -> None:  # noqa: ARG001, ANN001
+    """Test that a conversation streams typed Server-Sent Events when the client accepts them."""
+    with TestClient(fastapi_app) as test_client:
+        headers = {"Authorization": "pytest_key", "x-business-user": "123", "Accept": "text/event-stream"}
+        response = test_client.post(fastapi_app.url_path_for("start_conversation"), headers=headers,
+                                    json={"content": "What is the capital of France?"})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.headers["X-conversation-id"]
+        events = [block.split("\n")[1] for block in response.text.strip().split("\n\n")]
+        assert events[0] == "event: token"
+        assert events[-2:] == ["event: usage", "event: done"]
+        assert '"output_tokens"' in response.text
+
+
+def test_sqlite_history_loads_off_event_loop(
+    fastapi_app: FastAPI, mock_openai_chatcompletion, monkeypatch: pytest.MonkeyPatch,  # noqa: ARG001, ANN001
+) -> None:
+    """Test that the SQLite history of a new and a continued conversation is never loaded on the event loop."""
+    monkeypatch.setattr(settings, "chat_history_store", ChatHistoryStore.SQLITE)
+    on_event_loop = []
+    load_messages = SqliteChatHistory.load_messages
+
+    def record_load(history: SqliteChatHistory) -> list:
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return load_messages(history)
+
+    monkeypatch.setattr(SqliteChatHistory, "load_messages", record_load)
+    with TestClient(fastapi_app) as test_client:
+        headers = {"Authorization": "pytest_key", "x-business-user": "123"}
+        response = test_client.post(fastapi_app.url_path_for("start_conversation"), headers=headers,
+                                    json={"content": "What is the capital of France?"})
+        conversation_id = response.headers["X-conversation-id"]
+        url = fastapi_app.url_path_for("continue_conversation", conversationId=conversation_id)
+        response = test_client.put(url, headers=headers, json={"content": "And of Spain?"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert on_event_loop
+    assert not any(on_event_loop)
+
+
+def start_scope(fastapi_app: FastAPI, *headers: tuple[bytes, bytes]) -> dict:
+    """The ASGI scope of a request to start a conversation, for tests that drive the app while it streams."""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "method": "POST",
+        "path": fastapi_app.url_path_for("start_conversation"),
+        "query_string": b"",
+        "headers": [
+            (b"authorization", b"pytest_key"),
+            (b"x-business-user", b"123"),
+            (b"content-type", b"application/json"),
+            *headers,
+        ],
+    }
+
+
+@pytest.mark.anyio()
+async def test_disconnect_cancels_turn(fastapi_app: FastAPI, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a client disconnecting cancels the answer, whose part so far is saved marked as truncated."""
+    answer = "The capital of France is Paris."
+    body = json.dumps({"content": "What is the capital of France?"}).encode()
+    scope = start_scope(fastapi_app)
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    messages = []
+    answering = asyncio.Event()
+
+    async def receive() -> dict:
+        if requests:
+            return requests.pop()
+        await answering.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+        if message.get("body"):
+            answering.set()
+
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        llm = FakeListChatModel(responses=[answer], sleep=0.1)
+        monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, llm)
+        await fastapi_app(scope, receive, send)
+
+        conversation_id = dict(messages[0]["headers"])[b"x-conversation-id"].decode()
+        history = await fastapi_app.state.conversation_provider.history("123", conversation_id)
+
+    streamed = b"".join(message.get("body", b"") for message in messages).decode()
+    assert streamed
+    assert answer.startswith(streamed)
+    assert history[0] == {"role": "human", "content": "What is the capital of France?"}
+    assert history[1]["truncated"]
+    assert len(history[1]["content"]) < len(answer)
+    assert streamed.startswith(history[1]["content"])
+
+
+@pytest.mark.anyio()
+async def test_cancel_stops_answer(fastapi_app: FastAPI, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the cancel endpoint stops an answer, whose stream ends cleanly with a stopped done event."""
+    answer = "The capital of France is Paris."
+    body = json.dumps({"content": "What is the capital of France?"}).encode()
+    scope = start_scope(fastapi_app, (b"accept", b"text/event-stream"))
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    messages = []
+    answering = asyncio.Event()
+
+    async def receive() -> dict:
+        if requests:
+            return requests.pop()
+        await asyncio.Event().wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+        if b"event: token" in message.get("body", b""):
+            answering.set()
+
+    async def cancel() -> int:
+        await answering.wait()
+        conversation_id = dict(messages[0]["headers"])[b"x-conversation-id"].decode()
+        url = fastapi_app.url_path_for("cancel_conversation", conversationId=conversation_id)
+        async with AsyncClient(transport=ASGITransport(app=fastapi_app), base_url="http://test") as client:
+            response = await client.post(url, headers={"Authorization": "pytest_key", "x-business-user": "123"})
+        return response.status_code
+
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        llm = FakeListChatModel(responses=[answer], sleep=0.1)
+        monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, llm)
+        _, cancel_status = await asyncio.gather(fastapi_app(scope, receive, send), cancel())
+
+        conversation_id = dict(messages[0]["headers"])[b"x-conversation-id"].decode()
+        history = await fastapi_app.state.conversation_provider.history("123", conversation_id)
+
+    streamed = b"".join(message.get("body", b"") for message in messages).decode()
+    assert cancel_status == status.HTTP_202_ACCEPTED
+    assert streamed.endswith('event: done\ndata: {"reason": "stopped"}\n\n')
+    assert history[1]["truncated"]
+    assert len(history[1]["content"]) < len(answer)
+
+
+@pytest.mark.anyio()
+async def test_reconnect_resumes_answer(fastapi_app: FastAPI, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a client that reconnects resumes the answer from its last event, and the answer is saved whole."""
+    answer = "The capital of France is Paris."
+    body = json.dumps({"content": "What is the capital of France?"}).encode()
+    scope = start_scope(fastapi_app, (b"accept", b"text/event-stream"))
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    messages = []
+    answering = asyncio.Event()
+
+    async def receive() -> dict:
+        if requests:
+            return requests.pop()
+        await answering.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+        if b"event: token" in message.get("body", b""):
+            answering.set()
+
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        llm = FakeListChatModel(responses=[answer], sleep=0.1)
+        monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, llm)
+        await fastapi_app(scope, receive, send)
+
+        conversation_id = dict(messages[0]["headers"])[b"x-conversation-id"].decode()
+        url = fastapi_app.url_path_for("resume_conversation", conversationId=conversation_id)
+        headers = {"Authorization": "pytest_key", "x-business-user": "123"}
+        async with AsyncClient(transport=ASGITransport(app=fastapi_app), base_url="http://test") as client:
+            resumed = await client.get(url, headers={**headers, "Last-Event-ID": "1"})
+            gone = await client.get(url, headers=headers, params={"offset": 99})
+        history = await fastapi_app.state.conversation_provider.history("123", conversation_id)
+
+    first = b"".join(message.get("body", b"") for message in messages).decode()
+    assert first.startswith("id: 1\nevent: token\n")
+    assert resumed.status_code == status.HTTP_200_OK
+    assert resumed.text.startswith("id: 2\n")
+    assert resumed.text.endswith("event: done\ndata: {}\n\n")
+    tokens = [json.loads(block.split("data: ")[1])["content"]
+              for block in (first.split("\n\n")[0], *resumed.text.split("\n\n")) if "event: token" in block]
+    assert "".join(tokens) == answer
+    assert gone.status_code == status.HTTP_410_GONE
+    assert history[1] == {"role": "ai", "content": answer}
+
+
+def test_blocked_content_tracker_checks_every_provider() -> None:
+    """Test that the tracker catches a block whichever provider answers the turn."""
+    azure = LLMResult(generations=[[Generation(text="", generation_info={"finish_reason": "content_filter"})]])
+    vertex = LLMResult(generations=[[Generation(text="", generation_info={"safety_ratings": [{"blocked": True}]})]])
+    bedrock = LLMResult(generations=[[Generation(text=BEDROCK_CONTENT_FILTER_REASON)]])
+    answer = LLMResult(generations=[[Generation(text="Hello", generation_info={"finish_reason": "stop"})]])
+
+    for response in (azure, vertex, bedrock):
+        tracker = BlockedContentTracker()
+        tracker.on_llm_end(response)
+        assert tracker.has_blocked
+    tracker = BlockedContentTracker()
+    tracker.on_llm_end(answer)
+    assert not tracker.has_blocked
+
+
+@pytest.mark.anyio()
+async def test_summary_does_not_hold_turn_open(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a turn finishes once its history is written, while the summary is made in a task of its own."""
+    monkeypatch.setattr(settings, "history_memory", HistoryMemory.SUMMARY)
+    service = ConversationService(FastAPI(), {}, {})
+    summarising = asyncio.Event()
+    summarised = asyncio.Event()
+
+    async def summarise_history(history: CountingHistory) -> None:  # noqa: ARG001
+        summarising.set()
+        await summarised.wait()
+
+    monkeypatch.setattr(service, "summarise_history", summarise_history)
+    write_batch = HistoryWriteBatch()
+    store = CountingHistory()
+    store.metadata = None
+    write_batch.track(store).add_messages([HumanMessage(content="Hello"), AIMessage(content="Hi")])
+    configurable = {"user_id": "123", "conversation_id": "456", "write_batch": write_batch}
+    config = {"configurable": {**configurable, "route": ModelRoute(DEFAULT_MODEL_KEY)}}
+
+    await asyncio.wait_for(service.finish_turn(config), 1)
+    assert store.writes == 1
+
+    await asyncio.wait_for(summarising.wait(), 1)
+    summarised.set()
@@ -0,0 +1,192 @@
+from typing import Any
+
+import pytest
+
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.datatypes.models import ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.chat_history.cosmos_db_async import AsyncCosmosDBChatMessageHistory
+
+
+class FakeSyncContainer:
+    """An in-memory stand-in for a Cosmos container."""
+
+    def __init__(self) -> None:
+        self.items: dict[tuple[str, str], dict[str, Any]] = {}
+        self.reads = 0
+        self.writes = 0
+        self.patches: list[list[dict[str, Any]]] = []
+
+    def read_item(self, item: str, partition_key: str) -> dict[str, Any]:
+        """Read an item, raising not found if it does not exist."""
+        self.reads += 1
+        try:
+            return self.items[(item, partition_key)]
+        except KeyError:
+            raise CosmosResourceNotFoundError(message="Not found") from None
+
+    def upsert_item(self, body: dict[str, Any]) -> None:
+        """Create or replace an item."""
+        self.writes += 1
+        self.items[(body["id"], body["user_id"])] = body
+
+    def patch_item(self, item: str, partition_key: str, patch_operations: list[dict[str, Any]]) -> None:
+        """Apply set and append operations to an item, raising not found if it does not exist."""
+        if (item, partition_key) not in self.items:
+            raise CosmosResourceNotFoundError(message="Not found")
+        self.patches.append(patch_operations)
+        body = self.items[(item, partition_key)]
+        for operation in patch_operations:
+            if operation["path"] == "/messages/-":
+                body["messages"].append(operation["value"])
+            else:
+                body[operation["path"].lstrip("/")] = operation["value"]
+
+    def delete_item(self, item: str, partition_key: str) -> None:
+        """Delete an item."""
+        del self.items[(item, partition_key)]
+
+
+class FakeContainer(FakeSyncContainer):
+    """An in-memory stand-in for an asyncio Cosmos container."""
+
+    async def read_item(self, item: str, partition_key: str) -> dict[str, Any]:
+        """Read an item, raising not found if it does not exist."""
+        return super().read_item(item, partition_key)
+
+    async def upsert_item(self, body: dict[str, Any]) -> None:
+        """Create or replace an item."""
+        super().upsert_item(body)
+
+    async def patch_item(self, item: str, partition_key: str, patch_operations: list[dict[str, Any]]) -> None:
+        """Apply set and append operations to an item, raising not found if it does not exist."""
+        super().patch_item(item, partition_key, patch_operations)
+
+    async def delete_item(self, item: str, partition_key: str) -> None:
+        """Delete an item."""
+        super().delete_item(item, partition_key)
+
+
+class FakeClient:
+    """An in-memory stand-in for a Cosmos client, asyncio unless it wraps a sync container."""
+
+    def __init__(self, container: FakeSyncContainer | None = None) -> None:
+        self.container = FakeContainer() if container is None else container
+
+    def get_database_client(self, _name: str) -> "FakeClient":
+        """Return the database client, which is the client itself."""
+        return self
+
+    def get_container_client(self, _name: str) -> FakeSyncContainer:
+        """Return the container."""
+        return self.container
+
+
+def make_history(
+    client: FakeClient, user_id: str, metadata: ConversationMetadata | None,
+) -> AsyncCosmosDBChatMessageHistory:
+    """Create a history on the fake asyncio client, with a sync client sharing its items."""
+    sync_client = FakeClient(FakeSyncContainer())
+    sync_client.container.items = client.container.items
+    return AsyncCosmosDBChatMessageHistory(
+        client, "session", user_id, metadata, sync_client,  # type: ignore  # noqa: PGH003
+    )
+
+
+@pytest.fixture()
+def metadata() -> ConversationMetadata:
+    """Conversation metadata for the tests."""
+    return ConversationMetadata(
+        provider=ModelProvider.AZURE,
+        variant=ModelVariant.GENERAL,
+        family=ModelFamily.GPT,
+        modelKey="fake_model_key",
+        business_user="test_business_user",
+    )
+
+
+@pytest.mark.anyio()
+async def test_messages_are_loaded_lazily(metadata: ConversationMetadata) -> None:
+    """Test that nothing is read until the messages are requested."""
+    client = FakeClient()
+    history = make_history(client, "Test_User", metadata)
+    assert client.container.reads == 0
+
+    assert await history.aget_messages() == []
+    assert await history.aget_messages() == []
+    assert client.container.reads == 1
+
+
+@pytest.mark.anyio()
+async def test_add_and_reload(metadata: ConversationMetadata) -> None:
+    """Test that added messages can be loaded by a new instance."""
+    client = FakeClient()
+    history = make_history(client, "Test_User", metadata)
+    await history.aadd_messages([HumanMessage(content="Hello"), AIMessage(content="Hi")])
+
+    reloaded = make_history(client, "test_user", None)
+    messages = await reloaded.aget_messages()
+
+    assert [m.content for m in messages] == ["Hello", "Hi"]
+    assert reloaded.metadata.modelKey == "fake_model_key"
+
+
+@pytest.mark.anyio()
+async def test_clear(metadata: ConversationMetadata) -> None:
+    """Test that clearing removes the item."""
+    client = FakeClient()
+    history = make_history(client, "test_user", metadata)
+    await history.aadd_messages([HumanMessage(content="Hello"), AIMessage(content="Hi")])
+    await history.aclear()
+
+    assert client.container.items == {}
+
+
+@pytest.mark.anyio()
+async def test_sync_api_uses_sync_client(metadata: ConversationMetadata) -> None:
+    """Test that the blocking API writes through the sync client to the same item as the async API."""
+    client = FakeClient()
+    history = make_history(client, "test_user", metadata)
+    history.add_message(HumanMessage(content="Hello"))
+    history.add_message(AIMessage(content="Hi"))
+
+    assert client.container.writes == 0
+    assert history._container.writes == 1  # noqa: SLF001
+    assert len(history._container.patches) == 1  # noqa: SLF001
+    reloaded = make_history(client, "test_user", None)
+    assert [m.content for m in await reloaded.aget_messages()] == ["Hello", "Hi"]
+
+    history.clear()
+    assert client.container.items == {}
+
+
+@pytest.mark.anyio()
+async def test_later_turns_are_appended(metadata: ConversationMetadata) -> None:
+    """Test that the item is created by the first turn and only the new messages are sent after that."""
+    client = FakeClient()
+    history = make_history(client, "test_user", metadata)
+    await history.aadd_messages([HumanMessage(content="Hello"), AIMessage(content="Hi")])
+    await history.aadd_messages([HumanMessage(content="How are you?"), AIMessage(content="Fine")])
+
+    assert client.container.writes == 1
+    assert [[op["value"]["data"]["content"] for op in patch] for patch in client.container.patches] == [
+        ["How are you?", "Fine"],
+    ]
+    reloaded = make_history(client, "test_user", None)
+    assert len(await reloaded.aget_messages()) == 4  # noqa: PLR2004
+
+
+@pytest.mark.anyio()
+async def test_append_recreates_missing_item(metadata: ConversationMetadata) -> None:
+    """Test that the whole conversation is written if the item has gone."""
+    client = FakeClient()
+    history = make_history(client, "test_user", metadata)
+    await history.aadd_messages([HumanMessage(content="Hello"), AIMessage(content="Hi")])
+    client.container.items.clear()
+
+    await history.aadd_messages([HumanMessage(content="How are you?"), AIMessage(content="Fine")])
+
+    assert client.container.writes == 2  # noqa: PLR2004
+    assert len(client.container.items[("session", "test_user")]["messages"]) == 4  # noqa: PLR2004
@@ -0,0 +1,35 @@
+import asyncio
+
+from collections.abc import AsyncGenerator
+
+import pytest
+
+from lab_gen.web.api.conversation.event_stream import (
+    KEEP_ALIVE_COMMENT,
+    StreamEvent,
+    format_event,
+    wants_event_stream,
+    with_keep_alive,
+)
+
+
+def test_format_event() -> None:
+    """Test that an event is sent with its type and its data as JSON."""
+    assert format_event(StreamEvent.TOKEN, {"content": "Hi"}) == 'event: token\ndata: {"content": "Hi"}\n\n'
+    assert wants_event_stream("text/event-stream, text/plain")
+    assert not wants_event_stream("text/plain")
+    assert not wants_event_stream(None)
+
+
+@pytest.mark.anyio()
+async def test_idle_stream_is_kept_alive() -> None:
+    """Test that a comment is sent while no event is ready, and the events still follow in order."""
+
+    async def slow_events() -> AsyncGenerator[str, None]:
+        await asyncio.sleep(0.15)
+        yield format_event(StreamEvent.DONE, {})
+
+    sent = [event async for event in with_keep_alive(slow_events(), 0.05)]
+
+    assert sent[0] == KEEP_ALIVE_COMMENT
+    assert sent[-1] == format_event(StreamEvent.DONE, {})
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import time
+
+from pathlib import Path
+
+import pytest
+
+from lab_gen.services.conversation.generations import GenerationRegistry
+
+
+@pytest.mark.anyio()
+async def test_stop_answer_on_this_worker(tmp_path: Path) -> None:
+    """Test that an answer streamed by this worker is stopped straight away, and forgotten once it finishes."""
+    registry = GenerationRegistry(tmp_path, poll_seconds=10, max_age_seconds=60)
+    generation = registry.start("bob", "123")
+
+    assert await registry.stop("bob", "123")
+    await asyncio.wait_for(generation.wait_stopped(registry.poll_seconds), 1)
+
+    registry.finish("bob", "123", generation)
+    assert not await registry.stop("bob", "123")
+
+
+@pytest.mark.anyio()
+async def test_stop_answer_on_another_worker(tmp_path: Path) -> None:
+    """Test that an answer streamed by another worker is stopped through the signal file, but not another user's."""
+    streaming = GenerationRegistry(tmp_path, poll_seconds=0.01, max_age_seconds=60)
+    generation = streaming.start("bob", "123")
+    other = GenerationRegistry(tmp_path, poll_seconds=0.01, max_age_seconds=60)
+    waiting = asyncio.ensure_future(generation.wait_stopped(streaming.poll_seconds))
+
+    assert not await other.stop("alice", "123")
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    assert not await other.stop("bob", "123")
+    await asyncio.wait_for(waiting, 1)
+    assert generation.stopped.is_set()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+@pytest.mark.anyio()
+async def test_stale_signals_are_removed(tmp_path: Path) -> None:
+    """Test that signals no worker has taken are removed once they are older than the maximum age."""
+    registry = GenerationRegistry(tmp_path, poll_seconds=0.01, max_age_seconds=60)
+    await registry.stop("bob", "123")
+    stale = next(tmp_path.iterdir())
+    old = time.time() - 120
+    os.utime(stale, (old, old))
+
+    await registry.stop("alice", "456")
+
+    assert not stale.exists()
+    assert len(list(tmp_path.iterdir())) == 1
@@ -0,0 +1,104 @@
+import pytest
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.balancer import DeploymentStats
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.hedging import LatencyWindow
+from lab_gen.services.llm.routing import ModelRoute, routed_llm
+from lab_gen.services.metrics.llm_metrics_counter import LLMMetricsCounter
+from lab_gen.settings import settings
+from lab_gen.tests.unit.test_balancer import SECOND_DEPLOYMENT, two_deployments  # noqa: F401
+from lab_gen.tests.unit.test_routing import FALLBACK_KEY, with_fallback  # noqa: F401
+
+
+@pytest.fixture()
+def hedge_deployments(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Hedge quickly, with fresh circuit breakers and stats for both deployments of the default model."""
+    monkeypatch.setattr(settings, "hedge_initial_delay_seconds", 0.05)
+    monkeypatch.setitem(lifetime.first_token_latencies, DEFAULT_MODEL_KEY, LatencyWindow(settings.hedge_window))
+    for name in lifetime.deployments[DEFAULT_MODEL_KEY]:
+        monkeypatch.setitem(lifetime.deployment_stats, name, DeploymentStats())
+        monkeypatch.setitem(
+            lifetime.circuit_breakers,
+            name,
+            CircuitBreaker(name, failure_rate=0.5, window=10, min_calls=5, open_seconds=30, slow_call_seconds=30),
+        )
+
+
+def test_latency_percentile() -> None:
+    """Test that the percentile of the recent latencies is picked by the nearest rank."""
+    window = LatencyWindow(10)
+    for latency in range(1, 21):
+        window.add(latency / 10)
+
+    assert window.percentile(0.5) == pytest.approx(1.6)
+    assert window.percentile(0.95) == pytest.approx(2.0)
+    assert LatencyWindow(10).percentile(0.95) == 0
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("two_deployments", "hedge_deployments")
+async def test_late_request_is_hedged(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a request whose first token is late is sent to another deployment, which wins."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Slow"], sleep=1))
+    monkeypatch.setitem(lifetime.model_providers, SECOND_DEPLOYMENT, FakeListChatModel(responses=["Fast"]))
+    won = lifetime.hedge_stats.won[DEFAULT_MODEL_KEY]
+    route = ModelRoute(DEFAULT_MODEL_KEY)
+
+    response = await routed_llm(DEFAULT_MODEL_KEY, hedge=True).ainvoke(
+        [HumanMessage(content="Hi")], {"configurable": {"route": route}},
+    )
+
+    assert response.content == "Fast"
+    assert lifetime.hedge_stats.won[DEFAULT_MODEL_KEY] == won + 1
+    assert not route.failed_over
+    assert lifetime.get_deployment_stats(DEFAULT_MODEL_KEY).outstanding == 0
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("two_deployments", "hedge_deployments")
+async def test_prompt_request_is_not_hedged(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a request whose first token arrives in time is not hedged."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Fast"]))
+    monkeypatch.setitem(lifetime.model_providers, SECOND_DEPLOYMENT, FakeListChatModel(responses=["Hedge"]))
+    hedged = lifetime.hedge_stats.hedged[DEFAULT_MODEL_KEY]
+
+    response = await routed_llm(DEFAULT_MODEL_KEY, hedge=True).ainvoke([HumanMessage(content="Hi")])
+
+    assert response.content == "Fast"
+    assert lifetime.hedge_stats.hedged[DEFAULT_MODEL_KEY] == hedged
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("two_deployments", "hedge_deployments")
+async def test_hedged_prompt_is_counted_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the metrics counter shared by both legs counts the prompt once, timed from the first leg."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Slow"], sleep=1))
+    monkeypatch.setitem(lifetime.model_providers, SECOND_DEPLOYMENT, FakeListChatModel(responses=["Fast"]))
+    counter = LLMMetricsCounter()
+    prompt = [HumanMessage(content="Hi")]
+
+    await routed_llm(DEFAULT_MODEL_KEY, hedge=True).ainvoke(prompt, {"callbacks": [counter]})
+
+    assert counter.input_tokens == counter.count_tokens("Hi")
+    assert counter.first_token_seconds >= settings.hedge_initial_delay_seconds
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback", "hedge_deployments")
+async def test_hedge_to_fallback_moves_conversation(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a hedge sent to a fallback model that wins is recorded as the model that answered."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Slow"], sleep=1))
+    route = ModelRoute(DEFAULT_MODEL_KEY)
+
+    response = await routed_llm(DEFAULT_MODEL_KEY, hedge=True).ainvoke(
+        [HumanMessage(content="Hi")], {"configurable": {"route": route}},
+    )
+
+    assert response.content == "From the fallback"
+    assert route.answered_by == FALLBACK_KEY
+    assert route.metadata_update()["modelKey"] == FALLBACK_KEY
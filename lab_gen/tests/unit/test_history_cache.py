@@ -0,0 +1,64 @@
+import pytest
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import HumanMessage
+
+from lab_gen.services.chat_history import cache
+from lab_gen.services.chat_history.cache import HistoryCache
+
+
+def make_history(content: str = "Hello") -> ChatMessageHistory:
+    """Create an in-memory history holding a single message."""
+    return ChatMessageHistory(messages=[HumanMessage(content=content)])
+
+
+def test_hits_and_misses() -> None:
+    """Test that lookups are counted and user IDs are matched without case."""
+    history_cache = HistoryCache(max_entries=2, ttl=60, max_bytes=1024)
+    history = make_history()
+
+    assert history_cache.get("bob", "1") is None
+    history_cache.put("Bob", "1", history)
+    assert history_cache.get("bob", "1") is history
+
+    assert history_cache.hits == 1
+    assert history_cache.misses == 1
+
+
+def test_least_recently_used_is_evicted() -> None:
+    """Test that the least recently used history is evicted when the cache is full."""
+    history_cache = HistoryCache(max_entries=2, ttl=60, max_bytes=1024)
+    history_cache.put("bob", "1", make_history())
+    history_cache.put("bob", "2", make_history())
+    history_cache.get("bob", "1")
+    history_cache.put("bob", "3", make_history())
+
+    assert history_cache.get("bob", "2") is None
+    assert history_cache.get("bob", "1") is not None
+    assert history_cache.evictions == 1
+
+
+def test_entries_expire(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a history is not returned once its TTL has passed."""
+    now = 1000.0
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now)
+    history_cache = HistoryCache(max_entries=2, ttl=60, max_bytes=1024)
+    history_cache.put("bob", "1", make_history())
+
+    now += 61
+
+    assert history_cache.get("bob", "1") is None
+    assert history_cache.stats()["entries"] == 0
+
+
+def test_memory_limit() -> None:
+    """Test that histories are evicted to stay within the memory limit."""
+    history_cache = HistoryCache(max_entries=10, ttl=60, max_bytes=10)
+    history_cache.put("bob", "1", make_history("12345"))
+    history_cache.put("bob", "2", make_history("123456"))
+    history_cache.put("bob", "3", make_history("12345678901"))
+
+    assert history_cache.get("bob", "1") is None
+    assert history_cache.get("bob", "2") is not None
+    assert history_cache.get("bob", "3") is None
+    assert history_cache.stats()["bytes"] == len("123456")
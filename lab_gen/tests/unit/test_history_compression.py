@@ -0,0 +1,59 @@
+import uuid
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.datatypes.models import ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.chat_history.compression import decode_messages, encode_messages
+from lab_gen.services.chat_history.file_chat import FileChatHistory
+from lab_gen.settings import TEMP_DIR, HistoryCompression, settings
+
+
+LARGE_CONTENT = "caller,reason,outcome\n" * 200
+
+
+@pytest.fixture(autouse=True)
+def _chat_history_dir() -> None:
+    settings.chat_history_dir = TEMP_DIR
+
+
+@pytest.mark.parametrize("compression", [HistoryCompression.GZIP, HistoryCompression.ZSTD])
+def test_large_messages_are_compressed(compression: HistoryCompression, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that only messages over the minimum size are compressed, and both decode."""
+    monkeypatch.setattr(settings, "history_compression", compression)
+    messages = [HumanMessage(content=LARGE_CONTENT), AIMessage(content="Short")]
+
+    stored = encode_messages(messages)
+
+    assert stored[0]["encoding"] == compression.value
+    assert len(stored[0]["data"]) < len(LARGE_CONTENT)
+    assert stored[1]["data"]["content"] == "Short"
+    assert [m.content for m in decode_messages(stored)] == [LARGE_CONTENT, "Short"]
+
+
+def test_uncompressed_messages_still_load(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that messages stored before compression was enabled are read as they are."""
+    monkeypatch.setattr(settings, "history_compression", HistoryCompression.GZIP)
+    stored = messages_to_dict([HumanMessage(content=LARGE_CONTENT)])
+
+    assert decode_messages(stored)[0].content == LARGE_CONTENT
+
+
+def test_file_history_round_trip(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a compressed conversation file is loaded transparently."""
+    monkeypatch.setattr(settings, "history_compression", HistoryCompression.ZSTD)
+    metadata = ConversationMetadata(
+        provider=ModelProvider.AZURE,
+        variant=ModelVariant.GENERAL,
+        family=ModelFamily.GPT,
+        modelKey="fake_model_key",
+        business_user="test_business_user",
+    )
+    history = FileChatHistory(str(uuid.uuid4()), "test_user", metadata)
+    history.add_messages([HumanMessage(content=LARGE_CONTENT), AIMessage(content="Summary")])
+
+    assert LARGE_CONTENT.splitlines()[0] not in history.file_path.read_text()
+    loaded = FileChatHistory(history.session_id, "test_user", None)  # type: ignore  # noqa: PGH003
+    assert [m.content for m in loaded.messages] == [LARGE_CONTENT, "Summary"]
@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from lab_gen.services.conversation.history_window import (
+    TOKEN_COUNT_KEY,
+    count_message_tokens,
+    stamp_token_counts,
+    window_history,
+)
+from lab_gen.services.metrics.llm_metrics_counter import LLMMetricsCounter
+
+
+def make_turns(turns: int) -> list[BaseMessage]:
+    """Create the given number of human and ai message pairs."""
+    messages: list[BaseMessage] = []
+    for turn in range(turns):
+        messages.extend([HumanMessage(content=f"Question {turn}"), AIMessage(content=f"Answer {turn}")])
+    return messages
+
+
+def test_history_within_budget_is_unchanged() -> None:
+    """Test that nothing is trimmed when the history fits."""
+    messages = make_turns(3)
+
+    window = window_history(messages, 1000)
+
+    assert window.messages == messages
+    assert window.trimmed == 0
+    assert window.tokens == sum(count_message_tokens(m) for m in messages)
+
+
+def test_oldest_turns_are_trimmed() -> None:
+    """Test that the system message and first turn are kept, followed by the most recent turns that fit."""
+    messages = [SystemMessage(content="Be helpful"), *make_turns(5)]
+    turn_tokens = count_message_tokens(messages[1]) + count_message_tokens(messages[2])
+    budget = count_message_tokens(messages[0]) + 3 * turn_tokens
+
+    window = window_history(messages, budget)
+
+    assert [m.content for m in window.messages] == [
+        "Be helpful", "Question 0", "Answer 0", "Question 3", "Answer 3", "Question 4", "Answer 4",
+    ]
+    assert window.trimmed == len(messages) - len(window.messages)
+    assert window.tokens <= budget
+
+
+def test_multimodal_content_is_counted() -> None:
+    """Test that images are counted with an estimate rather than their encoded size."""
+    message = HumanMessage(content=[
+        {"type": "text", "text": "What is this?"},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 100000}},
+    ])
+
+    assert count_message_tokens(message) < 1000  # noqa: PLR2004
+
+
+def test_stored_token_counts_are_used() -> None:
+    """Test that a message stamped with its token count is not tokenised again."""
+    messages = make_turns(1)
+
+    total = stamp_token_counts(messages)
+    messages[0].content = "A much longer question that would count as more tokens"
+
+    assert messages[0].response_metadata[TOKEN_COUNT_KEY] + messages[1].response_metadata[TOKEN_COUNT_KEY] == total
+    assert window_history(messages, 1000).tokens == total
+
+
+def test_metrics_counter_uses_stored_counts() -> None:
+    """Test that only the messages without a stored count are tokenised for the prompt metrics."""
+    llm = FakeListChatModel(responses=[])
+    history = make_turns(2)
+    stamp_token_counts(history)
+    counter = LLMMetricsCounter(llm)
+    new_input = HumanMessage(content="Next question")
+
+    with patch.object(FakeListChatModel, "get_num_tokens", return_value=5) as get_num_tokens:
+        counter.on_chat_model_start({}, [[*history, new_input]])
+
+    get_num_tokens.assert_called_once_with("Next question")
+    assert counter.input_tokens == sum(m.response_metadata[TOKEN_COUNT_KEY] for m in history) + 5
@@ -0,0 +1,35 @@
+import httpx
+
+from lab_gen.datatypes.models import Model, ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.llm.http_pool import async_client, pool_usage, sync_client
+from lab_gen.services.llm.providers import anthropic
+from lab_gen.settings import settings
+
+
+def test_clients_share_pool() -> None:
+    """Test that the clients of different backends share one transport, with the configured limits and timeouts."""
+    first = sync_client(base_url="https://one.example.com")
+    second = sync_client(base_url="https://two.example.com")
+
+    assert first._transport is second._transport  # noqa: SLF001
+    assert first.timeout == httpx.Timeout(
+        settings.http_read_timeout_seconds, connect=settings.http_connect_timeout_seconds,
+    )
+    assert pool_usage()["sync"] == {"active": 0, "idle": 0}
+
+
+def test_provider_client_uses_pool() -> None:
+    """Test that a provider's SDK client is built over the shared async pool."""
+    model = Model(
+        provider=ModelProvider.ANTHROPIC,
+        family=ModelFamily.CLAUDE,
+        variant=ModelVariant.GENERAL,
+        identifier="claude",
+        description="Claude",
+        location="US",
+        config={"ANTHROPIC_API_KEY": "key"},
+    )
+
+    llm = anthropic.init_llm(model)
+
+    assert llm._async_client._client._transport is async_client()._transport  # noqa: SLF001
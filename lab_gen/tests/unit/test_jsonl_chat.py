@@ -0,0 +1,114 @@
+import json
+import uuid
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.datatypes.models import ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.chat_history.jsonl_chat import JsonlChatHistory
+from lab_gen.settings import TEMP_DIR, settings
+
+
+TWO_MESSAGES = 2
+FOUR_MESSAGES = 4
+
+
+@pytest.fixture(autouse=True)
+def _chat_history_dir() -> None:
+    settings.chat_history_dir = TEMP_DIR
+
+
+@pytest.fixture()
+def chat_history() -> JsonlChatHistory:
+    """Fixture to create an instance of JsonlChatHistory with real metadata."""
+    metadata = ConversationMetadata(
+        provider=ModelProvider.AZURE,
+        variant=ModelVariant.GENERAL,
+        family=ModelFamily.GPT,
+        modelKey="fake_model_key",
+        business_user="test_business_user",
+    )
+    return JsonlChatHistory(str(uuid.uuid4()), "test_user", metadata)
+
+
+def add_turns(chat_history: JsonlChatHistory, turns: int) -> None:
+    """Add the given number of human and ai message pairs to the history."""
+    for turn in range(turns):
+        chat_history.add_messages([HumanMessage(content=f"Question {turn}"), AIMessage(content=f"Answer {turn}")])
+
+
+def test_add_messages_appends_lines(chat_history: JsonlChatHistory) -> None:
+    """Test that each message is appended as one line, after a single header."""
+    add_turns(chat_history, 2)
+
+    records = [json.loads(line) for line in chat_history.file_path.read_text().splitlines()]
+    assert [r["record"] for r in records] == ["header", "message", "message", "message", "message"]
+    assert records[0]["user_id"] == "test_user"
+    assert records[1]["message"]["data"]["content"] == "Question 0"
+
+
+def test_load_messages(chat_history: JsonlChatHistory) -> None:
+    """Test that a new instance replays the log."""
+    add_turns(chat_history, 2)
+
+    loaded = JsonlChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+
+    assert len(loaded.messages) == FOUR_MESSAGES
+    assert loaded.messages[-1].content == "Answer 1"
+    assert loaded.metadata.modelKey == "fake_model_key"
+
+
+def test_metadata_change_writes_header(chat_history: JsonlChatHistory) -> None:
+    """Test that changing the metadata appends a new header that wins on load."""
+    add_turns(chat_history, 1)
+    chat_history.metadata = chat_history.metadata.model_copy(update={"modelKey": "other_key"})
+    add_turns(chat_history, 1)
+
+    loaded = JsonlChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+
+    assert loaded.metadata.modelKey == "other_key"
+    assert len(loaded.messages) == FOUR_MESSAGES
+
+
+def test_delete_appends_truncate_marker(chat_history: JsonlChatHistory) -> None:
+    """Test that deleting a pair appends a marker rather than rewriting the file."""
+    add_turns(chat_history, 3)
+    chat_history.delete(1)
+
+    last_record = json.loads(chat_history.file_path.read_text().splitlines()[-1])
+    assert last_record == {"record": "truncate", "length": FOUR_MESSAGES}
+
+    loaded = JsonlChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert len(loaded.messages) == FOUR_MESSAGES
+    assert loaded.messages[-1].content == "Answer 1"
+
+
+def test_delete_compacts_mostly_dead_log(chat_history: JsonlChatHistory) -> None:
+    """Test that the log is rewritten once most of its records are no longer live."""
+    add_turns(chat_history, 2)
+    chat_history.delete(1)
+
+    loaded = JsonlChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert [m.content for m in loaded.messages] == ["Question 0", "Answer 0"]
+    assert "truncate" not in chat_history.file_path.read_text()
+
+
+def test_malformed_tail_is_skipped(chat_history: JsonlChatHistory) -> None:
+    """Test that an interrupted append does not lose the rest of the conversation."""
+    add_turns(chat_history, 1)
+    with chat_history.file_path.open("a") as f:
+        f.write('{"record":"message","mess')
+
+    loaded = JsonlChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert len(loaded.messages) == TWO_MESSAGES
+
+
+def test_clear(chat_history: JsonlChatHistory) -> None:
+    """Test clearing the chat history and deleting the file."""
+    add_turns(chat_history, 1)
+    chat_history.clear()
+
+    assert len(chat_history.messages) == 0
+    assert not chat_history.file_path.exists()
@@ -4,6 +4,8 @@ from fastapi import FastAPI
 from httpx import AsyncClient
 from starlette import status
 
+from lab_gen.services.llm.lifetime import deployment_models
+
 
 @pytest.mark.anyio()
 async def test_health(client: AsyncClient, fastapi_app: FastAPI) -> None:
@@ -18,5 +20,9 @@ async def test_health(client: AsyncClient, fastapi_app: FastAPI) -> None:
     assert response.status_code == status.HTTP_200_OK
     assert response.json() == {
         "status": "OUT_OF_SERVICE",
-        "detail": {"cosmos": "OUT_OF_SERVICE", "metrics": "OUT_OF_SERVICE"},
+        "detail": {
+            "cosmos": "OUT_OF_SERVICE",
+            "metrics": "OUT_OF_SERVICE",
+            "models": dict.fromkeys(deployment_models, "CLOSED"),
+        },
     }
@@ -73,3 +73,13 @@ def test_calculate_messages_deletes_all_messages() -> None:
 
     updated_messages = chat_message.calculate_messages(messages, num_entries)
     assert updated_messages == []
+
+
+def test_append_operations_are_batched() -> None:
+    """Test that append operations are split into batches Cosmos accepts, with the metadata set first."""
+    messages = [HumanMessage(content=str(i)) for i in range(chat_message.MAX_PATCH_OPERATIONS)]
+    batches = chat_message.append_operations(messages, {"modelKey": "key"})
+
+    assert [len(batch) for batch in batches] == [chat_message.MAX_PATCH_OPERATIONS, 1]
+    assert batches[0][0] == {"op": "set", "path": "/metadata", "value": {"modelKey": "key"}}
+    assert batches[1][0]["path"] == "/messages/-"
@@ -1,7 +1,14 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
 from lab_gen.datatypes.errors import ModelKeyError
 from lab_gen.datatypes.models import Model, ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.llm import lifetime
 from lab_gen.services.llm.lifetime import get_model, init_models
 
 
@@ -32,3 +39,29 @@ def test_invalid_model() -> None:
     """Tests getting the model by invalid key."""
     with pytest.raises(ModelKeyError):
         get_model("NonExistentModel")
+
+
+def test_llm_is_built_once_on_first_use(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Tests that concurrent first requests for a model build its client once."""
+    key = Model.compute_key(ModelProvider.BEDROCK, ModelVariant.ADVANCED, ModelFamily.CLAUDE)
+    monkeypatch.delitem(lifetime.model_providers, key, raising=False)
+    builds = []
+
+    def init_llm(model: Model) -> FakeListChatModel:
+        builds.append(model.key)
+        time.sleep(0.05)
+        return FakeListChatModel(responses=[])
+
+    monkeypatch.setattr(lifetime, "init_llm", init_llm)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        llms = list(executor.map(lambda _: lifetime.get_llm(key), range(4)))
+
+    assert builds == [key]
+    assert all(llm is llms[0] for llm in llms)
+    monkeypatch.delitem(lifetime.model_providers, key)
+
+
+def test_invalid_llm() -> None:
+    """Tests getting the llm by invalid key."""
+    with pytest.raises(ModelKeyError):
+        lifetime.get_llm("NonExistentModel")
@@ -0,0 +1,94 @@
+import asyncio
+import time
+
+import pytest
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+
+from lab_gen.datatypes.errors import RateLimitedError
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.rate_limiter import RateLimiter, TokenBucket
+from lab_gen.services.llm.routing import routed_llm
+from lab_gen.web.api.conversation.views import get_error_status
+
+
+def test_bucket_waits_for_refill() -> None:
+    """Test that a bucket asks to wait once it is empty, for as long as the refill takes."""
+    bucket = TokenBucket(60)
+
+    assert bucket.wait_time(60) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1, abs=0.01)
+    assert bucket.wait_time(600) == pytest.approx(60, abs=0.01)
+
+
+@pytest.mark.anyio()
+async def test_request_over_quota_is_shed() -> None:
+    """Test that a request is shed when it would wait too long for the quota, and reconciled tokens are given back."""
+    limiter = RateLimiter("deployment", rpm=None, tpm=1000, max_wait=0)
+
+    reservation = await limiter.acquire(1000)
+    with pytest.raises(RateLimitedError) as exc_info:
+        await limiter.acquire(100)
+    assert exc_info.value.retry_after > 0
+
+    reservation.reconcile(200)
+    await limiter.acquire(100)
+
+
+@pytest.mark.anyio()
+async def test_request_waits_briefly_for_quota() -> None:
+    """Test that a request queues for the quota when the wait is short enough."""
+    limiter = RateLimiter("deployment", rpm=600, tpm=None, max_wait=1)
+    for _ in range(600):
+        await limiter.acquire(0)
+
+    started = time.monotonic()
+    await limiter.acquire(0)
+
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+
+
+@pytest.mark.anyio()
+async def test_cancelled_wait_is_refunded() -> None:
+    """Test that a request cancelled while it waits for the quota gives back its request and tokens."""
+    limiter = RateLimiter("deployment", rpm=1, tpm=60000, max_wait=90)
+    await limiter.acquire(60000)
+    waiting = asyncio.ensure_future(limiter.acquire(500))
+    await asyncio.sleep(0.01)
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+
+    assert limiter.requests.wait_time(1) == pytest.approx(60, abs=1)
+    assert limiter.tokens.wait_time(500) == pytest.approx(0.5, abs=0.05)
+
+
+@pytest.mark.anyio()
+async def test_routed_request_is_shed(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a routed request to a deployment whose quota is used up fails as too many requests."""
+    lifetime.init_models()
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeListChatModel(responses=["Hello"]))
+    monkeypatch.setitem(
+        lifetime.rate_limiters, DEFAULT_MODEL_KEY, RateLimiter(DEFAULT_MODEL_KEY, rpm=1, tpm=None, max_wait=0),
+    )
+    breaker = CircuitBreaker(
+        DEFAULT_MODEL_KEY, failure_rate=0.5, window=10, min_calls=1, open_seconds=30, slow_call_seconds=30,
+    )
+    monkeypatch.setitem(lifetime.circuit_breakers, DEFAULT_MODEL_KEY, breaker)
+    monkeypatch.setitem(
+        lifetime.deployment_models,
+        DEFAULT_MODEL_KEY,
+        lifetime.deployment_models[DEFAULT_MODEL_KEY].model_copy(update={"rpm": 1}),
+    )
+    llm = routed_llm(DEFAULT_MODEL_KEY)
+
+    response = await llm.ainvoke([HumanMessage(content="Hi")])
+    assert response.content == "Hello"
+    with pytest.raises(RateLimitedError) as exc_info:
+        await llm.ainvoke([HumanMessage(content="Hi")])
+    assert get_error_status(exc_info.value) == HTTP_429_TOO_MANY_REQUESTS
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from lab_gen.web.api.conversation.event_stream import StreamEvent
+from lab_gen.web.api.conversation.replay import ReplayBuffer
+
+
+async def collect(buffer: ReplayBuffer, last_id: int = 0) -> list[str]:
+    """The events a client following the buffer receives, until the answer finishes."""
+    return [event async for event in buffer.follow(last_id)]
+
+
+@pytest.mark.anyio()
+async def test_resume_after_last_event() -> None:
+    """Test that a client resumes with the events after the last it received, then the new ones as they come."""
+    buffer = ReplayBuffer(max_events=10, grace_seconds=1)
+    buffer.append(StreamEvent.TOKEN, {"content": "The"})
+    buffer.append(StreamEvent.TOKEN, {"content": " capital"})
+
+    following = asyncio.ensure_future(collect(buffer, 1))
+    await asyncio.sleep(0)
+    buffer.append(StreamEvent.DONE, {})
+    buffer.close()
+    events = await asyncio.wait_for(following, 1)
+
+    assert events == [
+        'id: 2\nevent: token\ndata: {"content": " capital"}\n\n',
+        "id: 3\nevent: done\ndata: {}\n\n",
+    ]
+    assert buffer.can_resume(3)
+
+
+@pytest.mark.anyio()
+async def test_cannot_resume_dropped_events() -> None:
+    """Test that a full buffer drops its oldest events, after which a client that missed them cannot resume."""
+    buffer = ReplayBuffer(max_events=2, grace_seconds=1)
+    for content in ("The", " capital", " of"):
+        buffer.append(StreamEvent.TOKEN, {"content": content})
+
+    assert not buffer.can_resume(0)
+    assert buffer.can_resume(1)
+    assert not buffer.can_resume(4)
+
+
+@pytest.mark.anyio()
+async def test_follower_gets_events_added_before_close() -> None:
+    """Test that a client receives the events added while it was sending earlier ones, even once the answer is done."""
+    buffer = ReplayBuffer(max_events=100, grace_seconds=1)
+    buffer.append(StreamEvent.TOKEN, {"content": "The"})
+
+    following = buffer.follow()
+    first = await anext(following)
+    for content in (" capital", " of", " France"):
+        buffer.append(StreamEvent.TOKEN, {"content": content})
+    buffer.append(StreamEvent.DONE, {})
+    buffer.close()
+    rest = [event async for event in following]
+
+    assert first.startswith("id: 1\n")
+    assert [event.split("\n")[0] for event in rest] == ["id: 2", "id: 3", "id: 4", "id: 5"]
+
+
+@pytest.mark.anyio()
+async def test_lagging_follower_gets_error() -> None:
+    """Test that a client whose next events were dropped while it lagged is sent an error rather than a gap."""
+    buffer = ReplayBuffer(max_events=2, grace_seconds=1)
+    buffer.append(StreamEvent.TOKEN, {"content": "The"})
+
+    following = buffer.follow()
+    await anext(following)
+    for content in (" capital", " of", " France"):
+        buffer.append(StreamEvent.TOKEN, {"content": content})
+    buffer.close()
+    rest = [event async for event in following]
+
+    assert len(rest) == 1
+    assert rest[0].startswith("event: error\n")
+    assert '"status": 410' in rest[0]
+
+
+@pytest.mark.anyio()
+async def test_answer_cancelled_after_grace() -> None:
+    """Test that an answer nobody is following is cancelled at the end of the grace period, unless a client resumes."""
+    buffer = ReplayBuffer(max_events=10, grace_seconds=0.05)
+    buffer.task = asyncio.ensure_future(asyncio.Event().wait())
+    buffer.append(StreamEvent.TOKEN, {"content": "The"})
+
+    following = buffer.follow()
+    await anext(following)
+    await following.aclose()
+    resumed = buffer.follow(1)
+    waiting = asyncio.ensure_future(anext(resumed))
+    await asyncio.sleep(0.1)
+    assert not buffer.task.done()
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    await resumed.aclose()
+    await asyncio.sleep(0.1)
+    assert buffer.task.cancelled()
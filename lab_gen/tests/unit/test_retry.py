@@ -0,0 +1,109 @@
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+from starlette import status
+
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.retry import RetryBudget, parse_duration, requested_delay
+from lab_gen.services.llm.routing import ModelRoute, routed_llm
+from lab_gen.settings import settings
+
+
+class ServerError(Exception):
+    """An error from a model client for a response from an overloaded server."""
+
+    status_code = 503
+
+    def __init__(self, headers: dict[str, str] | None = None) -> None:
+        super().__init__("Service unavailable")
+        self.response = httpx.Response(self.status_code, headers=headers)
+
+
+class FlakyChatModel(FakeListChatModel):
+    """A chat model that fails its first calls with a server error, then answers."""
+
+    failures: int = 1
+
+    async def _astream(self, *args: Any, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:  # noqa: ANN401
+        if self.failures:
+            self.failures -= 1
+            raise ServerError
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+def test_parse_duration() -> None:
+    """Test that the durations sent in the Azure rate limit headers are parsed."""
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1.5s") == pytest.approx(1.5)
+    assert parse_duration("6m0s") == pytest.approx(360)
+    assert parse_duration("soon") is None
+
+
+def test_requested_delay() -> None:
+    """Test that the delay the backend asked for is read from the response, including from a wrapped error."""
+    wrapped = ValueError("Error raised by service")
+    wrapped.__cause__ = ServerError({"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "2s"})
+
+    assert requested_delay(ServerError({"Retry-After": "3"})) == pytest.approx(3)
+    assert requested_delay(ServerError({"retry-after-ms": "250"})) == pytest.approx(0.25)
+    assert requested_delay(wrapped) == pytest.approx(2)
+    assert requested_delay(ServerError()) is None
+
+
+def test_retry_budget() -> None:
+    """Test that the budget refuses retries once spent, until requests deposit more."""
+    budget = RetryBudget(ratio=0.5, min_per_second=0)
+
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+@pytest.mark.anyio()
+async def test_server_error_is_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a call failing before its first token is retried, counting against the request's budget."""
+    lifetime.init_models()
+    monkeypatch.setattr(settings, "retry_base_delay_seconds", 0.01)
+    monkeypatch.setattr(lifetime.retry_budget, "_balance", lifetime.retry_budget.capacity)
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FlakyChatModel(responses=["Hello"]))
+    breaker = CircuitBreaker(
+        DEFAULT_MODEL_KEY, failure_rate=0.5, window=10, min_calls=5, open_seconds=30, slow_call_seconds=30,
+    )
+    monkeypatch.setitem(lifetime.circuit_breakers, DEFAULT_MODEL_KEY, breaker)
+    route = ModelRoute(DEFAULT_MODEL_KEY)
+
+    response = await routed_llm(DEFAULT_MODEL_KEY).ainvoke(
+        [HumanMessage(content="Hi")], {"configurable": {"route": route}},
+    )
+
+    assert response.content == "Hello"
+    assert route.retries == 1
+
+
+def test_chat_endpoint_is_retried(fastapi_app: FastAPI, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the chat endpoint sends its calls through the routing layer, which retries them."""
+    monkeypatch.setattr(settings, "retry_base_delay_seconds", 0.01)
+    monkeypatch.setattr(lifetime.retry_budget, "_balance", lifetime.retry_budget.capacity)
+    with TestClient(fastapi_app) as test_client:
+        monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FlakyChatModel(responses=["Hello"]))
+        response = test_client.post(
+            fastapi_app.url_path_for("chat_handler"),
+            headers={"Authorization": "pytest_key", "x-business-user": "123"},
+            json={"messages": [{"role": "user", "content": "Hi"}]},
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text == "Hello"
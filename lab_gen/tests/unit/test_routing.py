@@ -0,0 +1,145 @@
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+
+from langchain_core.language_models.fake import FakeStreamingListLLM
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.prompt_values import ChatPromptValue
+
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, CircuitState, Model, ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.llm import lifetime
+from lab_gen.services.llm.circuit_breaker import CircuitBreaker
+from lab_gen.services.llm.lifetime import init_models
+from lab_gen.services.llm.routing import ModelCandidate, ModelRoute, is_failover_error, routed_llm
+
+
+FALLBACK_KEY = Model.compute_key(ModelProvider.BEDROCK, ModelVariant.ADVANCED, ModelFamily.CLAUDE)
+
+
+class UnreachableChatModel(FakeListChatModel):
+    """A chat model that fails to connect, or raises the given error."""
+
+    error: Exception = ConnectionError("Connection refused")
+
+    async def _astream(self, *args: Any, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:  # noqa: ANN401, ARG002
+        raise self.error
+        yield
+
+
+class ClosableChatModel(FakeListChatModel):
+    """A chat model that records whether its response stream was closed."""
+
+    closed: bool = False
+
+    async def _astream(self, *args: Any, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:  # noqa: ANN401
+        try:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+        finally:
+            self.closed = True
+
+
+class RateLimitError(Exception):
+    """An error from a model client that has been rate limited."""
+
+    status_code = 429
+
+
+@pytest.fixture()
+def with_fallback(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Give the default model a fallback, with fake clients for both."""
+    init_models()
+    primary = lifetime.models[DEFAULT_MODEL_KEY]
+    monkeypatch.setitem(lifetime.models, DEFAULT_MODEL_KEY, primary.model_copy(update={"fallbacks": [FALLBACK_KEY]}))
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, UnreachableChatModel(responses=[]))
+    monkeypatch.setitem(lifetime.model_providers, FALLBACK_KEY, FakeListChatModel(responses=["From the fallback"]))
+    for key in [DEFAULT_MODEL_KEY, FALLBACK_KEY]:
+        monkeypatch.setitem(
+            lifetime.circuit_breakers,
+            key,
+            CircuitBreaker(key, failure_rate=0.5, window=10, min_calls=1, open_seconds=30, slow_call_seconds=30),
+        )
+
+
+def test_failover_errors() -> None:
+    """Test that connection errors and rate limiting move a request on, including when wrapped by the client."""
+    init_models()
+    wrapped = ValueError("Error raised by service")
+    wrapped.__cause__ = TimeoutError()
+
+    assert is_failover_error(DEFAULT_MODEL_KEY, ConnectionError())
+    assert is_failover_error(DEFAULT_MODEL_KEY, RateLimitError())
+    assert is_failover_error(DEFAULT_MODEL_KEY, wrapped)
+    assert not is_failover_error(DEFAULT_MODEL_KEY, ValueError("Bad request"))
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback")
+async def test_request_fails_over() -> None:
+    """Test that a request moves to the fallback when the model cannot be reached, recording which model answered."""
+    route = ModelRoute(DEFAULT_MODEL_KEY)
+
+    chunks = [
+        chunk.content
+        async for chunk in routed_llm(DEFAULT_MODEL_KEY).astream(
+            [HumanMessage(content="Hello")], {"configurable": {"route": route}},
+        )
+    ]
+
+    assert "".join(chunks) == "From the fallback"
+    assert route.answered_by == FALLBACK_KEY
+    assert route.metadata_update()["modelKey"] == FALLBACK_KEY
+    assert route.metadata_update()["provider"] == ModelProvider.BEDROCK
+    assert lifetime.circuit_breakers[DEFAULT_MODEL_KEY].state == CircuitState.OPEN
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback")
+async def test_open_circuit_is_skipped() -> None:
+    """Test that a model whose circuit is open is left out of the chain."""
+    lifetime.circuit_breakers[DEFAULT_MODEL_KEY].record_failure()
+    lifetime.model_providers[DEFAULT_MODEL_KEY].error = AssertionError("Should not be called")
+
+    response = await routed_llm(DEFAULT_MODEL_KEY).ainvoke([HumanMessage(content="Hello")])
+
+    assert response.content == "From the fallback"
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback")
+async def test_other_errors_do_not_fail_over() -> None:
+    """Test that an error caused by the request is raised rather than sent to the fallback."""
+    lifetime.model_providers[DEFAULT_MODEL_KEY].error = ValueError("Bad request")
+
+    with pytest.raises(ValueError, match="Bad request"):
+        await routed_llm(DEFAULT_MODEL_KEY).ainvoke([HumanMessage(content="Hello")])
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback")
+async def test_text_completion_model_is_routed(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a model streaming strings rather than message chunks, such as HuggingFace, can be routed."""
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, FakeStreamingListLLM(responses=["Hello"]))
+
+    chunks = [chunk async for chunk in routed_llm(DEFAULT_MODEL_KEY).astream([HumanMessage(content="Hi")])]
+
+    assert "".join(chunks) == "Hello"
+
+
+@pytest.mark.anyio()
+@pytest.mark.usefixtures("with_fallback")
+async def test_stopped_stream_is_closed(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that the model's response stream is closed when the client stops reading, as on a disconnect."""
+    model = ClosableChatModel(responses=["Hello there"])
+    monkeypatch.setitem(lifetime.model_providers, DEFAULT_MODEL_KEY, model)
+
+    stream = ModelCandidate(DEFAULT_MODEL_KEY, failover=False).astream(
+        ChatPromptValue(messages=[HumanMessage(content="Hi")]), {},
+    )
+    await anext(stream)
+    await stream.aclose()
+
+    assert model.closed
@@ -0,0 +1,120 @@
+import threading
+import uuid
+
+import pytest
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from lab_gen.datatypes.metadata import ConversationMetadata
+from lab_gen.datatypes.models import ModelFamily, ModelProvider, ModelVariant
+from lab_gen.services.chat_history import sqlite_chat
+from lab_gen.services.chat_history.sqlite_chat import SqliteChatHistory, expire_conversations
+from lab_gen.settings import TEMP_DIR, settings
+
+
+TWO_MESSAGES = 2
+FOUR_MESSAGES = 4
+
+
+@pytest.fixture(autouse=True)
+def _chat_history_dir() -> None:
+    settings.chat_history_dir = TEMP_DIR
+
+
+@pytest.fixture()
+def chat_history() -> SqliteChatHistory:
+    """Fixture to create an instance of SqliteChatHistory with real metadata."""
+    metadata = ConversationMetadata(
+        provider=ModelProvider.AZURE,
+        variant=ModelVariant.GENERAL,
+        family=ModelFamily.GPT,
+        modelKey="fake_model_key",
+        business_user="test_business_user",
+    )
+    return SqliteChatHistory(str(uuid.uuid4()), "Test_User", metadata)
+
+
+def add_turns(chat_history: SqliteChatHistory, turns: int) -> None:
+    """Add the given number of human and ai message pairs to the history."""
+    for turn in range(turns):
+        chat_history.add_messages([HumanMessage(content=f"Question {turn}"), AIMessage(content=f"Answer {turn}")])
+
+
+def test_load_messages(chat_history: SqliteChatHistory) -> None:
+    """Test that a new instance loads the messages and metadata, matching the user without case."""
+    add_turns(chat_history, 2)
+
+    loaded = SqliteChatHistory(chat_history.session_id, "test_user", None)  # type: ignore  # noqa: PGH003
+
+    assert [m.content for m in loaded.messages] == ["Question 0", "Answer 0", "Question 1", "Answer 1"]
+    assert loaded.metadata.modelKey == "fake_model_key"
+
+
+def test_version_follows_other_writers(chat_history: SqliteChatHistory) -> None:
+    """Test that a loaded history's version stops matching the store once another instance writes to it."""
+    assert chat_history.version is None
+    add_turns(chat_history, 1)
+    assert chat_history.stored_version() == chat_history.version
+
+    other = SqliteChatHistory(chat_history.session_id, "test_user", None)  # type: ignore  # noqa: PGH003
+    assert other.version == chat_history.version
+    add_turns(other, 1)
+
+    assert chat_history.stored_version() != chat_history.version
+    assert chat_history.stored_version() == other.version
+
+
+def test_conversation_is_scoped_to_user(chat_history: SqliteChatHistory) -> None:
+    """Test that another user cannot load the conversation."""
+    add_turns(chat_history, 1)
+
+    loaded = SqliteChatHistory(chat_history.session_id, "other_user", None)  # type: ignore  # noqa: PGH003
+
+    assert loaded.messages == []
+    assert loaded.metadata is None
+
+
+def test_add_from_another_thread(chat_history: SqliteChatHistory) -> None:
+    """Test that writes from the threadpool use their own connection."""
+    add_turns(chat_history, 1)
+    thread = threading.Thread(target=add_turns, args=(chat_history, 1))
+    thread.start()
+    thread.join()
+
+    loaded = SqliteChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert len(loaded.messages) == FOUR_MESSAGES
+
+
+def test_delete(chat_history: SqliteChatHistory) -> None:
+    """Test that deleting a pair removes the last messages."""
+    add_turns(chat_history, 2)
+    chat_history.delete(1)
+    add_turns(chat_history, 1)
+
+    loaded = SqliteChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert [m.content for m in loaded.messages] == ["Question 0", "Answer 0", "Question 0", "Answer 0"]
+
+
+def test_clear(chat_history: SqliteChatHistory) -> None:
+    """Test clearing the chat history and deleting the conversation."""
+    add_turns(chat_history, 1)
+    chat_history.clear()
+
+    loaded = SqliteChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert len(chat_history.messages) == 0
+    assert loaded.messages == []
+
+
+def test_expire_conversations(chat_history: SqliteChatHistory, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that conversations not updated within the age are deleted."""
+    add_turns(chat_history, 1)
+    now = sqlite_chat.time.time()
+    monkeypatch.setattr(sqlite_chat.time, "time", lambda: now + 60)
+
+    expire_conversations(120)
+    loaded = SqliteChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert len(loaded.messages) == TWO_MESSAGES
+
+    expire_conversations(30)
+    loaded = SqliteChatHistory(chat_history.session_id, chat_history.user_id, None)  # type: ignore  # noqa: PGH003
+    assert loaded.messages == []
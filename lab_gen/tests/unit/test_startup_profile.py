@@ -0,0 +1,16 @@
+from lab_gen.startup_profile import ImportTime, parse_import_times
+
+
+def test_parse_import_times() -> None:
+    """Test that the importtime report is parsed, keeping the indentation of nested imports."""
+    output = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |   _json\n"
+        "import time:      1500 |       1620 | json\n"
+        "Some other output\n"
+    )
+
+    assert parse_import_times(output) == [
+        ImportTime("  _json", 120, 120),
+        ImportTime("json", 1500, 1620),
+    ]
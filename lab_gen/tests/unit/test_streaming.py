@@ -0,0 +1,46 @@
+import asyncio
+
+from collections.abc import AsyncGenerator
+
+import pytest
+
+from starlette import status
+
+from lab_gen.web.api.conversation.streaming_with_status import ChunkCoalescer, StreamingResponseWithStatusCode
+
+
+def test_coalescer_flushes_at_size_or_delay() -> None:
+    """Test that chunks are buffered until they reach the size or the first of them has waited the delay."""
+    coalescer = ChunkCoalescer(max_bytes=6, max_delay=0.02)
+
+    assert coalescer.timeout(0) is None
+    assert coalescer.add(b"ab", 1.0) is None
+    assert coalescer.timeout(1.01) == pytest.approx(0.01)
+    assert coalescer.add(b"cd", 1.01) is None
+    assert coalescer.add(b"ef", 1.015) == b"abcdef"
+    assert coalescer.add(b"gh", 2.0) is None
+    assert coalescer.add(b"ij", 2.03) == b"ghij"
+    assert coalescer.flush() == b""
+
+
+@pytest.mark.anyio()
+async def test_response_coalesces_chunks() -> None:
+    """Test that the first chunk is sent at once, the next are sent together, and a pause flushes what is buffered."""
+
+    async def chunks() -> AsyncGenerator[tuple[str, int], None]:
+        for chunk in ("a", "b", "c"):
+            yield chunk, 200
+        await asyncio.sleep(0.1)
+        yield "d", 200
+
+    messages = []
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    response = StreamingResponseWithStatusCode(chunks(), max_bytes=1024, max_delay=0.02)
+    await response.stream_response(send)
+
+    assert messages[0]["status"] == status.HTTP_200_OK
+    assert [message["body"] for message in messages[1:]] == [b"a", b"bc", b"d"]
+    assert not messages[-1]["more_body"]
@@ -0,0 +1,57 @@
+import pytest
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from lab_gen.services.conversation.history_window import count_message_tokens
+from lab_gen.services.conversation.summary import SUMMARY_PREFIX, summarise, summarised_history, summary_range
+
+
+def make_turns(turns: int) -> list[BaseMessage]:
+    """Create the given number of human and ai message pairs."""
+    messages: list[BaseMessage] = []
+    for turn in range(turns):
+        messages.extend([HumanMessage(content=f"Question {turn}"), AIMessage(content=f"Answer {turn}")])
+    return messages
+
+
+def test_nothing_is_summarised_below_threshold() -> None:
+    """Test that the summary is left alone while the unsummarised history is small."""
+    assert summary_range(make_turns(4), 0, 1000, 2) is None
+
+
+def test_older_turns_are_summarised() -> None:
+    """Test that turns after the first, apart from the most recent, are summarised once over the threshold."""
+    messages = make_turns(5)
+
+    assert summary_range(messages, 0, 10, 2) == (2, 6)
+    assert summary_range(messages, 6, 10, 2) is None
+
+
+def test_summary_replaces_summarised_turns() -> None:
+    """Test that the history sent holds the summary, the first turn and the unsummarised turns."""
+    messages = make_turns(4)
+
+    history = summarised_history(messages, "They asked three questions.", 6)
+
+    assert isinstance(history[0], SystemMessage)
+    assert history[0].content == SUMMARY_PREFIX + "They asked three questions."
+    assert [m.content for m in history[1:]] == ["Question 0", "Answer 0", "Question 3", "Answer 3"]
+    assert count_message_tokens(history[0]) > 0
+
+
+def test_stale_summary_is_ignored() -> None:
+    """Test that a summary covering more messages than are stored is not used."""
+    messages = make_turns(2)
+
+    assert summarised_history(messages, "Old summary", 6) == messages
+
+
+@pytest.mark.anyio()
+async def test_summarise() -> None:
+    """Test that the summary is written by the model."""
+    llm = FakeListChatModel(responses=["The user asked about the weather."])
+
+    summary = await summarise(llm, None, make_turns(1))
+
+    assert summary == "The user asked about the weather."
@@ -0,0 +1,58 @@
+from collections.abc import Sequence
+
+import pytest
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from lab_gen.services.chat_history.write_batch import HistoryWriteBatch
+
+
+class CountingHistory(BaseChatMessageHistory):
+    """An in-memory history that counts the writes made to it."""
+
+    def __init__(self) -> None:
+        self.messages = []
+        self.writes = 0
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add the messages with a single write."""
+        self.messages.extend(messages)
+        self.writes += 1
+
+    def clear(self) -> None:
+        """Clear the messages."""
+        self.messages = []
+
+
+@pytest.mark.anyio()
+async def test_turn_is_written_once() -> None:
+    """Test that the messages of a turn are held and then written together."""
+    store = CountingHistory()
+    batch = HistoryWriteBatch()
+    history = batch.track(store)
+
+    await history.aadd_messages([HumanMessage(content="Hello")])
+    await history.aadd_messages([AIMessage(content="Hi")])
+
+    assert store.writes == 0
+    assert [m.content for m in await history.aget_messages()] == ["Hello", "Hi"]
+
+    await batch.aflush()
+    await batch.aflush()
+
+    assert store.writes == 1
+    assert [m.content for m in store.messages] == ["Hello", "Hi"]
+
+
+def test_clear_drops_pending() -> None:
+    """Test that clearing drops the messages that have not been written."""
+    store = CountingHistory()
+    history = HistoryWriteBatch().track(store)
+    history.add_messages([HumanMessage(content="Hello")])
+
+    history.clear()
+    history.flush()
+
+    assert store.writes == 0
+    assert history.messages == []
@@ -1,10 +1,13 @@
 TEXT_MEDIA_TYPE = "text/plain; charset=utf-8"
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
 
 success200 = "Successful Response"
+success202 = "Request accepted"
 error429 = "The user has sent too many requests in a given amount of time"
 error422 = "Unprocessable Input"
 error400 = "Invalid User Input"
 error404 = "Conversation not found"
+error410 = "The events to resume from are no longer buffered"
 error501 = "Server error"
 error503 = "OpenAI server is busy"
 error500 = "OpenAI Response (Streaming) Error"
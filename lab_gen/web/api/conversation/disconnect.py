@@ -0,0 +1,67 @@
+import asyncio
+
+from collections.abc import AsyncGenerator, AsyncIterator, Awaitable
+from typing import Any, TypeVar
+
+from starlette.requests import ClientDisconnect, Request
+
+
+T = TypeVar("T")
+
+_END = object()
+
+
+async def wait_for_disconnect(request: Request) -> None:
+    """
+    Wait until the client of a request disconnects, once its body has been read.
+
+    Args:
+        request (Request): The request.
+    """
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def cancel_on_disconnect(
+    stream: AsyncIterator[T], request: Request | None, stopped: Awaitable[Any] | None = None,
+) -> AsyncGenerator[T, None]:
+    """
+    Yield the items of a stream until the client disconnects or it is stopped, then cancel and close the stream.
+
+    Closing the stream closes the upstream call to the model, so no more tokens are generated for a client that has
+    gone or has what it needs. The disconnect is watched with the ASGI `http.disconnect` message, rather than found
+    when a send fails, so it is noticed while the model is still working on its answer.
+
+    Args:
+        stream (AsyncIterator[T]): The stream, such as a chain's `astream`.
+        request (Request | None): The request the stream is the response to, None if it is detached from it.
+        stopped (Awaitable[Any] | None, optional): Completes when the stream should stop, ending it without an error.
+
+    Yields:
+        T: The items of the stream.
+
+    Raises:
+        ClientDisconnect: If the client disconnected before the stream ended.
+    """
+    disconnected = None if request is None else asyncio.ensure_future(wait_for_disconnect(request))
+    watched = [asyncio.ensure_future(task) for task in (disconnected, stopped) if task is not None]
+    tasks = watched
+    try:
+        while True:
+            pending = asyncio.ensure_future(anext(stream, _END))
+            tasks = [*watched, pending]
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                if disconnected is not None and disconnected.done():
+                    raise ClientDisconnect
+                return
+            item = pending.result()
+            if item is _END:
+                return
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+from collections.abc import AsyncGenerator
+from enum import Enum
+from typing import Any
+
+from fastapi.responses import StreamingResponse
+
+from lab_gen.web.api import constants
+
+
+KEEP_ALIVE_COMMENT = ": keep-alive\n\n"
+
+
+class StreamEvent(str, Enum):
+    """The types of event sent in a Server-Sent Events stream."""
+
+    TOKEN = "token"  # noqa: S105
+    USAGE = "usage"
+    BLOCKED = "blocked"
+    ERROR = "error"
+    DONE = "done"
+
+
+def wants_event_stream(accept: str | None) -> bool:
+    """
+    Decide whether a client asked for a Server-Sent Events stream rather than plain text.
+
+    Args:
+        accept (str | None): The request's Accept header.
+
+    Returns:
+        bool: True if the client accepts `text/event-stream`.
+    """
+    return accept is not None and constants.EVENT_STREAM_MEDIA_TYPE in accept
+
+
+def format_event(event: StreamEvent, data: dict[str, Any], event_id: int | None = None) -> str:
+    """
+    Format an event for a Server-Sent Events stream, with its data as JSON.
+
+    Args:
+        event (StreamEvent): The type of event.
+        data (dict[str, Any]): The data of the event.
+        event_id (int | None, optional): The ID of the event, which a client resumes from. Defaults to None.
+
+    Returns:
+        str: The event as sent on the stream.
+    """
+    prefix = "" if event_id is None else f"id: {event_id}\n"
+    return f"{prefix}event: {event.value}\ndata: {json.dumps(data)}\n\n"
+
+
+async def with_keep_alive(events: AsyncGenerator[str, None], interval: float) -> AsyncGenerator[str, None]:
+    """
+    Send a comment whenever no event has been sent for `interval` seconds, so proxies do not close an idle stream.
+
+    Args:
+        events (AsyncGenerator[str, None]): The formatted events.
+        interval (float): The seconds to wait for an event before sending a comment.
+
+    Yields:
+        str: The events, with keep-alive comments between them.
+    """
+    next_event = asyncio.ensure_future(anext(events, None))
+    try:
+        while True:
+            done, _ = await asyncio.wait([next_event], timeout=interval)
+            if not done:
+                yield KEEP_ALIVE_COMMENT
+                continue
+            event = next_event.result()
+            if event is None:
+                return
+            yield event
+            next_event = asyncio.ensure_future(anext(events, None))
+    finally:
+        next_event.cancel()
+        await asyncio.gather(next_event, return_exceptions=True)
+        await events.aclose()
+
+
+class EventStreamResponse(StreamingResponse):
+    """A streaming response for Server-Sent Events, which proxies and browsers should neither buffer nor cache."""
+
+    media_type = constants.EVENT_STREAM_MEDIA_TYPE
+
+    def __init__(self, content: AsyncGenerator[str, None], interval: float, **kwargs: Any) -> None:  # noqa: ANN401
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **kwargs.pop("headers", {})}
+        super().__init__(with_keep_alive(content, interval), headers=headers, **kwargs)
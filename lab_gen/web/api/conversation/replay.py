@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+from collections import deque
+from collections.abc import AsyncGenerator
+from itertools import islice
+from typing import Any
+
+from starlette.status import HTTP_410_GONE
+
+from lab_gen.settings import settings
+from lab_gen.web.api import constants
+from lab_gen.web.api.conversation.event_stream import StreamEvent, format_event
+
+
+class ReplayBuffer:
+    """The events of an answer streamed as Server-Sent Events, numbered so a client that reconnects can resume.
+
+    The answer is generated in a task detached from the request, which appends its events here. Each client follows
+    the buffer from the last event it received. While nobody is following, the answer keeps going for a grace period,
+    and is cancelled if no client has come back by its end.
+    """
+
+    def __init__(self, max_events: int, grace_seconds: float) -> None:
+        self.grace_seconds = grace_seconds
+        self.task: asyncio.Task | None = None
+        self.finished_at: float | None = None
+        self._events: deque[tuple[int, StreamEvent, dict[str, Any]]] = deque(maxlen=max_events)
+        self._last_id = 0
+        self._followers = 0
+        self._changed = asyncio.Event()
+        self._grace: asyncio.TimerHandle | None = None
+
+    @property
+    def done(self) -> bool:
+        """Whether the answer has finished, so no more events will be added."""
+        return self.finished_at is not None
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, event: StreamEvent, data: dict[str, Any]) -> None:
+        """
+        Add the next event of the answer, dropping the oldest once the buffer is full.
+
+        Args:
+            event (StreamEvent): The type of event.
+            data (dict[str, Any]): The data of the event.
+        """
+        self._last_id += 1
+        self._events.append((self._last_id, event, data))
+        self._notify()
+
+    def close(self) -> None:
+        """Mark the answer as finished."""
+        self.finished_at = time.monotonic()
+        if self._grace is not None:
+            self._grace.cancel()
+        self._notify()
+
+    def _first_id(self) -> int:
+        return self._events[0][0] if self._events else self._last_id + 1
+
+    def can_resume(self, last_id: int) -> bool:
+        """
+        Check whether the events after one a client received are still buffered.
+
+        Args:
+            last_id (int): The ID of the last event the client received, 0 for none.
+
+        Returns:
+            bool: True if no event after it has been dropped.
+        """
+        return self._first_id() <= last_id + 1 <= self._last_id + 1
+
+    async def follow(self, last_id: int = 0) -> AsyncGenerator[str, None]:
+        """
+        Stream the events after the last one a client received, then each new one until the answer finishes.
+
+        A client that falls so far behind that the events it has not received are dropped from the buffer is sent an
+        error event, and the stream ends, rather than carrying on with a gap in the answer.
+
+        Args:
+            last_id (int, optional): The ID of the last event the client received. Defaults to 0, from the start.
+
+        Yields:
+            str: The formatted events, with their IDs.
+        """
+        self._followers += 1
+        if self._grace is not None:
+            self._grace.cancel()
+            self._grace = None
+        try:
+            while True:
+                changed = self._changed
+                if last_id + 1 < self._first_id():
+                    yield format_event(StreamEvent.ERROR, {"status": HTTP_410_GONE, "message": constants.error410})
+                    return
+                # The IDs are consecutive, so the events after the last sent start at a known index
+                start = last_id + 1 - self._first_id()
+                for event_id, event, data in list(islice(self._events, start, None)):
+                    yield format_event(event, data, event_id)
+                    last_id = event_id
+                # More events may have been added, and the answer finished, while these were being sent
+                if last_id == self._last_id:
+                    if self.done:
+                        return
+                    await changed.wait()
+        finally:
+            self._followers -= 1
+            if not self._followers and not self.done:
+                self._grace = asyncio.get_running_loop().call_later(self.grace_seconds, self._expire)
+
+    def _expire(self) -> None:
+        if not self._followers and self.task is not None:
+            self.task.cancel()
+
+
+class ReplayRegistry:
+    """The replay buffers of the answers this worker is streaming or has just streamed, by user and conversation."""
+
+    def __init__(self) -> None:
+        self._buffers: dict[tuple[str, str], ReplayBuffer] = {}
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        expired = [
+            key for key, buffer in self._buffers.items()
+            if buffer.finished_at is not None and now - buffer.finished_at > settings.replay_ttl_seconds
+        ]
+        for key in expired:
+            del self._buffers[key]
+
+    def start(self, user_id: str, conversation_id: str) -> ReplayBuffer:
+        """
+        Create the buffer for a new answer in a conversation, replacing that of its previous answer.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            ReplayBuffer: The buffer.
+        """
+        self._expire()
+        buffer = ReplayBuffer(settings.replay_max_events, settings.replay_grace_seconds)
+        self._buffers[(user_id, conversation_id)] = buffer
+        return buffer
+
+    def get(self, user_id: str, conversation_id: str) -> ReplayBuffer | None:
+        """
+        Get the buffer of the answer being streamed in a conversation, or of its last if that finished recently.
+
+        Args:
+            user_id (str): The ID of the user.
+            conversation_id (str): The ID of the conversation.
+
+        Returns:
+            ReplayBuffer | None: The buffer, or None if there is none on this worker.
+        """
+        self._expire()
+        return self._buffers.get((user_id, conversation_id))
+
+
+replays = ReplayRegistry()
@@ -1,10 +1,89 @@
+import asyncio
+import time
+
+from typing import Any
+
 from fastapi.responses import StreamingResponse
 from starlette.types import Send
 
+from lab_gen.settings import settings
+
 
 SUCCESS_STATUS_CODE_START = 200
 SUCCESS_STATUS_CODE_END = 300
 
+
+def coalesce_limits(endpoint: str) -> tuple[int, float]:
+    """
+    Get the limits at which an endpoint's buffered chunks are sent.
+
+    Args:
+        endpoint (str): The name of the endpoint.
+
+    Returns:
+        tuple[int, float]: The bytes and seconds, the endpoint's own if it has them or else the defaults.
+    """
+    return settings.stream_coalesce_endpoints.get(
+        endpoint, (settings.stream_coalesce_bytes, settings.stream_coalesce_seconds),
+    )
+
+
+class ChunkCoalescer:
+    """Buffers the chunks of a stream, so small chunks are sent together at a size or after a delay."""
+
+    def __init__(self, max_bytes: int, max_delay: float) -> None:
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._chunks: list[bytes] = []
+        self._size = 0
+        self._first_at = 0.0
+
+    def add(self, chunk: bytes, now: float) -> bytes | None:
+        """
+        Buffer a chunk, flushing the buffer if it has reached the size or its first chunk has waited the delay.
+
+        Args:
+            chunk (bytes): The chunk.
+            now (float): The monotonic time the chunk arrived.
+
+        Returns:
+            bytes | None: The buffered chunks to send, or None to keep buffering.
+        """
+        if not self._chunks:
+            self._first_at = now
+        self._chunks.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_bytes or self.timeout(now) == 0:
+            return self.flush()
+        return None
+
+    def timeout(self, now: float) -> float | None:
+        """
+        Get how long the buffered chunks can still wait to be sent.
+
+        Args:
+            now (float): The monotonic time.
+
+        Returns:
+            float | None: The seconds until the buffer must be flushed, or None if it is empty.
+        """
+        if not self._chunks:
+            return None
+        return max(0.0, self._first_at + self.max_delay - now)
+
+    def flush(self) -> bytes:
+        """
+        Empty the buffer.
+
+        Returns:
+            bytes: The buffered chunks, joined.
+        """
+        body = b"".join(self._chunks)
+        self._chunks.clear()
+        self._size = 0
+        return body
+
+
 class StreamingResponseWithStatusCode(StreamingResponse):
     """
     Variation of StreamingResponse that can dynamically decide the HTTP status code, based on the returns from the.
@@ -13,7 +92,20 @@ class StreamingResponseWithStatusCode(StreamingResponse):
 
     Expects the content to yield tuples of (content: str, status_code: int).
     The constructor's status_code parameter is ignored but kept for compatibility with StreamingResponse.
+    After the first chunk, chunks are coalesced until they reach `max_bytes` or have waited `max_delay` seconds.
     """
+
+    def __init__(
+        self,
+        *args: Any,  # noqa: ANN401
+        max_bytes: int = 0,
+        max_delay: float = 0,
+        **kwargs: Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+
     async def stream_response(self, send: Send) -> None:
         """
         A coroutine that streams the response content to the client.
@@ -51,16 +143,48 @@ class StreamingResponseWithStatusCode(StreamingResponse):
         if content_to_send:
             await self.send_content(send, content_to_send, more_body=True)
 
-        # Continue streaming the rest of the response.
-        async for chunk_content, chunk_status in self.body_iterator:
-            if not (SUCCESS_STATUS_CODE_START <= int(chunk_status) < SUCCESS_STATUS_CODE_END):
-                self.status_code = chunk_status
-                await self.send_content(send, b"", more_body=False)  # End the response if status is not 2xx.
-                return
-            await self.send_content(send, chunk_content, more_body=True)
+        # Continue streaming the rest of the response, sending what is buffered when the stream ends.
+        coalescer = ChunkCoalescer(self.max_bytes, self.max_delay)
+        await self.send_content(send, await self.stream_coalesced(send, coalescer), more_body=False)
+
+    async def stream_coalesced(self, send: Send, coalescer: ChunkCoalescer) -> bytes:
+        """
+        Stream the rest of the content, buffering chunks until they reach the size or have waited the delay.
+
+        The wait for the next chunk is timed out when the buffer is due, so a pause in the stream does not hold back
+        the chunks already received.
 
-        # End the response.
-        await self.send_content(send, b"", more_body=False)
+        Parameters:
+            send (Send): The coroutine used to send data back to the client.
+            coalescer (ChunkCoalescer): The buffer of chunks.
+
+        Returns:
+            bytes: The chunks still buffered when the stream ends or a chunk has a status that is not 2xx.
+        """
+        pending = asyncio.ensure_future(anext(self.body_iterator, None))
+        try:
+            while True:
+                done, _ = await asyncio.wait([pending], timeout=coalescer.timeout(time.monotonic()))
+                if not done:
+                    await self.send_content(send, coalescer.flush(), more_body=True)
+                    continue
+                item = pending.result()
+                if item is None:
+                    break
+                chunk_content, chunk_status = item
+                if not (SUCCESS_STATUS_CODE_START <= int(chunk_status) < SUCCESS_STATUS_CODE_END):
+                    self.status_code = chunk_status  # End the response if status is not 2xx.
+                    break
+                if not isinstance(chunk_content, bytes):
+                    chunk_content = chunk_content.encode(self.charset)
+                body = coalescer.add(chunk_content, time.monotonic())
+                if body is not None:
+                    await self.send_content(send, body, more_body=True)
+                pending = asyncio.ensure_future(anext(self.body_iterator, None))
+        finally:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        return coalescer.flush()
 
     async def send_response_start(self, send: Send) -> None:
         """
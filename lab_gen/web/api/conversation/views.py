@@ -1,31 +1,55 @@
+import asyncio
+import math
+
 from collections.abc import AsyncGenerator
 from typing import Annotated
 
 from fastapi import Depends, HTTPException, Header
 from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from loguru import logger
 from pydantic import BaseModel, EncodedStr, Field, model_validator
 from pydantic.types import Base64UrlEncoder
+from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect, Request
 from starlette.status import (
     HTTP_400_BAD_REQUEST,
     HTTP_404_NOT_FOUND,
+    HTTP_410_GONE,
+    HTTP_429_TOO_MANY_REQUESTS,
     HTTP_500_INTERNAL_SERVER_ERROR,
     HTTP_503_SERVICE_UNAVAILABLE,
 )
 
-from lab_gen.datatypes.errors import InvalidParamsError, ModelKeyError, NoConversationError
+from lab_gen.datatypes.errors import (
+    CircuitOpenError,
+    ConcurrencyLimitError,
+    InvalidParamsError,
+    ModelKeyError,
+    NoConversationError,
+    RateLimitedError,
+)
 from lab_gen.datatypes.metadata import ContentType
 from lab_gen.datatypes.models import DEFAULT_MODEL_KEY
 from lab_gen.services.conversation.conversation import (
     ConversationService,
 )
 from lab_gen.services.conversation.dependencies import conversation_provider
+from lab_gen.services.conversation.history_window import TRUNCATED_KEY
 from lab_gen.services.metrics.dependencies import metrics_provider
 from lab_gen.services.metrics.metrics import Metric, MetricsService
+from lab_gen.settings import settings
 from lab_gen.web.api import constants
-from lab_gen.web.api.conversation.streaming_with_status import StreamingResponseWithStatusCode
+from lab_gen.web.api.conversation.disconnect import cancel_on_disconnect
+from lab_gen.web.api.conversation.event_stream import (
+    EventStreamResponse,
+    StreamEvent,
+    wants_event_stream,
+)
+from lab_gen.web.api.conversation.replay import ReplayBuffer, replays
+from lab_gen.web.api.conversation.streaming_with_status import StreamingResponseWithStatusCode, coalesce_limits
 from lab_gen.web.auth import get_api_key
 
 
@@ -78,9 +102,11 @@ class ConversationContinueRequest(BaseModel):
 
     Attributes:
         content (str | None): The string contents of the continuation message. Defaults to None.
+        hedge (bool): Whether to hedge the request to cut its tail latency. Defaults to False.
     """
 
     content: str | None = None
+    hedge: bool = False
 
 class ConversationStartRequest(ConversationRequest):
     """
@@ -90,9 +116,11 @@ class ConversationStartRequest(ConversationRequest):
         promptId (str): The ID of the prompt to use. Defaults to "DEFAULT".
         modelKey (str): The unique key for the model to use.
         variables (dict[str, str] | None): Map of variable names and values. Defaults to None.
+        hedge (bool): Whether to hedge the request to cut its tail latency. Defaults to False.
     """
 
     promptId: str = "DEFAULT"  # noqa: N815
+    hedge: bool = False
 
     @model_validator(mode="after")
     def check_required(self) -> "ConversationStartRequest":
@@ -117,6 +145,72 @@ class ConversationFileStartRequest(ConversationStartRequest):
     file: str | None = Annotated[str | None, EncodedStr(encoder=Base64UrlEncoder)]
     fileContentType: ContentType | None = ContentType.PNG  # noqa: N815
 
+def circuit_open_error(coe: CircuitOpenError) -> HTTPException:
+    """Creates the 503 response for a model whose circuit is open, saying when to retry.
+
+    Args:
+        coe (CircuitOpenError): The error raised for the model.
+
+    Returns:
+        HTTPException: The exception to raise from the endpoint.
+    """
+    return HTTPException(
+        HTTP_503_SERVICE_UNAVAILABLE, str(coe), headers={"Retry-After": str(math.ceil(coe.retry_after))},
+    )
+
+
+def rate_limited_error(rle: RateLimitedError) -> HTTPException:
+    """Creates the 429 response for a request shed by a deployment's rate limiter, saying when to retry.
+
+    Args:
+        rle (RateLimitedError): The error raised for the deployment.
+
+    Returns:
+        HTTPException: The exception to raise from the endpoint.
+    """
+    return HTTPException(
+        HTTP_429_TOO_MANY_REQUESTS, str(rle), headers={"Retry-After": str(math.ceil(rle.retry_after))},
+    )
+
+
+def unavailable_error(error: CircuitOpenError | RateLimitedError | ConcurrencyLimitError) -> HTTPException:
+    """Creates the response for a request that no model could take, because of a circuit, quota or concurrency limit.
+
+    Args:
+        error (CircuitOpenError | RateLimitedError | ConcurrencyLimitError): The error raised for the request.
+
+    Returns:
+        HTTPException: The exception to raise from the endpoint.
+    """
+    if isinstance(error, RateLimitedError):
+        return rate_limited_error(error)
+    if isinstance(error, CircuitOpenError):
+        return circuit_open_error(error)
+    return HTTPException(HTTP_503_SERVICE_UNAVAILABLE, str(error))
+
+
+def get_error_status(exception: BaseException) -> int:
+    """Picks the status code for an error raised while streaming a response.
+
+    Args:
+        exception (BaseException): The error raised, or an error it caused.
+
+    Returns:
+        int: 429 if the request was rate limited, 503 if the model's circuit is open or its provider is at its
+            concurrency limit, otherwise 500.
+    """
+    seen: set[int] = set()
+    current: BaseException | None = exception
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if isinstance(current, RateLimitedError):
+            return HTTP_429_TOO_MANY_REQUESTS
+        if isinstance(current, CircuitOpenError | ConcurrencyLimitError):
+            return HTTP_503_SERVICE_UNAVAILABLE
+        current = current.__cause__ or current.__context__
+    return HTTP_500_INTERNAL_SERVER_ERROR
+
+
 def get_error_message(exception: Exception) -> str:
     """Extracts an error message from an exception.
 
@@ -134,47 +228,200 @@ def get_error_message(exception: Exception) -> str:
         return str(exception)
 
 
-async def stream_chain_response(
+def cancel_turn(variables: dict[str, str], answer: str, config: dict, metrics: MetricsService, reason: str) -> None:
+    """Counts a turn whose answer was cut short, and holds its partial answer, marked truncated, for the turn's history.
+
+    Args:
+        variables: The input variables provided to the chain.
+        answer (str): The answer streamed before it was cut short.
+        config (dict): The configuration dictionary.
+        metrics (MetricsService): The metrics service.
+        reason (str): Why the answer was cut short, `disconnected` or `stopped`.
+    """
+    logger.info(f"Cancelling the answer, the client {reason}")
+    metrics.increment(Metric.COUNT_CANCELLED, config["configurable"]["metadata"], custom_meta={"reason": reason})
+    if answer:
+        messages = [AIMessage(content=answer, response_metadata={TRUNCATED_KEY: True})]
+        if "input" in variables:
+            messages.insert(0, HumanMessage(content=variables["input"]))
+        config["configurable"]["write_batch"].add_unfinished_turn(messages)
+
+
+async def chain_events(
     chain: RunnableWithMessageHistory,
     variables: dict[str, str],
     config: dict,
     metrics: MetricsService,
-) -> AsyncGenerator[tuple[str, int], None]:
-    """Streams responses from a conversation chain along with status codes.
+    request: Request | None = None,
+) -> AsyncGenerator[tuple[StreamEvent, dict], None]:
+    """Streams the events of a turn of a conversation chain: its tokens, then any error or block, its usage and done.
 
-    This asynchronously generates responses and status codes from the conversation chain for the given input.
-    It configures the chain to use the provided conversation ID as the session ID.
-    It also counts the number of tokens used in the conversation and sends them to the metrics service.
+    It also counts the number of tokens used in the conversation and sends them to the metrics service. If the client
+    disconnects, or the answer is stopped from the cancel endpoint, the chain is cancelled and the answer so far is kept
+    for the turn's history. A stopped answer still ends with its usage and done, marked stopped.
 
     Args:
         chain: The conversation chain to stream responses from.
         variables: The input variables to provide to the chain.
         config (dict): The configuration dictionary.
         metrics (MetricsService, optional): The metrics service.
+        request (Request | None, optional): The request, to watch for its client disconnecting. Defaults to None, for
+            a turn detached from its request.
 
     Yields:
-        AsyncGenerator[Tuple[str, int], None]: Tuples of response text and status codes streamed from the chain.
+        AsyncGenerator[tuple[StreamEvent, dict], None]: The type and data of each event.
     """
     metric_counter = config["callbacks"][0]
     blocked_counter = config["callbacks"][1]
-    meta = config["configurable"]["metadata"]
-
+    configurable = config["configurable"]
+    meta = configurable["metadata"]
+    generations = configurable["generations"]
+    generation = generations.start(configurable["user_id"], configurable["conversation_id"])
+
+    answer = []
+    stream = cancel_on_disconnect(
+        chain.astream(variables, config=config), request, generation.wait_stopped(generations.poll_seconds),
+    )
     try:
-        async for chunk in chain.astream(variables, config=config):
-            yield (chunk, OK_STATUS_CODE)
+        async for chunk in stream:
+            answer.append(chunk)
+            yield StreamEvent.TOKEN, {"content": chunk}
+    except ClientDisconnect:
+        cancel_turn(variables, "".join(answer), config, metrics, "disconnected")
+        return
+    except asyncio.CancelledError:
+        # The server noticed the disconnect first and cancelled the response, or nobody resumed a detached answer
+        cancel_turn(variables, "".join(answer), config, metrics, "disconnected")
+        raise
     except Exception as e:  # noqa: BLE001
         logger.error(f"Error occurred: {e}")
 
         if not blocked_counter.has_blocked:
             metrics.increment(Metric.COUNT_ERRORS, meta)
-            yield (get_error_message(e), 500)
+            yield StreamEvent.ERROR, {"status": get_error_status(e), "message": get_error_message(e)}
+    finally:
+        generations.finish(configurable["user_id"], configurable["conversation_id"], generation)
+
+    stopped = generation.stopped.is_set()
+    if stopped:
+        cancel_turn(variables, "".join(answer), config, metrics, "stopped")
 
     if blocked_counter.has_blocked:
         metrics.increment(Metric.COUNT_CONTENT_FILTERED, meta)
         logger.warning(BLOCKED_CONTENT_RESPONSE)
-        yield (BLOCKED_CONTENT_RESPONSE, BAD_REQUEST_STATUS_CODE)
+        yield StreamEvent.BLOCKED, {"status": BAD_REQUEST_STATUS_CODE, "message": BLOCKED_CONTENT_RESPONSE}
 
     metrics.record_llm_metrics(metric_counter, meta)
+    yield StreamEvent.USAGE, metric_counter.usage()
+    yield StreamEvent.DONE, {"reason": "stopped"} if stopped else {}
+
+
+async def stream_chain_response(
+    chain: RunnableWithMessageHistory,
+    variables: dict[str, str],
+    config: dict,
+    metrics: MetricsService,
+    request: Request | None = None,
+) -> AsyncGenerator[tuple[str, int], None]:
+    """Streams responses from a conversation chain along with status codes.
+
+    This asynchronously generates responses and status codes from the conversation chain for the given input.
+
+    Args:
+        chain: The conversation chain to stream responses from.
+        variables: The input variables to provide to the chain.
+        config (dict): The configuration dictionary.
+        metrics (MetricsService, optional): The metrics service.
+        request (Request | None, optional): The request, to watch for its client disconnecting.
+
+    Yields:
+        AsyncGenerator[Tuple[str, int], None]: Tuples of response text and status codes streamed from the chain.
+    """
+    async for event, data in chain_events(chain, variables, config, metrics, request):
+        if event == StreamEvent.TOKEN:
+            yield (data["content"], OK_STATUS_CODE)
+        elif event in (StreamEvent.ERROR, StreamEvent.BLOCKED):
+            yield (data["message"], data["status"])
+
+
+async def buffer_chain_events(  # noqa: PLR0913
+    buffer: ReplayBuffer,
+    chain: RunnableWithMessageHistory,
+    variables: dict[str, str],
+    config: dict,
+    metrics: MetricsService,
+    finish: BackgroundTask,
+) -> None:
+    """Runs a turn of a conversation chain detached from its request, adding its events to the turn's replay buffer.
+
+    The turn is finished, saving it to the history, before the buffer is closed, so a client that has the last event
+    can continue the conversation.
+
+    Args:
+        buffer (ReplayBuffer): The buffer that the clients follow.
+        chain: The conversation chain to stream responses from.
+        variables: The input variables to provide to the chain.
+        config (dict): The configuration dictionary.
+        metrics (MetricsService): The metrics service.
+        finish (BackgroundTask): The task that finishes the turn.
+    """
+    try:
+        async for event, data in chain_events(chain, variables, config, metrics):
+            buffer.append(event, data)
+    finally:
+        try:
+            await finish()
+        finally:
+            buffer.close()
+
+
+def chain_response(  # noqa: PLR0913
+    chain: RunnableWithMessageHistory,
+    variables: dict[str, str],
+    config: dict,
+    metrics: MetricsService,
+    *,
+    request: Request,
+    endpoint: str,
+    conversation_id: str,
+    background: BackgroundTask,
+    accept: str | None,
+) -> StreamingResponse:
+    """Creates the streaming response for a turn of a conversation, as Server-Sent Events if the client accepts them.
+
+    Server-Sent Events are generated in a task detached from the request, so the client can reconnect and resume them.
+
+    Args:
+        chain: The conversation chain to stream responses from.
+        variables: The input variables to provide to the chain.
+        config (dict): The configuration dictionary.
+        metrics (MetricsService): The metrics service.
+        request (Request): The request, to watch for its client disconnecting.
+        endpoint (str): The name of the endpoint, for its limits on coalescing chunks.
+        conversation_id (str): The ID of the conversation, returned in a header.
+        background (BackgroundTask): The task that finishes the turn, once the response has been sent or, for
+            Server-Sent Events, the answer has finished.
+        accept (str | None): The request's Accept header.
+
+    Returns:
+        StreamingResponse: The response.
+    """
+    headers = {CONVERSATION_ID: conversation_id}
+    if wants_event_stream(accept):
+        # Generated apart from the request, so a client that reconnects can resume it from the replay buffer
+        buffer = replays.start(config["configurable"]["user_id"], conversation_id)
+        buffer.task = asyncio.create_task(buffer_chain_events(buffer, chain, variables, config, metrics, background))
+        return EventStreamResponse(buffer.follow(), settings.sse_keep_alive_seconds, headers=headers)
+    max_bytes, max_delay = coalesce_limits(endpoint)
+    return StreamingResponseWithStatusCode(
+        stream_chain_response(chain, variables=variables, config=config, metrics=metrics, request=request),
+        headers=headers,
+        media_type=constants.TEXT_MEDIA_TYPE,
+        background=background,
+        max_bytes=max_bytes,
+        max_delay=max_delay,
+    )
+
 
 @router.post(
     "/conversations",
@@ -187,13 +434,15 @@ async def stream_chain_response(
         503: {"description": constants.error503},
     },
 )
-async def start_conversation(  # noqa: D417
+async def start_conversation(  # noqa: D417, PLR0913
     start: ConversationStartRequest,
     x_business_user: Annotated[str, Header()],
+    accept: Annotated[str | None, Header()] = None,
     *,
     api_key: key_check,
     conversation: conversation_service,
     metrics: metrics_service,
+    request: Request,
 ) -> StreamingResponse:
     """Starts a new conversation.
 
@@ -206,6 +455,7 @@ async def start_conversation(  # noqa: D417
         variables: Map of variable names and values.
         promptId: The ID of the prompt to use.
         x_business_user: business user ID header.
+        accept: `text/event-stream` to receive the response as Server-Sent Events.
 
     Returns:
         The response from the LLM.
@@ -248,27 +498,31 @@ async def start_conversation(  # noqa: D417
     logger.debug(f"Has api key {api_key}")
     try:
         meta = conversation.get_metadata(model_key=start.modelKey, business_user=x_business_user)
-        config, conversation_id, chain = conversation.start(
+        config, conversation_id, chain = await conversation.start(
             meta,
             start.promptId.lower(),
+            hedge=start.hedge,
         )
         input_variables = {"user_id": x_business_user}
         if start.variables:
             input_variables.update(start.variables)
         if start.content:
             input_variables.update({"input": start.content})
-        return StreamingResponseWithStatusCode(
-            stream_chain_response(
+        return chain_response(
             chain,
-            variables=input_variables,
-            config=config,
-            metrics=metrics,
-            ),
-            headers={CONVERSATION_ID: conversation_id},
-            media_type=constants.TEXT_MEDIA_TYPE,
+            input_variables,
+            config,
+            metrics,
+            request=request,
+            endpoint="start_conversation",
+            conversation_id=conversation_id,
+            background=BackgroundTask(conversation.finish_turn, config),
+            accept=accept,
         )
     except ModelKeyError as ke:
         raise HTTPException(HTTP_400_BAD_REQUEST, str(ke)) from ke
+    except CircuitOpenError as coe:
+        raise circuit_open_error(coe) from coe
     except Exception as e:
         logger.exception("Conversation Chain error")
         raise HTTPException(HTTP_500_INTERNAL_SERVER_ERROR, constants.error503) from e
@@ -290,16 +544,19 @@ async def continue_conversation(  # noqa: D417, PLR0913
     conversationId: str,  # noqa: N803
     convo: ConversationContinueRequest,
     x_business_user: Annotated[str, Header()],
+    accept: Annotated[str | None, Header()] = None,
     *,
     api_key: key_check,
     conversation: conversation_service,
     metrics: metrics_service,
+    request: Request,
 ) -> StreamingResponse:
     """Continues an existing conversation by sending a new message to the conversation and returning the response.
 
     Arguments:
         conversationId: The ID of the conversation to continue.
         content: The new message content to send to the conversation.
+        accept: `text/event-stream` to receive the response as Server-Sent Events.
 
     Returns:
         The response from the LLM.
@@ -309,14 +566,22 @@ async def continue_conversation(  # noqa: D417, PLR0913
     """
     logger.debug(f"Conversation api key {api_key}")
     try:
-        config, chain = conversation.get(conversationId, x_business_user)
-        return StreamingResponseWithStatusCode(
-            stream_chain_response(chain, config=config, metrics=metrics, variables={"input": convo.content}),
-            headers={CONVERSATION_ID: conversationId},
-            media_type=constants.TEXT_MEDIA_TYPE,
+        config, chain = await conversation.get(conversationId, x_business_user, hedge=convo.hedge)
+        return chain_response(
+            chain,
+            {"input": convo.content},
+            config,
+            metrics,
+            request=request,
+            endpoint="continue_conversation",
+            conversation_id=conversationId,
+            background=BackgroundTask(conversation.finish_turn, config),
+            accept=accept,
         )
     except NoConversationError as nce:
         raise HTTPException(HTTP_404_NOT_FOUND, str(nce)) from nce
+    except CircuitOpenError as coe:
+        raise circuit_open_error(coe) from coe
     except Exception as e:
         logger.exception("Conversation Chain error")
         raise HTTPException(HTTP_503_SERVICE_UNAVAILABLE, constants.error503) from e
@@ -337,7 +602,7 @@ async def conversation_history(  # noqa: D417
     *,
     api_key: bool = Depends(get_api_key),
     conversation: ConversationService = Depends(conversation_provider),  # noqa: B008
-) -> list[dict[str, str]]:
+) -> list[dict[str, str | bool]]:
     """Gets the message history for a conversation.
 
     Arguments:
@@ -351,12 +616,94 @@ async def conversation_history(  # noqa: D417
     """
     try:
         logger.debug(f"History api key {api_key}")
-        return conversation.history(x_business_user, conversationId)
+        return await conversation.history(x_business_user, conversationId)
 
     except NoConversationError as nce:
         raise HTTPException(HTTP_404_NOT_FOUND, str(nce)) from nce
 
 
+@router.post(
+    "/conversations/{conversationId}/cancel",
+    tags=["conversation"],
+    responses={
+        202: {"description": constants.success202},
+    },
+    status_code=202,
+)
+async def cancel_conversation(  # noqa: D417
+    conversationId: str,  # noqa: N803
+    x_business_user: Annotated[str, Header()],
+    *,
+    api_key: key_check,
+    conversation: conversation_service,
+) -> None:
+    """Stops the answer being streamed for a conversation, keeping the connection open.
+
+    The stream ends with the answer so far, which is saved to the history marked truncated. With Server-Sent Events
+    the stream's `done` event has the reason `stopped`. If another worker is streaming the answer, it is signalled and
+    stops when it next checks, so the request is accepted rather than confirmed.
+
+    Arguments:
+        conversationId: The ID of the conversation whose answer to stop.
+        x_business_user: business user ID header.
+    """
+    logger.debug(f"Cancel conversation api key {api_key}")
+    if not await conversation.generations.stop(x_business_user, conversationId):
+        logger.info(f"Signalled the other workers to stop the answer for {conversationId}")
+
+
+@router.get(
+    "/conversations/{conversationId}/stream",
+    tags=["conversation"],
+    responses={
+        200: {"description": constants.success200},
+        400: {"description": constants.error400},
+        404: {"description": constants.error404},
+        410: {"description": constants.error410},
+    },
+    response_class=EventStreamResponse,
+)
+async def resume_conversation(  # noqa: D417
+    conversationId: str,  # noqa: N803
+    x_business_user: Annotated[str, Header()],
+    last_event_id: Annotated[str | None, Header()] = None,
+    offset: int = 0,
+    *,
+    api_key: key_check,
+) -> EventStreamResponse:
+    """Resumes the Server-Sent Events stream of the conversation's latest answer, after a client reconnects.
+
+    The events after the last one the client received are sent again, then the rest of the answer as it streams. An
+    answer keeps streaming for a grace period after its client disconnects, and stays buffered for a while after it
+    finishes. The buffers are held by the worker that streamed the answer.
+
+    Arguments:
+        conversationId: The ID of the conversation whose answer to resume.
+        x_business_user: business user ID header.
+        last_event_id: The ID of the last event received, as the browser's `EventSource` sends it.
+        offset: The ID of the last event received, if the header cannot be set. Defaults to 0, from the start.
+
+    Returns:
+        The stream of the answer's events.
+
+    Raises:
+         HTTPException if there is no answer to resume or its events have been dropped.
+    """
+    logger.debug(f"Resume conversation api key {api_key}")
+    buffer = replays.get(x_business_user, conversationId)
+    if buffer is None:
+        raise HTTPException(HTTP_404_NOT_FOUND, constants.error404)
+    try:
+        after = offset if last_event_id is None else int(last_event_id)
+    except ValueError as ve:
+        raise HTTPException(HTTP_400_BAD_REQUEST, constants.error400) from ve
+    if not buffer.can_resume(after):
+        raise HTTPException(HTTP_410_GONE, constants.error410)
+    return EventStreamResponse(
+        buffer.follow(after), settings.sse_keep_alive_seconds, headers={CONVERSATION_ID: conversationId},
+    )
+
+
 @router.delete(
     "/conversations/{conversationId}",
     tags=["conversation"],
@@ -380,7 +727,7 @@ async def end_conversation(  # noqa: D417
     """
     try:
         logger.debug(f"End conversation api key {api_key}")
-        conversation.end(x_business_user, conversationId)
+        await conversation.end(x_business_user, conversationId)
 
     except NoConversationError as nce:
         raise HTTPException(HTTP_404_NOT_FOUND, str(nce)) from nce
@@ -420,7 +767,7 @@ async def delete_history_entry(
         HTTPException: 400 error if the num_entries parameter is not an integer.
     """
     try:
-        conversation.delete_history(x_business_user, conversationId, num_entries)
+        await conversation.delete_history(x_business_user, conversationId, num_entries)
     except NoConversationError as nce:
         raise HTTPException(HTTP_404_NOT_FOUND, str(nce)) from nce
     except InvalidParamsError as ipe:
@@ -75,7 +75,7 @@ class CreateScoreRequest(BaseModel):
         429: {"description": "The user has sent too many requests in a given amount of time"},
     },
 )
-def scores_handler(
+async def scores_handler(
     score: CreateScoreRequest,
     x_business_user: Annotated[str, Header()],
     *,
@@ -91,7 +91,7 @@ def scores_handler(
     meta = {
         "score_name": score.name,
     }
-    history = conversation.get_message_history(user_id=x_business_user, conversation_id=score.conversationId)
+    history = await conversation.aget_message_history(user_id=x_business_user, conversation_id=score.conversationId)
     if history.metadata is None:
         raise HTTPException(HTTP_404_NOT_FOUND, str(NoConversationError(score.conversationId)))
     if score.value == 1:
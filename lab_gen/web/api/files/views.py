@@ -9,21 +9,22 @@ from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from loguru import logger
+from starlette.background import BackgroundTask
+from starlette.requests import Request
 from starlette.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR
 
 from lab_gen.datatypes.calls import Call
-from lab_gen.datatypes.errors import ModelKeyError
+from lab_gen.datatypes.errors import CircuitOpenError, ModelKeyError
 from lab_gen.services.conversation.conversation import ConversationService
 from lab_gen.services.conversation.dependencies import conversation_provider
-from lab_gen.services.llm.lifetime import get_llm
+from lab_gen.services.llm.routing import routed_llm
 from lab_gen.services.metrics.dependencies import metrics_provider
 from lab_gen.services.metrics.metrics import Metric, MetricsService
 from lab_gen.web.api import constants
-from lab_gen.web.api.conversation.streaming_with_status import StreamingResponseWithStatusCode
 from lab_gen.web.api.conversation.views import (
-    CONVERSATION_ID,
     ConversationFileStartRequest,
-    stream_chain_response,
+    chain_response,
+    circuit_open_error,
 )
 from lab_gen.web.auth import get_api_key
 
@@ -52,13 +53,15 @@ parser = JsonOutputParser(pydantic_object=Call)
         503: {"description": constants.error503},
     },
 )
-async def start_file_conversation(  # noqa: D417
+async def start_file_conversation(  # noqa: D417, PLR0913
     start: ConversationFileStartRequest,
     x_business_user: Annotated[str, Header()],
+    accept: Annotated[str | None, Header()] = None,
     *,
     api_key: key_check,
     conversation: conversation_service,
     metrics: metrics_service,
+    request: Request,
 ) -> StreamingResponse:
     """Starts a new conversation.
 
@@ -74,6 +77,7 @@ async def start_file_conversation(  # noqa: D417
         x_business_user: business user ID header.
         file: The image file to send in base64.
         fileContentType: The content type of the file.
+        accept: `text/event-stream` to receive the response as Server-Sent Events.
 
     Returns:
         The response from the LLM.
@@ -96,52 +100,51 @@ async def start_file_conversation(  # noqa: D417
         input_variables = {"user_id": x_business_user}
 
         conversation_id = str(uuid.uuid4())  # Generate a new UUID
-        llm = get_llm(start.modelKey)
         content = start.variables.get("input") if start.content is None else start.content
 
-        if llm:
-            messages = []
-            if start.file is not None:
-                # I had a problem with detecting the optional file string,
-                # the `is_a_file` logic below works.
-                is_a_file = get_origin(start.file) != Annotated
-                if is_a_file:
-                    if start.fileContentType is None:
-                        msg = "ContentType is required when file is provided"
-                        raise ValueError(msg)  # noqa: TRY301
-                    image_message = {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:{start.fileContentType.value};base64,{start.file}"},
-                    }
-                    text_message = {
-                        "type": "text",
-                        "text": content,
-                    }
-                    messages.append(HumanMessage(content=[text_message, image_message]))
-
-            else:
-                messages.append(("human", content))
-
-            chat_prompt = ChatPromptTemplate.from_messages(messages)
-            chain = conversation.create_chain(llm, chat_prompt)
-            conversation.app.state.metrics_provider.increment(Metric.COUNT_CHAT_REQUESTS, meta.model_dump())
-
-            config = conversation.generate_config(meta, conversation_id, llm)
-            return StreamingResponseWithStatusCode(
-                stream_chain_response(
-                    chain,
-                    variables=input_variables,
-                    config=config,
-                    metrics=metrics,
-                ),
-                headers={CONVERSATION_ID: conversation_id},
-                media_type=constants.TEXT_MEDIA_TYPE,
-            )
-        else:  # noqa: RET505
-            logger.warning("Unable to create llm.")
-            raise HTTPException(HTTP_500_INTERNAL_SERVER_ERROR, constants.error501)  # noqa: TRY301
+        messages = []
+        if start.file is not None:
+            # I had a problem with detecting the optional file string,
+            # the `is_a_file` logic below works.
+            is_a_file = get_origin(start.file) != Annotated
+            if is_a_file:
+                if start.fileContentType is None:
+                    msg = "ContentType is required when file is provided"
+                    raise ValueError(msg)  # noqa: TRY301
+                image_message = {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{start.fileContentType.value};base64,{start.file}"},
+                }
+                text_message = {
+                    "type": "text",
+                    "text": content,
+                }
+                messages.append(HumanMessage(content=[text_message, image_message]))
+
+        else:
+            messages.append(("human", content))
+
+        chat_prompt = ChatPromptTemplate.from_messages(messages)
+        chain = conversation.create_chain(routed_llm(start.modelKey, hedge=start.hedge), chat_prompt)
+        conversation.app.state.metrics_provider.increment(Metric.COUNT_CHAT_REQUESTS, meta.model_dump())
+
+        config = conversation.generate_config(meta, conversation_id)
+        await conversation.aload_turn_history(config)
+        return chain_response(
+            chain,
+            input_variables,
+            config,
+            metrics,
+            request=request,
+            endpoint="start_file_conversation",
+            conversation_id=conversation_id,
+            background=BackgroundTask(conversation.finish_turn, config),
+            accept=accept,
+        )
     except ModelKeyError as ke:
         raise HTTPException(HTTP_400_BAD_REQUEST, str(ke)) from ke
+    except CircuitOpenError as coe:
+        raise circuit_open_error(coe) from coe
     except Exception as e:
         logger.exception("Conversation Chain error")
         raise HTTPException(HTTP_500_INTERNAL_SERVER_ERROR, constants.error503) from e
@@ -1,4 +1,6 @@
 
+import time
+
 from collections.abc import AsyncGenerator
 from typing import Annotated
 
@@ -7,6 +9,8 @@ import tiktoken
 from fastapi import Depends, HTTPException, Header
 from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
+from langchain_core.messages import convert_to_messages
+from langchain_core.prompt_values import ChatPromptValue
 from loguru import logger
 from pydantic import BaseModel, Field
 from slowapi import Limiter
@@ -14,11 +18,19 @@ from slowapi.util import get_remote_address
 from starlette.requests import Request
 from starlette.status import HTTP_400_BAD_REQUEST, HTTP_500_INTERNAL_SERVER_ERROR, HTTP_503_SERVICE_UNAVAILABLE
 
-from lab_gen.datatypes.errors import ModelKeyError
-from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, Model
+from lab_gen.datatypes.errors import CircuitOpenError, ConcurrencyLimitError, ModelKeyError, RateLimitedError
+from lab_gen.datatypes.models import DEFAULT_MODEL_KEY, ModelStatus
 from lab_gen.services.conversation.conversation import SYSTEM_MESSAGE
-from lab_gen.services.llm.lifetime import get_llm, get_model
+from lab_gen.services.llm.lifetime import get_circuit_state, get_model
+from lab_gen.services.llm.routing import routed_llm
 from lab_gen.settings import settings
+from lab_gen.web.api.conversation.event_stream import (
+    EventStreamResponse,
+    StreamEvent,
+    format_event,
+    wants_event_stream,
+)
+from lab_gen.web.api.conversation.views import circuit_open_error, unavailable_error
 from lab_gen.web.auth import get_api_key
 
 
@@ -62,14 +74,43 @@ class Chat(BaseModel):
 
 
 @router.get("/models/")
-async def read_models() -> list[Model]:
+async def read_models() -> list[ModelStatus]:
     """
-    Retrieves a list of model definitions.
+    Retrieves a list of model definitions, with the state of each model's circuit breaker.
 
     Returns:
-        list[Model]: A list of Models representing the available models.
+        list[ModelStatus]: A list of Models representing the available models.
+    """
+    modelz = {}
+    for model in settings.models + settings.models_vertex:
+        # Further configs for a key are deployments of the same model
+        modelz.setdefault(model.key, model)
+    return [ModelStatus(**dict(model), circuit=get_circuit_state(key)) for key, model in modelz.items()]
+
+
+async def chat_events(stream: AsyncGenerator[str, None], usage: dict) -> AsyncGenerator[str, None]:
+    """
+    Send a chat's response as Server-Sent Events, ending with its usage and timings once the stream is done.
+
+    Args:
+        stream (AsyncGenerator[str, None]): The chat's response.
+        usage (dict): The token counts, filled in as the response streams.
+
+    Yields:
+        str: The formatted events.
     """
-    return settings.models + settings.models_vertex
+    started = time.monotonic()
+    first_token_seconds = None
+    try:
+        async for content in stream:
+            if first_token_seconds is None:
+                first_token_seconds = time.monotonic() - started
+            yield format_event(StreamEvent.TOKEN, {"content": content})
+    except HTTPException as e:
+        yield format_event(StreamEvent.ERROR, {"status": e.status_code, "message": e.detail})
+    timings = {"first_token_seconds": first_token_seconds, "duration_seconds": time.monotonic() - started}
+    yield format_event(StreamEvent.USAGE, {**usage, **timings})
+    yield format_event(StreamEvent.DONE, {})
 
 
 @router.post(
@@ -84,9 +125,10 @@ async def read_models() -> list[Model]:
     },
 )
 @limiter.limit(settings.rate_limit_default)
-async def chat_handler(
+async def chat_handler(  # noqa: C901
     chat: Chat,
     x_business_user: Annotated[str | None, Header()] = None,
+    accept: Annotated[str | None, Header()] = None,
     *,
     api_key: bool = Depends(get_api_key),
     request: Request,  # used by limiter
@@ -95,12 +137,14 @@ async def chat_handler(
     Asynchronously generates a stream of responses from the OpenAI chat model.
 
     Returns:
-        A stream of responses from the OpenAI chat model.
+        A stream of responses from the OpenAI chat model, as Server-Sent Events if the Accept header is
+        `text/event-stream`.
 
     Raises:
         HTTPException: If there is an error in the OpenAI API response.
     """
     logger.debug(f"Has api key {api_key}")
+    usage = {"input_tokens": 0, "output_tokens": 0}
 
     async def response_stream() -> AsyncGenerator[str, None]:
         completion_tokens = 0
@@ -118,9 +162,10 @@ async def chat_handler(
         for message in chat.messages:
             prompt_tokens += len(encoding.encode(message.content))
             messages.append((message.role, message.content))
+        usage["input_tokens"] = prompt_tokens
 
         try:
-            client = get_llm(chat.modelKey)
+            routed = routed_llm(chat.modelKey)
             model = get_model(chat.modelKey)
             logger.debug(f"User is {x_business_user} and Chat Model name is : {model.identifier}")
 
@@ -139,17 +184,22 @@ async def chat_handler(
 
         except ModelKeyError as ke:
             raise HTTPException(HTTP_400_BAD_REQUEST, str(ke)) from ke
+        except CircuitOpenError as coe:
+            raise circuit_open_error(coe) from coe
         except Exception as e:
             logger.exception("Error from chat endpoint")
             raise HTTPException(HTTP_503_SERVICE_UNAVAILABLE, error503) from e
         try:
-            async for chunk in client.astream(messages):
+            async for chunk in routed.astream(ChatPromptValue(messages=convert_to_messages(messages))):
                 current_content = chunk.content
                 if current_content is not None:
                     # Calculate the number of tokens in the response
                     chunk_tokens = encoding.encode(current_content)
                     completion_tokens += len(chunk_tokens)
+                    usage["output_tokens"] = completion_tokens
                     yield current_content
+        except (CircuitOpenError, RateLimitedError, ConcurrencyLimitError) as e:
+            raise unavailable_error(e) from e
         except Exception as e:
             logger.exception("Chat endpoint Response (Streaming) Error")
             raise HTTPException(HTTP_500_INTERNAL_SERVER_ERROR, error500) from e
@@ -157,4 +207,6 @@ async def chat_handler(
         # Record the completion tokens metric
         completion_tokens_counter.record(completion_tokens, meta)
 
+    if wants_event_stream(accept):
+        return EventStreamResponse(chat_events(response_stream(), usage), settings.sse_keep_alive_seconds)
     return StreamingResponse(response_stream(), media_type="text/plain; charset=utf-8")
@@ -2,6 +2,7 @@ from fastapi import APIRouter
 from starlette.requests import Request
 
 from lab_gen.datatypes.health import Health, HealthStatus
+from lab_gen.services.llm.lifetime import deployment_models, get_circuit_state
 from lab_gen.services.metrics.metrics import METRICS_AVAILABLE
 
 
@@ -13,7 +14,9 @@ def health_check(request: Request) -> Health:
     """
     Checks the health of the application.
 
-    It returns 200 if the application is healthy.
+    It returns 200 if the application is healthy. The state of the circuit breaker around each model deployment is
+    reported under `models`, without affecting the overall status, as the other models can still be used while one is
+    failing.
     """
     health_status = {}
     overall = HealthStatus.OUT_OF_SERVICE
@@ -28,4 +31,7 @@ def health_check(request: Request) -> Health:
     if all(status == HealthStatus.UP for status in health_status.values()):
         overall = HealthStatus.UP
 
-    return Health(status=overall, detail=health_status)
+    return Health(
+        status=overall,
+        detail={**health_status, "models": {name: get_circuit_state(name) for name in deployment_models}},
+    )
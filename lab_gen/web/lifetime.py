@@ -14,7 +14,7 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
-from lab_gen.services.chat_history.lifetime import init_cosmosdb
+from lab_gen.services.chat_history.lifetime import close_cosmosdb, init_cosmosdb
 from lab_gen.services.conversation.lifetime import init_conversation
 from lab_gen.services.llm.lifetime import init_models
 from lab_gen.services.metrics.lifetime import init_metrics
@@ -123,6 +123,7 @@ def register_shutdown_event(
 
     @app.on_event("shutdown")
     async def _shutdown() -> None:
+        await close_cosmosdb(app)
         stop_opentelemetry(app)
 
     return _shutdown